@@ -6,11 +6,11 @@
 # requested symbolication data is in the cache, it will be returned from it. If
 # not, the needed file will be retrieved and added to the cache.
 #
-# This cache uses a LRU eviction policy.
+# The eviction policy of this cache is configurable. It uses LRU by default.
 ################################################################################
 from logger import logger, logLevel
 from DiskCache_Config import config
-from DiskCache_RequestHandler import RequestHandler
+from DiskCache_RequestHandler import RequestHandler, StatusHandler
 
 import sys
 import os
@@ -86,7 +86,7 @@ def runServer():
         maxFileBytes=config["log"]["maxFileSizeMB"] * 1024 * 1024
     )
     logger.log(logLevel.INFO, "Configuration loaded: {}".format(config))
-    app = tornado.web.Application([(r"/", RequestHandler)])
+    app = tornado.web.Application([(r"/", RequestHandler), (r"/status", StatusHandler)])
     app.listen(config['port'])
     tornado.ioloop.IOLoop.current().start()
 
@@ -7,15 +7,37 @@ class Config(dict):
     def __init__(self, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
         # Load defaults:
+        self['batching'] = {
+            'windowMs': 0,
+            'maxRequests': 0
+        }
         self['cachePath'] = os.path.realpath("./DiskCacheData")
+        self['downloadThreads'] = 4
         self['localSymbolDirs'] = []
+        self['localSymbolRescanSec'] = 60
+        self['maxQueuedRequests'] = 0
         self['maxSizeMB'] = 200
+        self['memoryCacheMB'] = 64
+        self['manifestIntervalSec'] = 60
+        self['parseProcesses'] = 2
+        self['parseTimeoutSec'] = 300
         self['port'] = 8888
         self['retries'] = 3
         self['retryDelayMs'] = 500
         self['symbolURLs'] = [
             "https://s3-us-west-2.amazonaws.com/org.mozilla.crash-stats.symbols-public/v1/"
         ]
+        self['eviction'] = {
+            'policy': "lru",
+            'tinyLFUWindowPercent': 10,
+            'highWatermarkPercent': 100,
+            'lowWatermarkPercent': 90
+        }
+        self['negativeCache'] = {
+            'maxEntries': 10000,
+            'notFoundTTLSec': 3600,
+            'errorTTLSec': 60
+        }
         self['log'] = {
             'path': "DiskCache.log",
             'level': 30,
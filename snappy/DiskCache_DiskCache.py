@@ -1,20 +1,40 @@
 from logger import logger, logLevel
 from DiskCache_Config import config
+from DiskCache_SymbolIndex import SymbolIndex, isSymbolIndex, upgradeSymMapV1
+from DiskCache_SymbolIndex import buildSymbolIndex, lookupRawSymbols
+from DiskCache_Manifest import CacheManifest
+from DiskCache_LocalSymbols import LocalSymbolDirs
+from DiskCache_EvictionPolicy import makeEvictionPolicy
+from DiskCache_Reaper import CacheReaper
+from DiskCache_ParsePool import ParsePool
 
 import sys
 import os
 import threading
-from concurrent.futures import Future
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
 import Queue
+import tornado.ioloop
 import traceback
 import urllib
 import urllib2
 import contextlib
-from StringIO import StringIO
-import gzip
+import zlib
 import time
 import collections
-import errno
+import hashlib
+import shutil
+import uuid
+import heapq
+import itertools
+from functools import partial
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Directory, relative to the cache path, holding indexes built from the files in
+# the local symbol directories
+LOCAL_SIDECAR_DIR = ".local"
+# Directory, relative to the cache path, that files are downloaded to
+DOWNLOAD_DIR = ".downloads"
 
 
 class DiskCache:
@@ -23,26 +43,46 @@ class DiskCache:
         self.diskCacheThread = DiskCacheThread(self.workQueue)
         self.diskCacheStarted = False
 
-    def request(self, request, id):
+    def request(self, request, id, deadline=None):
+        """ Returns a Future for the response to |request|. If |deadline| (a time
+        as returned by |time.time|) passes before the response is complete, the
+        Future gets what could be resolved until then.
+        """
         if not self.diskCacheStarted:
             self.diskCacheStarted = True
+            # The parse processes are forked before any other threads are started
+            # so that they cannot inherit a lock held by one of those threads
+            if config['parseProcesses'] > 0:
+                self.diskCacheThread.parsePool = ParsePool(config['parseProcesses'],
+                                                           config['parseTimeoutSec'])
+            self.diskCacheThread.ioLoop = tornado.ioloop.IOLoop.current()
             self.diskCacheThread.start()
 
         future = Future()
         response = self.makeResponseTemplate(request)
-        workObject = [str(id), request, response, future]
+        workItem = WorkItem(str(id), request, response, future, deadline)
 
-        self.workQueue.put(workObject)
+        self.workQueue.put(workItem)
         logger.log(logLevel.DEBUG,
                    "{} Work submitted to DiskCache thread".format(id))
 
         return future
 
+    def cancel(self, future):
+        """ Stops work on the request that |future| was returned for, because
+        nobody is waiting for its response any more.
+        """
+        if future.done() or future.cancel():
+            return
+        # The DiskCache thread has already started on the request
+        self.workQueue.put(Cancellation(future))
+
     def makeResponseTemplate(self, request):
         if 'debug' in request:
             return {}
         response = {
             'symbolicatedStacks': [],
+            'symbolRanges': [],
             'knownModules': [False] * len(request['memoryMap'])
         }
         memoryMap = request['memoryMap']
@@ -52,6 +92,7 @@ class DiskCache:
                 module = memoryMap[frameModuleIndex][0]
                 responseStack.append("{} (in {})".format(hex(frameOffset), module))
             response['symbolicatedStacks'].append(responseStack)
+            response['symbolRanges'].append([None] * len(stack))
         return response
 
 
@@ -59,189 +100,566 @@ class DiskCacheThread(threading.Thread):
     def __init__(self, workQueue):
         threading.Thread.__init__(self)
         self.asyncWorkQueue = workQueue
-        # The Queue type of queue only allows items to be put in and pulled out
-        # I want to concurrency benefits associated with the Queue, but I also want
-        # to be able to examine other enqueued work while working. Therefore we will
-        # transfer work items from the Queue to a regular list
-        self.workQueue = []
+        # Requests arrive on the Queue, and download workers post their results
+        # to it too. Requests that are waiting for symbol files to be downloaded
+        # are indexed by the |libName, breakpadId| of the modules they are
+        # waiting for, so that they can be found when a download finishes.
+        self.pendingWork = {}
+        # Maps |libName, breakpadId| of the modules that are being downloaded to
+        # the Future of their download job
+        self.downloads = {}
+        # Heap of |deadline, sequence number, WorkItem| of the requests that have
+        # a deadline
+        self.deadlines = []
+        self.deadlineSequence = itertools.count()
+        # The IOLoop that posts Wakeups to the async queue, and the time of the
+        # earliest Wakeup that it has been asked to post and has not posted yet.
+        # Set up by DiskCache before this thread is started.
+        self.ioLoop = None
+        self.nextWakeup = None
+        self.downloadPool = None
+        self.downloadDir = None
+        # Symbol files are parsed in these processes so that parsing does not
+        # hold the GIL. Set up by DiskCache before this thread is started.
+        self.parsePool = None
         # config may not be loaded during __init__. Initialize data from config in
         # self.run()
         self.symbolURLs = []
         self.cache = None  # LRUCache also needs config
-        self.staticCache = {}
+        self.memoryCache = None  # As does SymbolTableCache
+        self.localSymbols = None  # As does LocalSymbolDirs
+        self.negativeCache = None  # As does NegativeCache
+        self.batchStats = None
+        # Maps the path of each local symbol file that an index has been built for
+        # to the path of that index
+        self.staticSidecars = {}
+        # Maps the path of each local symbol file that could not be indexed to
+        # the path its index would have had, which changes along with the file,
+        # so that it is read directly rather than indexed again for every request
+        self.failedSidecars = {}
 
     def init(self):
         if not os.path.exists(config['cachePath']):
             os.makedirs(config['cachePath'])
         self.symbolURLs = config['symbolURLs']
-        self.cache = LRUCache()
+        # Downloads are written to this directory until they are complete. Anything
+        # still in it was left behind by a download that never finished.
+        self.downloadDir = os.path.join(config['cachePath'], DOWNLOAD_DIR)
+        if os.path.exists(self.downloadDir):
+            shutil.rmtree(self.downloadDir)
+        os.makedirs(self.downloadDir)
+        self.downloadPool = ThreadPoolExecutor(max_workers=config['downloadThreads'])
+        self.negativeCache = NegativeCache()
+        self.batchStats = BatchStats()
+        self.memoryCache = SymbolTableCache()
+        self.cache = LRUCache(onEvict=self.memoryCache.evict)
         self.loadCache()
-        self.loadStaticCache()
+        self.localSymbols = LocalSymbolDirs(config['localSymbolDirs'],
+                                            config['localSymbolRescanSec'])
 
     def loadCache(self):
+        entries = self.cache.manifest.load()
+        if entries is not None:
+            self.cache.load(entries)
+            logger.log(logLevel.INFO, "Loaded {} cache entries from the manifest"
+                       .format(len(entries)))
+            return
+
+        # No usable manifest. Find the cache files by walking the cache directory
+        # and approximate their LRU order from their access and modification times.
         cacheDir = config['cachePath']
+        entries = []
         for root, dirs, files in os.walk(cacheDir):
             for file in files:
                 path = os.path.join(root, file)
-                self.cache.add(path)
-
-    def loadStaticCache(self):
-        # Load from directories in reverse order so that directories listed earlier
-        # overwrite entries from directories listed later.
-        for cacheDir in reversed(config['localSymbolDirs']):
-            for root, dirs, files in os.walk(cacheDir):
-                relRoot = os.path.relpath(root, cacheDir)
-                for file in files:
-                    relPath = os.path.join(relRoot, file)
-                    path = os.path.join(root, file)
-                    self.staticCache[relPath] = path
+                if self.cache.manifest.isManifestFile(path):
+                    continue
+                if path.endswith(".tmp"):
+                    # Left over from a file that was never finished
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                entries.append((path, diskUsage(stat), max(stat.st_atime, stat.st_mtime)))
+        entries.sort(key=lambda entry: entry[2])
+        self.cache.load(entries)
+        self.cache.checkpoint(force=True)
+        logger.log(logLevel.INFO, "Loaded {} cache entries from the cache directory"
+                   .format(len(entries)))
 
     def run(self):
         self.init()
 
         while True:
-            id = "XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX"
-            future = None
-            with self.firstCacheItem():     # Make SURE that we pop the first cache item
-                                            # off the work queue even if we fail. We don't
-                                            # want to keep processing it over and over.
-                try:
-                    self.transferWorkQueue(needOne=True)
-                    id, request, response, future = self.workQueue[0]
-                    runIt = future.set_running_or_notify_cancel()
-                    if not runIt:
-                        logger.log(logLevel.DEBUG, "{} Thread work was cancelled".format(id))
-                        continue
-
-                    logger.log(logLevel.DEBUG, "{} Thread got work".format(id))
-                    if 'debug' in request:
-                        response = self.doDebugWork()
-                    else:
-                        response = self.symbolicateFirstQueueEntry()
-                    logger.log(logLevel.DEBUG, "{} Thread work done".format(id))
-
-                    future.set_result(response)
-                except Exception as e:
-                    ex_type, ex, tb = sys.exc_info()
-                    stack = traceback.extract_tb(tb)
-                    logger.log(logLevel.ERROR,
-                               "{} Thread caught exception while working: {}: {} STACK: {}"
-                               .format(id, ex_type, e, stack))
-                    if future:
-                        future.set_exception(e)
+            # Responses to the last batch of work have been sent, so now is the
+            # time for housekeeping
+            self.cache.evictIfFull()
+            self.cache.checkpoint()
+            newWork = []
+            for item in self.getWork():
+                if isinstance(item, DownloadResult):
+                    self.finishDownload(item)
                     continue
+                if isinstance(item, Cancellation):
+                    self.cancelWork(item.future)
+                    continue
+                if not item.future.set_running_or_notify_cancel():
+                    logger.log(logLevel.DEBUG, "{} Thread work was cancelled".format(item.id))
+                    continue
+                logger.log(logLevel.DEBUG, "{} Thread got work".format(item.id))
+                if 'debug' in item.request:
+                    self.doWork(self.doDebugRequests, [item])
+                else:
+                    newWork.append(item)
+            if newWork:
+                # Requests that arrived together are started together so that
+                # modules that they have in common are only read once
+                self.doWork(self.startWork, newWork)
+            self.expireWork()
 
-    @contextlib.contextmanager
-    def firstCacheItem(self):
-        yield
-        self.workQueue.pop(0)
+    # Calls |function| with |workItems|. If that fails, all of |workItems| that
+    # have not been completed yet fail with the exception
+    def doWork(self, function, workItems):
+        try:
+            function(workItems)
+        except Exception as e:
+            ex_type, ex, tb = sys.exc_info()
+            stack = traceback.extract_tb(tb)
+            logger.log(logLevel.ERROR,
+                       "Thread caught exception while working: {}: {} STACK: {}"
+                       .format(ex_type, e, stack))
+            for workItem in workItems:
+                if workItem.future.done():
+                    continue
+                self.forgetWork(workItem)
+                workItem.future.set_exception(e)
 
-    def transferWorkQueue(self, needOne=False):
-        if len(self.workQueue) > 0 and needOne:
-            # We need one, but we already have one!
-            needOne = False
+    # Blocks until there is something in the async queue, then returns a list of
+    # everything that is in it. If batching is configured, keeps collecting
+    # requests for up to |batching.windowMs| after the first one, or until there
+    # are |batching.maxRequests| of them, so that they are started together.
+    # Returns an empty list if nothing arrives before the next deadline of a
+    # request or before the cache manifest is due to be checkpointed.
+    # The queue is only ever waited on without a timeout: on Python 2, a wait
+    # with a timeout polls, and would delay every request that arrives while the
+    # thread is idle. Instead, the IOLoop wakes the thread up when it is time
+    # (see |wakeAt|).
+    def getWork(self):
+        wakeTime = time.time() + config['manifestIntervalSec']
+        if self.deadlines:
+            wakeTime = min(wakeTime, self.deadlines[0][0])
+        self.wakeAt(wakeTime)
+        items = [self.asyncWorkQueue.get()]
+        items.extend(self.drainAsyncQueue())
 
-        workObj = self.getFromAsyncQueue(block=needOne)
-        while workObj:
-            self.workQueue.append(workObj)
-            workObj = self.getFromAsyncQueue(block=False)
+        windowSec = config['batching']['windowMs'] / 1000.0
+        maxRequests = config['batching']['maxRequests']
+        requestCount = sum(1 for item in items if isinstance(item, WorkItem))
+        if windowSec > 0 and requestCount > 0:
+            windowEnd = time.time() + windowSec
+            self.wakeAt(windowEnd)
+            while ((not maxRequests or requestCount < maxRequests) and
+                   time.time() < windowEnd):
+                item = self.asyncWorkQueue.get()
+                items.append(item)
+                if isinstance(item, WorkItem):
+                    requestCount += 1
+        return [queued for queued in items if not self.isWakeup(queued)]
 
-    def getFromAsyncQueue(self, block):
-        try:
-            item = self.asyncWorkQueue.get(block=block)
-        except Queue.Empty:
-            item = None
-        return item
-
-    # Symbolicates the first request in the queue and returns a response. Also
-    # symbolicates any frames from other requests if they use the same file so
-    # that we don't have to re-read the whole symbol file again when we get to
-    # the next request
-    # Assumes that the first request in the queue is not a debug request
-    def symbolicateFirstQueueEntry(self):
-        id, request, response, future = self.workQueue[0]
-        for moduleIndex, module in enumerate(request['memoryMap']):
-            libName, breakpadId = module
-
-            if response['knownModules'][moduleIndex]:
-                # Frames in this module were already symbolicated
-                continue
+    # Returns everything that is in the async queue without blocking
+    def drainAsyncQueue(self):
+        items = []
+        while True:
+            try:
+                items.append(self.asyncWorkQueue.get(block=False))
+            except Queue.Empty:
+                return items
 
-            # Find frames from all requests that use this module
-            frameIndicies, offsets = self.findAllFramesReferencingModule(moduleIndex,
-                                                                         libName,
-                                                                         breakpadId)
-            if not offsets:
-                continue
+    # Makes sure that a Wakeup is posted to the async queue by |wakeTime|. The
+    # IOLoop posts it, since its timers do not poll.
+    def wakeAt(self, wakeTime):
+        if self.nextWakeup is not None and self.nextWakeup <= wakeTime:
+            return
+        self.nextWakeup = wakeTime
+        self.ioLoop.add_callback(self.ioLoop.add_timeout, wakeTime, self.asyncWorkQueue.put,
+                                 Wakeup(wakeTime))
 
-            # Get symbol file from cache or add it to the cache
-            path = self.getFile(libName, breakpadId)
-            if not path:
-                # Hmm. Looks like we couldn't get these symbols.
+    def isWakeup(self, item):
+        if not isinstance(item, Wakeup):
+            return False
+        if item.time == self.nextWakeup:
+            self.nextWakeup = None
+        return True
+
+    # Symbolicates every module of the new requests in |workItems| whose symbol
+    # file is available now, and starts downloads for the rest. The requests
+    # wait in |pendingWork| until all of their modules have been resolved.
+    def startWork(self, workItems):
+        # Maps each module to the new requests that have frames in it
+        modules = collections.OrderedDict()
+        for workItem in workItems:
+            workItem.moduleFrames = self.indexFrames(workItem.request)
+            workItem.pendingModules = set(workItem.moduleFrames)
+            for module in workItem.moduleFrames:
+                modules.setdefault(module, []).append(workItem)
+        self.batchStats.addBatch(len(workItems))
+
+        for (libName, breakpadId), moduleWork in modules.iteritems():
+            if (libName, breakpadId) in self.downloads:
+                # The requests will be completed when the download finishes
+                self.pendingWork.setdefault((libName, breakpadId), []).extend(moduleWork)
                 continue
+            path = self.getCachedFile(libName, breakpadId)
+            sourcePath = None
+            if not path:
+                sourcePath, sidecarPath = self.findLocalFile(libName, breakpadId)
+                if sourcePath and self.failedSidecars.get(sourcePath) == sidecarPath:
+                    path = sourcePath
+                elif sourcePath and self.cache.retrieve(sidecarPath):
+                    path = sidecarPath
+            if path:
+                self.resolveModule(libName, breakpadId, path, moduleWork)
+            elif sourcePath:
+                self.startJob(libName, breakpadId, self.indexLocalFile, libName, breakpadId,
+                              sourcePath, sidecarPath)
+                self.pendingWork[(libName, breakpadId)] = moduleWork
+            elif not self.symbolURLs:
+                # There is nowhere to download symbol files from
+                self.resolveModule(libName, breakpadId, None, moduleWork)
+            elif self.negativeCache.contains(libName, breakpadId):
+                logger.log(logLevel.DEBUG, "Symbols for {}/{} are known to be unavailable"
+                           .format(libName, breakpadId))
+                self.resolveModule(libName, breakpadId, None, moduleWork)
+            else:
+                self.startJob(libName, breakpadId, self.downloadToTempFile, libName, breakpadId)
+                self.pendingWork[(libName, breakpadId)] = moduleWork
+        self.completeFinishedWork(workItems)
+        for workItem in workItems:
+            if workItem.deadline is not None and not workItem.future.done():
+                heapq.heappush(self.deadlines, (workItem.deadline, next(self.deadlineSequence),
+                                                workItem))
 
-            symbols = self.getSymbols(path, offsets)
-            for workIndex, stackIndex, frameIndex, moduleIndex, frameOffset in frameIndicies:
-                if frameOffset not in symbols:
+    # Returns a dictionary mapping the |libName, breakpadId| of each module that
+    # frames of |request| are in to a list of those frames, each given as a
+    # tuple: |stackIndex, frameIndex, moduleIndex, frameOffset|. Frames whose module
+    # index is out of range, such as -1, are not in any module and are left out.
+    def indexFrames(self, request):
+        memoryMap = request['memoryMap']
+        moduleFrames = {}
+        for stackIndex, stack in enumerate(request['stacks']):
+            for frameIndex, frame in enumerate(stack):
+                moduleIndex, frameOffset = frame
+                if moduleIndex < 0 or moduleIndex >= len(memoryMap):
+                    # The frame is not in any module
                     continue
-                workResponse = self.workQueue[workIndex][2]
-                workResponse['symbolicatedStacks'][stackIndex][frameIndex] = \
-                    symbols[frameOffset] + " (in {})".format(libName)
-                workResponse['knownModules'][moduleIndex] = True
-            # A significant amount of time may have passed while retrieving that
-            # symbol file. If we added new things to the work queue now, we may be
-            # able to consolidate requests for the same file later.
-            self.transferWorkQueue()
-        return self.workQueue[0][2]
-
-    def findAllFramesReferencingModule(self, moduleIndex, libName, breakpadId):
-        """ moduleIndex is the index of the module in the memory map of the request
-        at the head of the work queue.
-        """
-        frameIndicies = []
+                libName, breakpadId = memoryMap[moduleIndex]
+                moduleFrames.setdefault((libName, breakpadId), []).append(
+                    (stackIndex, frameIndex, moduleIndex, frameOffset))
+        return moduleFrames
+
+    # Resolves the frames of |workItems| that are in the given module using the
+    # symbol file at |path|, or leaves them unresolved if |path| is |None|.
+    # Either way, the module is no longer pending for those requests, unless
+    # |path| is a raw symbol file. Then it is read on a download worker and the
+    # requests wait in |pendingWork| until that is done.
+    def resolveModule(self, libName, breakpadId, path, workItems):
+        module = (libName, breakpadId)
         offsets = set()
-        for workIndex, workObj in enumerate(self.workQueue):
-            id, request, response, future = workObj
-            if 'debug' in request:
-                continue
-            memoryMap = request['memoryMap']
-            stacks = request['stacks']
-            if workIndex > 0:
-                for m_index, module in enumerate(memoryMap):
-                    m_libName, m_breakpadId = module
-                    if m_libName == libName and m_breakpadId == breakpadId:
-                        moduleIndex = m_index
-                        break
-                else:
-                    # This module is not in this request. Skip to the next request
+        for workItem in workItems:
+            for stackIndex, frameIndex, moduleIndex, frameOffset in workItem.moduleFrames[module]:
+                offsets.add(frameOffset)
+        symbols = {}
+        if path:
+            symbols = self.getSymbols(path, list(offsets))
+            if symbols is None:
+                # A raw symbol file, which has to be parsed to find anything in
+                # it. That is done on a download worker, like indexing.
+                self.startJob(libName, breakpadId, self.lookUpRawFile, libName, breakpadId,
+                              path, list(offsets))
+                self.pendingWork.setdefault(module, []).extend(workItems)
+                return
+            self.batchStats.addRead(len(workItems))
+        self.applySymbols(libName, breakpadId, symbols, workItems)
+
+    # Resolves the frames of |workItems| that are in the given module with
+    # |symbols|, as returned by |getSymbols|, and marks the module as no longer
+    # pending for those requests
+    def applySymbols(self, libName, breakpadId, symbols, workItems):
+        module = (libName, breakpadId)
+        for workItem in workItems:
+            workItem.pendingModules.discard(module)
+            response = workItem.response
+            for stackIndex, frameIndex, moduleIndex, frameOffset in workItem.moduleFrames[module]:
+                if frameOffset not in symbols:
                     continue
-            for stackIndex, stack in enumerate(stacks):
-                for frameIndex, frame in enumerate(stack):
-                    frameModuleIndex, frameOffset = frame
-                    if frameModuleIndex == moduleIndex:
-                        frameIndicies.append((workIndex, stackIndex, frameIndex,
-                                             moduleIndex, frameOffset))
-                        offsets.add(frameOffset)
-        return frameIndicies, list(offsets)
+                symbol, start, end = symbols[frameOffset]
+                response['symbolicatedStacks'][stackIndex][frameIndex] = \
+                    symbol + " (in {})".format(libName)
+                response['symbolRanges'][stackIndex][frameIndex] = [start, end]
+                response['knownModules'][moduleIndex] = True
+
+    # Resolves the futures of the requests in |workItems| that have no pending
+    # modules left
+    def completeFinishedWork(self, workItems):
+        for workItem in workItems:
+            if workItem.pendingModules or workItem.future.done():
+                continue
+            logger.log(logLevel.DEBUG, "{} Thread work done".format(workItem.id))
+            workItem.future.set_result(workItem.response)
+
+    # Removes a request that failed from |pendingWork|
+    def forgetWork(self, workItem):
+        for module in workItem.pendingModules:
+            moduleWork = self.pendingWork.get(module, [])
+            if workItem in moduleWork:
+                moduleWork.remove(workItem)
+
+    # Stops working on a request that is no longer wanted. Downloads that no
+    # other request is waiting for are cancelled unless they have started.
+    def abandonWork(self, workItem):
+        self.forgetWork(workItem)
+        for module in workItem.pendingModules:
+            if self.pendingWork.get(module):
+                continue
+            job = self.downloads.get(module)
+            if job and job.cancel():
+                logger.log(logLevel.DEBUG, "Cancelled download of {}/{}".format(*module))
+                del self.downloads[module]
+                self.pendingWork.pop(module, None)
+        workItem.pendingModules.clear()
+
+    # Called with the Future of a request whose client went away after the
+    # request was started
+    def cancelWork(self, future):
+        if future.done():
+            return
+        for moduleWork in self.pendingWork.itervalues():
+            for workItem in moduleWork:
+                if workItem.future is future:
+                    logger.log(logLevel.INFO, "{} Request cancelled with {} modules pending"
+                               .format(workItem.id, len(workItem.pendingModules)))
+                    self.abandonWork(workItem)
+                    # The response is not going anywhere, but whoever is waiting
+                    # on the Future still needs it to be resolved
+                    workItem.future.set_result(workItem.response)
+                    return
+
+    # Sends what has been resolved so far to the requests whose deadline has
+    # passed
+    def expireWork(self):
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, sequence, workItem = heapq.heappop(self.deadlines)
+            if workItem.future.done():
+                continue
+            logger.log(logLevel.INFO,
+                       "{} Deadline passed with {} modules pending. Sending partial response"
+                       .format(workItem.id, len(workItem.pendingModules)))
+            self.abandonWork(workItem)
+            workItem.future.set_result(workItem.response)
+
+    # Starts getting the symbol file of a module on a download worker unless it
+    # is already being downloaded. The worker calls |function| with |args|, which
+    # must return a DownloadResult, and posts the result to the async queue.
+    def startJob(self, libName, breakpadId, function, *args):
+        key = (libName, breakpadId)
+        if key in self.downloads:
+            return
+        logger.log(logLevel.DEBUG, "Starting job for {}/{}".format(libName, breakpadId))
+        self.downloads[key] = self.downloadPool.submit(self.downloadWorker, libName,
+                                                       breakpadId, function, *args)
+
+    # Runs on a download worker thread. Nothing but the download itself may be
+    # done here: the cache and everything else belong to the DiskCacheThread.
+    def downloadWorker(self, libName, breakpadId, function, *args):
+        try:
+            result = function(*args)
+        except Exception as e:
+            ex_type, ex, tb = sys.exc_info()
+            stack = traceback.extract_tb(tb)
+            logger.log(logLevel.ERROR,
+                       "Exception when downloading {}/{}: {}: {} STACK: {}"
+                       .format(libName, breakpadId, ex_type, e, stack))
+            result = DownloadResult(libName, breakpadId, None, None, False)
+        self.asyncWorkQueue.put(result)
+
+    # Called on the DiskCacheThread with the DownloadResult of a download worker.
+    # Adds the file to the cache and resolves the module for every request that
+    # is waiting for it.
+    def finishDownload(self, result):
+        libName = result.libName
+        breakpadId = result.breakpadId
+        self.downloads.pop((libName, breakpadId), None)
+        waiting = self.pendingWork.pop((libName, breakpadId), [])
+
+        def finish(workItems):
+            if result.symbols is not None:
+                self.finishRawLookup(result, workItems)
+            else:
+                path = self.addResultFile(result)
+                self.resolveModule(libName, breakpadId, path, workItems)
+            self.completeFinishedWork(workItems)
+        self.doWork(finish, waiting)
+
+    # Resolves the frames of |workItems| with the symbols that a download worker
+    # looked up in a raw symbol file. Requests that started waiting for the
+    # lookup after it was started may have frames that were not looked up, so
+    # the file is looked up again for those.
+    def finishRawLookup(self, result, workItems):
+        module = (result.libName, result.breakpadId)
+        lookedUp = []
+        notLookedUp = []
+        for workItem in workItems:
+            if all(frameOffset in result.offsets
+                   for stackIndex, frameIndex, moduleIndex, frameOffset
+                   in workItem.moduleFrames[module]):
+                lookedUp.append(workItem)
+            else:
+                notLookedUp.append(workItem)
+        if lookedUp:
+            self.applySymbols(result.libName, result.breakpadId, result.symbols, lookedUp)
+            self.batchStats.addRead(len(lookedUp))
+        if notLookedUp:
+            self.resolveModule(result.libName, result.breakpadId, result.destPath, notLookedUp)
+
+    # Adds the file of a DownloadResult to the cache. Returns the path that the
+    # module's symbols should be read from, or |None| if there is none.
+    def addResultFile(self, result):
+        if result.tempPath:
+            path = self.addDownloadedFile(result.tempPath, result.destPath)
+            if path and result.sourcePath:
+                self.staticSidecars[result.sourcePath] = path
+            if path:
+                return path
+        if result.sourcePath:
+            # The local symbol file could not be indexed. Read it directly instead
+            if not result.tempPath:
+                self.failedSidecars[result.sourcePath] = result.destPath
+            return result.sourcePath
+        if not result.tempPath and self.symbolURLs:
+            # Remember that we could not get this file so that we don't try
+            # again for every request that needs it
+            self.negativeCache.add(result.libName, result.breakpadId,
+                                   notFound=result.retrieved)
+        return None
 
     # If the file is in the cache, its path is returned. Otherwise the file is
-    # added to the cache.
+    # added to the cache. Blocks while the file is downloaded or indexed.
     def getFile(self, libName, breakpadId):
+        path = self.getCachedFile(libName, breakpadId)
+        if path:
+            return path
+
+        sourcePath, sidecarPath = self.findLocalFile(libName, breakpadId)
+        if sourcePath:
+            if self.failedSidecars.get(sourcePath) == sidecarPath:
+                return sourcePath
+            if self.cache.retrieve(sidecarPath):
+                return sidecarPath
+            return self.addResultFile(self.indexLocalFile(libName, breakpadId, sourcePath,
+                                                          sidecarPath))
+
+        if not self.symbolURLs:
+            return None
+        if self.negativeCache.contains(libName, breakpadId):
+            logger.log(logLevel.DEBUG, "Symbols for {}/{} are known to be unavailable"
+                       .format(libName, breakpadId))
+            return None
+
+        return self.downloadToCache(libName, breakpadId)
+
+    # Returns the path of the symbol file of a module if it is in the cache.
+    # Otherwise returns |None|.
+    def getCachedFile(self, libName, breakpadId):
+        cachePath = self.getCachePath(libName, breakpadId)
+        if self.cache.retrieve(cachePath):
+            return cachePath
+        return None
+
+    def getCachePath(self, libName, breakpadId):
         symbolFilename = self.getSymbolFileName(libName)
         relPath = self.getSymbolFileRelPath(libName, breakpadId, symbolFilename)
+        return os.path.join(config['cachePath'], relPath)
 
-        cachePath = os.path.join(config['cachePath'], relPath)
-        cacheResult = self.cache.retrieve(cachePath)
-        if cacheResult:
-            return cachePath
+    # Looks for the symbol file of a module in the local symbol directories.
+    # Returns a tuple: |sourcePath, sidecarPath|
+    # |sourcePath| is the path of the local symbol file, or |None| if there is
+    # none. |sidecarPath| is where the index of that file is kept in the cache.
+    # Indexes are kept in the cache like downloaded files, under a name that
+    # changes whenever the local file is modified.
+    def findLocalFile(self, libName, breakpadId):
+        symbolFilename = self.getSymbolFileName(libName)
+        relPath = self.getSymbolFileRelPath(libName, breakpadId, symbolFilename)
+        sourcePath = self.localSymbols.find(relPath)
+        if not sourcePath:
+            return None, None
+        try:
+            stat = os.stat(sourcePath)
+        except OSError as e:
+            logger.log(logLevel.ERROR, "Unable to stat local symbol file {}: {}"
+                       .format(sourcePath, e))
+            self.localSymbols.forget(relPath)
+            return None, None
+        sourceHash = hashlib.sha1(sourcePath).hexdigest()
+        sidecarName = "{}-{}-{}.sym".format(sourceHash, int(stat.st_mtime * 1000), stat.st_size)
+        sidecarPath = os.path.join(config['cachePath'], LOCAL_SIDECAR_DIR, libName,
+                                   breakpadId, sidecarName)
 
-        if relPath in self.staticCache:
-            return self.staticCache[relPath]
+        oldSidecarPath = self.staticSidecars.get(sourcePath)
+        if oldSidecarPath and oldSidecarPath != sidecarPath:
+            logger.log(logLevel.INFO, "Local symbol file {} changed".format(sourcePath))
+            self.cache.evict(oldSidecarPath)
+            del self.staticSidecars[sourcePath]
+        if self.failedSidecars.get(sourcePath, sidecarPath) != sidecarPath:
+            logger.log(logLevel.INFO, "Local symbol file {} changed. Indexing it again"
+                       .format(sourcePath))
+            del self.failedSidecars[sourcePath]
+        return sourcePath, sidecarPath
 
-        if self.downloadToCache(libName, breakpadId, symbolFilename, cachePath):
-            return cachePath
+    # Builds an index of the local symbol file at |sourcePath| in the download
+    # directory and returns a DownloadResult for it. Like |downloadToTempFile|,
+    # this is safe to call from a download worker.
+    def indexLocalFile(self, libName, breakpadId, sourcePath, sidecarPath):
+        logger.log(logLevel.INFO, "Building index of local symbol file {}".format(sourcePath))
+        tempPath = self.makeDownloadPath()
+        success = False
+        try:
+            self.runParseJob(buildSymbolIndex, sourcePath, tempPath, sourcePath)
+            success = True
+        except (OSError, IOError) as e:
+            logger.log(logLevel.ERROR, "Failed to index local symbol file {}: {}"
+                       .format(sourcePath, e))
+        except multiprocessing.TimeoutError:
+            logger.log(logLevel.ERROR, "Timed out indexing local symbol file {}"
+                       .format(sourcePath))
+        if not success and os.path.exists(tempPath):
+            os.remove(tempPath)
+        return DownloadResult(libName, breakpadId, tempPath if success else None, sidecarPath,
+                              True, sourcePath=sourcePath)
 
-        return None
+    # Looks up |offsets| in the raw symbol file at |path| and returns a
+    # DownloadResult holding the symbols. Safe to call from a download worker.
+    def lookUpRawFile(self, libName, breakpadId, path, offsets):
+        symbols = {}
+        try:
+            symbols = self.runParseJob(lookupRawSymbols, path, offsets)
+        except multiprocessing.TimeoutError:
+            logger.log(logLevel.ERROR, "Timed out reading symbols from {}".format(path))
+        except Exception as e:
+            ex_type, ex, tb = sys.exc_info()
+            stack = traceback.extract_tb(tb)
+            logger.log(logLevel.ERROR,
+                       "Exception when reading symbols from {}: {} STACK: {}"
+                       .format(path, e, stack))
+        return DownloadResult(libName, breakpadId, None, path, True, symbols=symbols,
+                              offsets=set(offsets))
+
+    # Runs |function| with |args| in the parse pool and returns its result, or
+    # runs it on the calling thread if there is no parse pool. |function| must be
+    # a module level function so that it can be sent to the pool.
+    def runParseJob(self, function, *args):
+        if not self.parsePool:
+            return function(*args)
+        return self.parsePool.run(function, args)
 
     def getSymbolFileName(self, libName):
         if libName.endswith(".pdb"):
@@ -252,37 +670,91 @@ class DiskCacheThread(threading.Thread):
         path = os.path.join(libName, breakpadId, fileName)
         return path
 
-    def downloadToCache(self, libName, breakpadId, symbolFilename, destPath, saveRaw=False):
-        success, data = self.retrieveFile(libName, breakpadId, symbolFilename)
-        if not success:
-            return False
+    # Downloads a symbol file and adds it to the cache. Returns the path of the
+    # file in the cache, or |None| if it could not be downloaded.
+    def downloadToCache(self, libName, breakpadId, saveRaw=False):
+        return self.addResultFile(self.downloadToTempFile(libName, breakpadId, saveRaw))
 
-        if not saveRaw:
-            libId = "{}/{}/{}".format(libName, breakpadId, symbolFilename)
-            data = data.splitlines()
-            data = self.makeSymMap(data, libId)
+    # Downloads a symbol file to a temporary file in the download directory and
+    # returns a DownloadResult. Unless |saveRaw| is set, the downloaded file is
+    # then replaced by its index, which is built in the parse pool. This does
+    # not touch the cache, so it is safe to call from a download worker.
+    def downloadToTempFile(self, libName, breakpadId, saveRaw=False):
+        symbolFilename = self.getSymbolFileName(libName)
+        libId = "{}/{}/{}".format(libName, breakpadId, symbolFilename)
+        destPath = self.getCachePath(libName, breakpadId)
+        tempPath = self.makeDownloadPath()
+        indexPath = None
+        success = False
+        retrieved = False
         try:
-            destDir = os.path.dirname(destPath)
-            if not os.path.exists(destDir):
-                os.makedirs(destDir)
-            with open(destPath, 'wb') as fp:
-                fp.write(data)
+            with open(tempPath, 'wb') as fp:
+                retrieved, exists, sink = self.retrieveFile(libName, breakpadId, symbolFilename,
+                                                            partial(RawFileSink, fp))
+            success = retrieved and exists
+            if success and not saveRaw:
+                indexPath = self.makeDownloadPath()
+                self.runParseJob(buildSymbolIndex, tempPath, indexPath, libId)
+                os.remove(tempPath)
+                tempPath, indexPath = indexPath, None
         except (OSError, IOError) as e:
             logger.log(logLevel.ERROR, "Failed to write file {}: {}".format(destPath, e))
-            return False
+            success = False
+            retrieved = False
+        except multiprocessing.TimeoutError:
+            logger.log(logLevel.ERROR, "Timed out parsing symbol file {}".format(libId))
+            success = False
+            retrieved = False
+        finally:
+            if indexPath and os.path.exists(indexPath):
+                os.remove(indexPath)
+            if not success and os.path.exists(tempPath):
+                os.remove(tempPath)
+        return DownloadResult(libName, breakpadId, tempPath if success else None, destPath,
+                              retrieved)
+
+    # Returns a unique path in the download directory
+    def makeDownloadPath(self):
+        return os.path.join(self.downloadDir, uuid.uuid4().hex + ".tmp")
+
+    # Moves a downloaded file to |destPath| in the cache directory and adds it to
+    # the cache, replacing any file that was already there. Returns |destPath|,
+    # or |None| on failure.
+    def addDownloadedFile(self, tempPath, destPath):
+        destDir = os.path.dirname(destPath)
+        self.cache.evict(destPath)
+        try:
+            self.cache.reaper.moveIntoCache(tempPath, destPath)
+        except OSError as e:
+            logger.log(logLevel.ERROR, "Failed to write file {}: {}".format(destPath, e))
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+            self.cache.reaper.removeEmptyDirs(destDir)
+            return None
         self.cache.add(destPath)
-        return True
+        return destPath
 
-    def retrieveFile(self, libName, breakpadId, symbolFilename):
-        """ Returns a tuple: |success, data|
+    def retrieveFile(self, libName, breakpadId, symbolFilename, makeSink):
+        """ Downloads a symbol file. |makeSink| is called at the start of each
+        attempt to get an object whose |write| method is passed the decoded data
+        as it arrives.
+        Returns a tuple: |success, exists, sink|
+        |success| and |exists| have the same meaning as for |fetchURL|. |exists|
+        is only |False| if every server responded that it does not have the file.
         """
+        if not self.symbolURLs:
+            # Not a sign that the file does not exist
+            logger.log(logLevel.DEBUG, "No symbol servers to download {}/{}/{} from"
+                       .format(libName, breakpadId, symbolFilename))
+            return False, False, None
         skipURLs = []
         for attempt in xrange(config['retries']):
             for symbolURL in self.symbolURLs:
                 if symbolURL in skipURLs:
                     continue
                 url = self.getSymbolURL(symbolURL, libName, breakpadId, symbolFilename)
-                success, exists, data = self.fetchURL(url)
+                sink = makeSink()
+                success, exists = self.fetchURL(url, sink)
 
                 if not success:
                     continue
@@ -290,55 +762,68 @@ class DiskCacheThread(threading.Thread):
                     # Don't retry this server if we know the file is not on it
                     skipURLs.append(symbolURL)
                     continue
-                return True, data
+                return True, True, sink
+            if len(skipURLs) == len(self.symbolURLs):
+                logger.log(logLevel.DEBUG, "No server has {}/{}/{}"
+                           .format(libName, breakpadId, symbolFilename))
+                return True, False, None
             if config['retryDelayMs']:
                 time.sleep(config['retryDelayMs'] / 1000)
             logger.log(logLevel.DEBUG,
                        "Retrying download of {}/{}/{}".format(libName, breakpadId, symbolFilename))
         logger.log(logLevel.DEBUG,
                    "Unable to download {}/{}/{}".format(libName, breakpadId, symbolFilename))
-        return False, ""
+        return False, False, None
 
-    def fetchURL(self, url):
-        """ Retrieves a remote file. Returns a tuple: |success, exists, response|
-        |exists| will be set to |True| if the response is a 404 error.
+    def fetchURL(self, url, sink):
+        """ Retrieves a remote file, passing its data to |sink.write| in chunks.
+        Returns a tuple: |success, exists|
+        |exists| will be set to |False| if the response is a 404 error.
         |success| will be set to |False| if an exception occurs during the request or
         the request received has a code other than 404 or 200. Code 404 is considered
         a success because we successfully learned that the file does not exist on
         the server.
-        |response| will be a string of response data. If |exists| or |success| is
-        |True|, the response string will be empty.
         """
         try:
-            with contextlib.closing(urllib2.urlopen(url)) as response:
+            with contextlib.closing(self.openURL(url)) as response:
                 responseCode = response.getcode()
                 if responseCode == 404:
                     logger.log(logLevel.DEBUG,
                                "Got HTTP Code 404 when requesting symbol file at {}".format(url))
-                    return True, False, ""
+                    return True, False
                 if responseCode != 200:
                     logger.log(logLevel.WARNING,
                                "Got HTTP Code {} when requesting symbol file at {}"
                                .format(responseCode, url))
-                    return False, False, ""
-                return True, True, self.decodeResponse(response)
-        except IOError as e:
+                    return False, False
+                self.decodeResponse(response, sink)
+                return True, True
+        except (IOError, zlib.error) as e:
             logger.log(logLevel.ERROR,
                        "Exception when requesting symbol file at {}: {}".format(url, e))
-            return False, False, ""
+            return False, False
 
-    def decodeResponse(self, response):
+    def openURL(self, url):
+        # urllib2 raises an exception for error responses. We want to inspect the
+        # response code of those too.
+        try:
+            return urllib2.urlopen(url)
+        except urllib2.HTTPError as e:
+            return e
+
+    def decodeResponse(self, response, sink):
         headers = response.info()
         contentEncoding = headers.get("Content-Encoding", "").lower()
+        decompressor = None
         if contentEncoding in ("gzip", "x-gzip", "deflate"):
-            with contextlib.closing(StringIO(response.read())) as dataStream:
-                try:
-                    with gzip.GzipFile(fileobj=dataStream) as f:
-                        return f.read()
-                except EnvironmentError:
-                    dataStream.seek(0)
-                    return dataStream.read().decode('zlib')
-        return response.read()
+            # Accept both gzip and zlib headers
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        for chunk in iter(partial(response.read, DOWNLOAD_CHUNK_SIZE), ""):
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            sink.write(chunk)
+        if decompressor:
+            sink.write(decompressor.flush())
 
     def getSymbolURL(self, symbolURL, libName, breakpadId, fileName):
         # The symbol URL must end with a "/" for this to work. This is why we added
@@ -349,104 +834,47 @@ class DiskCacheThread(threading.Thread):
             urllib.quote_plus(fileName)
         ])
 
-    def makeSymMap(self, data, libId):
-        publicSymbols = {}
-        funcSymbols = {}
-        lineNum = 0
-        for line in data:
-            lineNum += 1
-            if line.startswith("PUBLIC "):
-                line = line.rstrip()
-                fields = line.split(" ", 3)
-                if len(fields) < 4:
-                    logger.log(logLevel.WARNING,
-                               "PUBLIC line {} in {} has too few fields"
-                               .format(lineNum, libId))
-                    continue
-                address = int(fields[1], 16)
-                symbol = fields[3]
-                publicSymbols[address] = symbol
-            elif line.startswith("FUNC "):
-                line = line.rstrip()
-                fields = line.split(" ", 4)
-                if len(fields) < 5:
-                    logger.log(logLevel.WARNING,
-                               "FUNC line {} in {} has too few fields"
-                               .format(lineNum, libId))
-                    continue
-                address = int(fields[1], 16)
-                symbol = fields[4]
-                funcSymbols[address] = symbol
-        # Prioritize PUBLIC symbols over FUNC ones
-        symMap = funcSymbols
-        symMap.update(publicSymbols)
-
-        sortedAddresses = sorted(symMap.keys(), reverse=True)
-        symmapString = "DiskCache v.1\n"
-        for address in sortedAddresses:
-            symmapString += "{} {}\n".format(hex(address), symMap[address])
-        return symmapString
-
+    # Returns a dictionary mapping each of |offsets| that could be resolved with
+    # the symbol file at |path| to |symbol, start, end|, or |None| if it is a raw
+    # symbol file, which the caller has to look up with |lookupRawSymbols|.
     def getSymbols(self, path, offsets):
         if not offsets:
             return {}
         symbols = {}
         try:
-            with open(path, 'r') as symFile:
-                firstLine = symFile.next().rstrip()
-                if firstLine == "DiskCache v.1":
-                    # Special DiskCache symbol file
-                    offsets.sort(reverse=True)
-                    nextOffset = offsets.pop(0)
-
-                    for line in symFile:
-                        line = line.rstrip()
-                        address, symbol = line.split(" ", 1)
-                        address = int(address, 16)
-                        while address <= nextOffset:
-                            symbols[nextOffset] = symbol
-                            if not offsets:
-                                return symbols
-                            nextOffset = offsets.pop(0)
-                elif firstLine.startswith("MODULE "):
-                    # Regular symbol file
-                    offsets = [[o, None] for o in offsets]
-                    lineNum = 1
-                    for line in symFile:
-                        lineNum += 1
-                        if line.startswith("PUBLIC "):
-                            line = line.rstrip()
-                            fields = line.split(" ", 3)
-                            if len(fields) < 4:
-                                logger.log(logLevel.WARNING,
-                                           "PUBLIC line {} in {} has too few fields"
-                                           .format(lineNum, path))
-                                continue
-                            address = int(fields[1], 16)
-                            symbol = fields[3]
-                            for index in xrange(len(offsets)):
-                                offset, closest = offsets[index]
-                                if address <= offset and (closest is None or address > closest):
-                                    offsets[index] = [offset, address]
-                                    symbols[offset] = symbol
-                        elif line.startswith("FUNC "):
-                            line = line.rstrip()
-                            fields = line.split(" ", 4)
-                            if len(fields) < 5:
-                                logger.log(logLevel.WARNING,
-                                           "FUNC line {} in {} has too few fields"
-                                           .format(lineNum, path))
-                                continue
-                            address = int(fields[1], 16)
-                            symbol = fields[4]
-                            for index in xrange(len(offsets)):
-                                offset, closest = offsets[index]
-                                if address <= offset and (closest is None or address > closest):
-                                    offsets[index] = [offset, address]
-                                    symbols[offset] = symbol
+            index = self.memoryCache.retrieve(path)
+            if index:
+                return index.lookup(offsets)
+
+            with open(path, 'rb') as symFile:
+                firstLine = symFile.readline().rstrip()
+            if firstLine == "DiskCache v.1":
+                # Processed by an older version of DiskCache. Convert it to the
+                # current format so that this only has to be done once.
+                logger.log(logLevel.INFO, "Upgrading symbol file {}".format(path))
+                upgradeSymMapV1(path)
+                self.cache.update(path)
+                firstLine = "DiskCache v.2"
+            if isSymbolIndex(firstLine):
+                # Special DiskCache symbol file
+                self.memoryCache.recordMiss()
+                if self.memoryCache.fits(os.path.getsize(path)):
+                    with open(path, 'rb') as symFile:
+                        index = SymbolIndex(symFile.read())
+                    self.memoryCache.add(path, index)
+                    symbols = index.lookup(offsets)
                 else:
-                    logger.log(logLevel.ERROR,
-                               "Unrecognizable type of symbol file {}".format(path))
+                    index = SymbolIndex.open(path)
+                    try:
+                        symbols = index.lookup(offsets)
+                    finally:
+                        index.close()
+            elif firstLine.startswith("MODULE "):
+                # Regular symbol file
+                return None
+            else:
+                logger.log(logLevel.ERROR,
+                           "Unrecognizable type of symbol file {}".format(path))
         except Exception as e:
             ex_type, ex, tb = sys.exc_info()
             stack = traceback.extract_tb(tb)
@@ -455,28 +883,28 @@ class DiskCacheThread(threading.Thread):
                        .format(path, e, stack))
         return symbols
 
-    # Carries out the debug action specified by the first request in the work
-    # queue.
-    # Assumes that the first request in the queue is a debug request
-    def doDebugWork(self):
-        id, request, response, future = self.workQueue[0]
+    # Carries out the debug actions of |workItems| and completes them. Debug
+    # actions are carried out synchronously, so those that download files block
+    # the DiskCacheThread.
+    def doDebugRequests(self, workItems):
+        for workItem in workItems:
+            response = self.doDebugWork(workItem.id, workItem.request, workItem.response)
+            logger.log(logLevel.DEBUG, "{} Thread work done".format(workItem.id))
+            workItem.future.set_result(response)
+
+    # Carries out the debug action specified by |request|
+    def doDebugWork(self, id, request, response):
         action = request['action']
         logger.log(logLevel.INFO, "{} Handling debug action: {}".format(id, action))
         if 'libName' in request and 'breakpadId' in request:
             # Lots of requests require the cache path for a library
             libName = str(request['libName'])
             breakpadId = str(request['breakpadId'])
-            symbolFilename = self.getSymbolFileName(libName)
-            relPath = self.getSymbolFileRelPath(libName, breakpadId, symbolFilename)
-            cachePath = os.path.join(config['cachePath'], relPath)
+            cachePath = self.getCachePath(libName, breakpadId)
 
         if action == "cacheAddRaw":
             self.cache.evict(cachePath)
-            if self.downloadToCache(libName, breakpadId, symbolFilename, cachePath,
-                                    saveRaw=True):
-                response['path'] = cachePath
-            else:
-                response['path'] = None
+            response['path'] = self.downloadToCache(libName, breakpadId, saveRaw=True)
         elif action == "cacheGet":
             response['path'] = self.getFile(libName, breakpadId)
         elif action == "cacheEvict":
@@ -484,6 +912,21 @@ class DiskCacheThread(threading.Thread):
             response['success'] = True
         elif action == "cacheExists":
             response['exists'] = (self.cache.retrieve(cachePath) is not None)
+        elif action == "memoryCacheStats":
+            response.update(self.memoryCache.stats())
+        elif action == "batchStats":
+            response.update(self.batchStats.stats())
+        elif action == "batchStatsClear":
+            self.batchStats.clear()
+            response['success'] = True
+        elif action == "negativeCacheList":
+            response['entries'] = self.negativeCache.list()
+        elif action == "negativeCacheClear":
+            if 'libName' in request and 'breakpadId' in request:
+                self.negativeCache.remove(libName, breakpadId)
+            else:
+                self.negativeCache.clear()
+            response['success'] = True
         else:
             logger.log(logLevel.ERROR, "{} Invalid action: {}".format(id, action))
             response['message'] = "Invalid action"
@@ -491,12 +934,33 @@ class DiskCacheThread(threading.Thread):
 
 
 class LRUCache:
-    def __init__(self):
+    def __init__(self, onEvict=None):
         self.cache = collections.OrderedDict()
         self.size = 0
         self.maxSize = config['maxSizeMB'] * 1024 * 1024
+        # Eviction starts once the cache is bigger than the high watermark and
+        # continues until it is no bigger than the low watermark
+        self.highWatermark = self.maxSize * config['eviction']['highWatermarkPercent'] / 100
+        self.lowWatermark = self.maxSize * config['eviction']['lowWatermarkPercent'] / 100
+        # Called with the path of an entry whenever its file is removed or
+        # rewritten
+        self.onEvict = onEvict
+        self.manifest = CacheManifest(config['cachePath'])
+        # Deletes the files of evicted entries
+        self.reaper = CacheReaper(config['cachePath'])
+        self.reaper.start()
+        # The most recently added entry. It is about to be used, so it is not
+        # evicted.
+        self.newestEntry = None
+        # Decides which entry is evicted when the cache is too big
+        self.policy = makeEvictionPolicy(config['eviction']['policy'], self.maxSize,
+                                         config['eviction']['tinyLFUWindowPercent'])
+        # Whether the cache has changed since the manifest was last written
+        self.dirty = False
+        self.lastCheckpoint = time.time()
 
     def retrieve(self, key):
+        self.policy.record(key)
         if key not in self.cache:
             return None
         entry = self.cache[key]
@@ -505,9 +969,22 @@ class LRUCache:
         # the ordered dictionary
         del self.cache[key]
         self.cache[key] = entry
+        entry.lastAccess = time.time()
+        self.policy.access(entry)
+        self.dirty = True
 
         return entry
 
+    # Adds existing cache files, given as a list of |path, size, lastAccess|
+    # tuples in LRU order, without recording them in the manifest journal
+    def load(self, entries):
+        for path, size, lastAccess in entries:
+            entry = CacheEntry(path, size, lastAccess)
+            self.size += entry.size
+            self.cache[path] = entry
+            self.policy.add(entry)
+        self.evictIfFull()
+
     def add(self, path):
         logger.log(logLevel.DEBUG, "Adding {} to cache".format(path))
         if path in self.cache:
@@ -518,12 +995,41 @@ class LRUCache:
         newEntry = CacheEntry(path)
         self.size += newEntry.size
         self.cache[path] = newEntry
+        self.policy.add(newEntry)
+        self.manifest.recordAdd(newEntry)
+        self.dirty = True
+        self.newestEntry = newEntry
 
-        while self.size > self.maxSize:
-            oldestKey, oldestEntry = self.cache.items()[0]
-            if oldestEntry is newEntry:
+    # Evicts entries until the cache is no bigger than the low watermark if it
+    # is bigger than the high watermark. Their files are deleted in the
+    # background by the reaper.
+    def evictIfFull(self):
+        if self.size <= self.highWatermark:
+            return
+        evicted = 0
+        while self.size > self.lowWatermark:
+            victim = self.policy.victim(exclude=self.newestEntry)
+            if not victim:
                 break
-            self.evict(oldestKey)
+            self.evict(victim.path)
+            evicted += 1
+        logger.log(logLevel.INFO, "Evicted {} files from the cache. Cache size: {} bytes"
+                   .format(evicted, self.size))
+
+    # Should be called when the file of a cache entry is rewritten so that the
+    # cache size stays accurate
+    def update(self, key):
+        if key not in self.cache:
+            return
+        entry = self.cache[key]
+        oldSize = entry.size
+        entry.size = diskUsage(entry.path)
+        self.size += entry.size - oldSize
+        self.policy.resize(entry, oldSize)
+        self.manifest.recordAdd(entry)
+        self.dirty = True
+        if self.onEvict:
+            self.onEvict(key)
 
     def evict(self, key):
         if key not in self.cache:
@@ -533,30 +1039,252 @@ class LRUCache:
                    "Evicting {} from the cache".format(toEvict.path))
         del self.cache[toEvict.path]
         self.size -= toEvict.size
-        try:
-            os.remove(toEvict.path)
-        except:
-            logger.log(logLevel.ERROR, "Unable to delete file evicted from cache: {}"
-                       .format(toEvict.path))
-        self.removeEmptyCacheDirs(os.path.dirname(toEvict.path))
-
-    def removeEmptyCacheDirs(self, directory):
-        while directory != config['cachePath']:
-            # Going for the "easier to ask for forgiveness than permission" model:
-            # Try to remove directory. Check afterwards to see if there was an
-            # error indicating that the directory was not empty
-            try:
-                os.rmdir(directory)
-            except OSError as ex:
-                if ex.errno == errno.ENOTEMPTY:
-                    return
-                raise
-            directory = os.path.dirname(directory)
+        self.policy.remove(toEvict)
+        self.manifest.recordEvict(toEvict.path)
+        self.dirty = True
+        if self.onEvict:
+            self.onEvict(toEvict.path)
+        if toEvict is self.newestEntry:
+            self.newestEntry = None
+        self.reaper.delete(toEvict.path)
+
+    # Writes the cache manifest if the cache has changed and it has not been
+    # written recently
+    def checkpoint(self, force=False):
+        if not force:
+            if not self.dirty:
+                return
+            if time.time() - self.lastCheckpoint < config['manifestIntervalSec']:
+                return
+        if self.manifest.checkpoint(self.cache.itervalues()):
+            self.dirty = False
+            self.lastCheckpoint = time.time()
+
+
+class SymbolTableCache:
+    """ Keeps the symbol indexes of the most recently used cache files in memory
+    so that the modules that appear in almost every request do not have to be
+    read from the disk again. Uses its own size limit and LRU eviction.
+    """
+    def __init__(self):
+        self.cache = collections.OrderedDict()
+        self.size = 0
+        self.maxSize = config['memoryCacheMB'] * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+
+    def retrieve(self, path):
+        """ Returns the index of |path| if it is in memory. Only hits are
+        counted, since the caller knows whether the file could have been in
+        memory; see |recordMiss|.
+        """
+        index = self.cache.pop(path, None)
+        if index is None:
+            return None
+        self.hits += 1
+        # Mark this entry as the "most recently used"
+        self.cache[path] = index
+        return index
+
+    def recordMiss(self):
+        self.misses += 1
+
+    def fits(self, size):
+        """ Returns |True| if an index of |size| bytes would be kept in memory.
+        """
+        return size <= self.maxSize
+
+    def add(self, path, index):
+        size = len(index.data)
+        if not self.fits(size):
+            return
+        self.evict(path)
+        self.cache[path] = index
+        self.size += size
+        while self.size > self.maxSize:
+            self.evict(next(iter(self.cache)))
+
+    def evict(self, path):
+        index = self.cache.pop(path, None)
+        if index is not None:
+            self.size -= len(index.data)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.cache),
+            'sizeBytes': self.size,
+            'maxSizeBytes': self.maxSize
+        }
+
+
+class NegativeCache:
+    """ Remembers the modules that symbol files could not be retrieved for.
+    Modules that no server has a symbol file for are remembered for longer than
+    modules that could not be retrieved because of errors.
+    """
+    def __init__(self):
+        self.cache = collections.OrderedDict()
+        self.maxEntries = config['negativeCache']['maxEntries']
+        self.notFoundTTL = config['negativeCache']['notFoundTTLSec']
+        self.errorTTL = config['negativeCache']['errorTTLSec']
+
+    def add(self, libName, breakpadId, notFound):
+        ttl = self.notFoundTTL if notFound else self.errorTTL
+        if ttl <= 0 or self.maxEntries <= 0:
+            return
+        key = (libName, breakpadId)
+        self.cache.pop(key, None)
+        self.cache[key] = (time.time() + ttl, notFound)
+        while len(self.cache) > self.maxEntries:
+            self.cache.popitem(last=False)
+
+    def contains(self, libName, breakpadId):
+        key = (libName, breakpadId)
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+        if entry[0] <= time.time():
+            del self.cache[key]
+            return False
+        return True
+
+    def remove(self, libName, breakpadId):
+        self.cache.pop((libName, breakpadId), None)
+
+    def clear(self):
+        self.cache.clear()
+
+    def list(self):
+        now = time.time()
+        return [{
+            'libName': key[0],
+            'breakpadId': key[1],
+            'reason': "notFound" if notFound else "error",
+            'expiresInSec': expires - now
+        } for key, (expires, notFound) in self.cache.iteritems() if expires > now]
+
+
+class BatchStats:
+    """ Counts how many requests are started together and how many symbol file
+    reads are saved by resolving a module for several requests at once.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.batches = 0
+        self.requests = 0
+        self.maxBatchSize = 0
+        self.reads = 0
+        self.readsSaved = 0
+
+    def addBatch(self, size):
+        self.batches += 1
+        self.requests += size
+        self.maxBatchSize = max(self.maxBatchSize, size)
+
+    # Called whenever a symbol file is read to resolve a module for |requests|
+    # requests
+    def addRead(self, requests):
+        self.reads += 1
+        self.readsSaved += requests - 1
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'averageBatchSize': float(self.requests) / self.batches if self.batches else 0,
+            'maxBatchSize': self.maxBatchSize,
+            'symbolFileReads': self.reads,
+            'readsSaved': self.readsSaved
+        }
+
+
+class RawFileSink:
+    """ Writes downloaded data unchanged to a file, discarding anything written
+    by a previous attempt.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.fp.seek(0)
+        self.fp.truncate()
+
+    def write(self, data):
+        self.fp.write(data)
+
+
+class WorkItem:
+    def __init__(self, id, request, response, future, deadline=None):
+        self.id = id
+        self.request = request
+        self.response = response
+        self.future = future
+        # The time by which the response must be sent, or |None|
+        self.deadline = deadline
+        # Maps |libName, breakpadId| of each module of the request to the frames
+        # in it (see |DiskCacheThread.indexFrames|)
+        self.moduleFrames = {}
+        # |libName, breakpadId| of the modules of the request that have not been
+        # resolved yet
+        self.pendingModules = set()
+
+
+class DownloadResult:
+    """ Posted to the work queue by a download worker when it has finished.
+    |tempPath| is the path of the downloaded file, or |None| if the download
+    failed. It belongs at |destPath| in the cache. |retrieved| has the same
+    meaning as |success| in |retrieveFile|. |sourcePath| is set if the file is
+    the index of a local symbol file rather than a download. |symbols| is set
+    instead of |tempPath| if the worker looked up |offsets| in the raw symbol
+    file at |destPath|, and maps them to symbols like |getSymbols|.
+    """
+    def __init__(self, libName, breakpadId, tempPath, destPath, retrieved, sourcePath=None,
+                 symbols=None, offsets=None):
+        self.libName = libName
+        self.breakpadId = breakpadId
+        self.tempPath = tempPath
+        self.destPath = destPath
+        self.retrieved = retrieved
+        self.sourcePath = sourcePath
+        self.symbols = symbols
+        self.offsets = offsets
+
+
+class Wakeup:
+    """ Posted to the work queue by the IOLoop at |time| when the
+    DiskCacheThread has asked to be woken up then.
+    """
+    def __init__(self, time):
+        self.time = time
+
+
+class Cancellation:
+    """ Posted to the work queue when the client of a request that the
+    DiskCacheThread has already started on goes away.
+    """
+    def __init__(self, future):
+        self.future = future
+
+
+def diskUsage(pathOrStat):
+    """ Returns the disk space used by a file in bytes, which is usually more
+    than its size since whole blocks are allocated.
+    """
+    if isinstance(pathOrStat, basestring):
+        pathOrStat = os.stat(pathOrStat)
+    blocks = getattr(pathOrStat, 'st_blocks', None)
+    if blocks is None:
+        # Not available on every platform
+        return pathOrStat.st_size
+    return blocks * 512
 
 
 class CacheEntry:
-    def __init__(self, path):
+    def __init__(self, path, size=None, lastAccess=None):
         self.path = path
-        self.size = os.path.getsize(path)
+        self.size = diskUsage(path) if size is None else size
+        self.lastAccess = time.time() if lastAccess is None else lastAccess
 
 diskCache = DiskCache()
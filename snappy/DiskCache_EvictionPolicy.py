@@ -0,0 +1,228 @@
+################################################################################
+# DiskCache eviction policies
+#
+# Decide which file the cache evicts when it is over its size limit. A policy
+# is told about every entry that is added to, accessed in, resized in or removed
+# from the cache, and |victim| returns the entry that should be evicted next.
+# Policies only order entries; the cache itself does the evicting.
+#
+# - "lru" evicts the least recently used file.
+# - "gdsf" (Greedy Dual Size Frequency) evicts the file with the lowest
+#   frequency / size, aged so that files that used to be popular do not stay
+#   forever. Many small files are kept rather than one big one.
+# - "tinylfu" keeps new files in a small LRU window. When the window is full,
+#   its least recently used file only replaces the main segment's least
+#   recently used file if it has been requested more often, according to a
+#   frequency sketch of recent requests (including cache misses). Files that
+#   are only requested once never push frequently used files out of the cache.
+################################################################################
+from logger import logger, logLevel
+
+import heapq
+import itertools
+import collections
+
+# TinyLFU frequency sketch dimensions. The counters are halved after
+# |SKETCH_WIDTH * SKETCH_RESET_FACTOR| requests so that old popularity fades.
+SKETCH_DEPTH = 4
+SKETCH_WIDTH = 16384
+SKETCH_RESET_FACTOR = 10
+SKETCH_MAX_COUNT = 15
+
+
+def makeEvictionPolicy(name, maxSize, tinyLFUWindowPercent):
+    if name == "lru":
+        return LRUPolicy()
+    if name == "gdsf":
+        return GDSFPolicy()
+    if name == "tinylfu":
+        return TinyLFUPolicy(maxSize, maxSize * tinyLFUWindowPercent / 100)
+    logger.log(logLevel.ERROR, "Unknown eviction policy {}. Using LRU".format(name))
+    return LRUPolicy()
+
+
+class LRUPolicy:
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+
+    def record(self, key):
+        pass
+
+    def add(self, entry):
+        self.entries[entry.path] = entry
+
+    def access(self, entry):
+        del self.entries[entry.path]
+        self.entries[entry.path] = entry
+
+    def resize(self, entry, oldSize):
+        pass
+
+    def remove(self, entry):
+        self.entries.pop(entry.path, None)
+
+    def victim(self, exclude=None):
+        for entry in self.entries.itervalues():
+            if entry is not exclude:
+                return entry
+        return None
+
+
+class GDSFPolicy:
+    """ Entries are kept in a heap ordered by priority. Updating the priority of
+    an entry pushes a new heap item rather than moving the old one, so items
+    whose priority no longer matches their entry are skipped when popped.
+    """
+    def __init__(self):
+        self.heap = []
+        # Maps the path of each entry to |entry, frequency, priority|
+        self.entries = {}
+        # The priority of the last victim, added to every new priority
+        self.inflation = 0.0
+        self.sequence = itertools.count()
+
+    def record(self, key):
+        pass
+
+    def add(self, entry):
+        self.setPriority(entry, 1)
+
+    def access(self, entry):
+        self.setPriority(entry, self.entries[entry.path][1] + 1)
+
+    def resize(self, entry, oldSize):
+        self.setPriority(entry, self.entries[entry.path][1])
+
+    def setPriority(self, entry, frequency):
+        priority = self.inflation + float(frequency) / max(entry.size, 1)
+        self.entries[entry.path] = (entry, frequency, priority)
+        heapq.heappush(self.heap, (priority, next(self.sequence), entry.path))
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.compact()
+
+    def remove(self, entry):
+        self.entries.pop(entry.path, None)
+
+    def victim(self, exclude=None):
+        skipped = None
+        victim = None
+        while self.heap:
+            priority, sequence, path = self.heap[0]
+            current = self.entries.get(path)
+            if current is None or current[2] != priority:
+                heapq.heappop(self.heap)
+                continue
+            if current[0] is exclude:
+                skipped = heapq.heappop(self.heap)
+                continue
+            victim = current[0]
+            self.inflation = priority
+            break
+        if skipped:
+            heapq.heappush(self.heap, skipped)
+        return victim
+
+    def compact(self):
+        self.heap = [(priority, next(self.sequence), path)
+                     for path, (entry, frequency, priority) in self.entries.iteritems()]
+        heapq.heapify(self.heap)
+
+
+class TinyLFUPolicy:
+    def __init__(self, maxSize, windowMaxSize):
+        self.window = collections.OrderedDict()
+        self.main = collections.OrderedDict()
+        self.windowSize = 0
+        self.mainSize = 0
+        self.windowMaxSize = windowMaxSize
+        self.mainMaxSize = maxSize - windowMaxSize
+        self.sketch = FrequencySketch()
+
+    def record(self, key):
+        self.sketch.increment(key)
+
+    def add(self, entry):
+        self.window[entry.path] = entry
+        self.windowSize += entry.size
+
+    def access(self, entry):
+        segment = self.window if entry.path in self.window else self.main
+        del segment[entry.path]
+        segment[entry.path] = entry
+
+    def resize(self, entry, oldSize):
+        if entry.path in self.window:
+            self.windowSize += entry.size - oldSize
+        else:
+            self.mainSize += entry.size - oldSize
+
+    def remove(self, entry):
+        if entry.path in self.window:
+            del self.window[entry.path]
+            self.windowSize -= entry.size
+        elif entry.path in self.main:
+            del self.main[entry.path]
+            self.mainSize -= entry.size
+
+    def victim(self, exclude=None):
+        while self.windowSize > self.windowMaxSize:
+            candidate = self.oldest(self.window, exclude)
+            if not candidate:
+                # Only the excluded entry is left in the window. It is not
+                # judged until it can be like any other entry, but the cache
+                # must still shrink, so the main segment gives up its oldest
+                return self.oldest(self.main, exclude)
+            if self.mainSize + candidate.size <= self.mainMaxSize:
+                self.promote(candidate)
+                continue
+            mainVictim = self.oldest(self.main, exclude)
+            if not mainVictim:
+                return candidate
+            # The oldest entry of the full window only gets into the main
+            # segment if it is more popular than the entry it would replace
+            if self.sketch.estimate(candidate.path) > self.sketch.estimate(mainVictim.path):
+                self.promote(candidate)
+                return mainVictim
+            return candidate
+        return self.oldest(self.main, exclude) or self.oldest(self.window, exclude)
+
+    def promote(self, entry):
+        del self.window[entry.path]
+        self.windowSize -= entry.size
+        self.main[entry.path] = entry
+        self.mainSize += entry.size
+
+    def oldest(self, segment, exclude):
+        for entry in segment.itervalues():
+            if entry is not exclude:
+                return entry
+        return None
+
+
+class FrequencySketch:
+    """ A count-min sketch estimating how often each key has been recorded.
+    """
+    def __init__(self):
+        self.rows = [[0] * SKETCH_WIDTH for row in xrange(SKETCH_DEPTH)]
+        self.additions = 0
+
+    def indexes(self, key):
+        keyHash = hash(key)
+        return [hash((keyHash, row)) % SKETCH_WIDTH for row in xrange(SKETCH_DEPTH)]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self.indexes(key)):
+            if row[index] < SKETCH_MAX_COUNT:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= SKETCH_WIDTH * SKETCH_RESET_FACTOR:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.indexes(key)))
+
+    def reset(self):
+        for row in self.rows:
+            for index in xrange(SKETCH_WIDTH):
+                row[index] >>= 1
+        self.additions /= 2
@@ -0,0 +1,54 @@
+################################################################################
+# DiskCache local symbol directories
+#
+# Finds symbol files in the directories listed in |localSymbolDirs|. Symbol
+# files are always stored at <libName>/<breakpadId>/<symbol file name> within a
+# symbol directory, so rather than walking the directories to build an index of
+# them, the expected path is checked in each directory when a file is needed.
+# The results are remembered for a while so that modules that have no local
+# symbols (most modules, usually) do not cost a check of every directory on
+# every request.
+################################################################################
+import os
+import time
+import collections
+
+# The maximum number of lookup results to remember
+MAX_REMEMBERED = 10000
+
+
+class LocalSymbolDirs:
+    def __init__(self, symbolDirs, rescanSec):
+        self.symbolDirs = symbolDirs
+        self.rescanSec = rescanSec
+        # Maps the relative path of a symbol file to |path, time found| where
+        # |path| is |None| if the file is not in any of the directories
+        self.found = collections.OrderedDict()
+
+    def find(self, relPath):
+        """ Returns the path of the symbol file with the relative path |relPath|,
+        or |None| if it is not in any of the directories. Directories listed
+        earlier take priority over directories listed later.
+        """
+        if not self.symbolDirs:
+            return None
+        now = time.time()
+        result = self.found.pop(relPath, None)
+        if result is None or (result[0] is None and now - result[1] >= self.rescanSec):
+            result = (self.search(relPath), now)
+        self.found[relPath] = result
+        while len(self.found) > MAX_REMEMBERED:
+            self.found.popitem(last=False)
+        return result[0]
+
+    def search(self, relPath):
+        for symbolDir in self.symbolDirs:
+            path = os.path.join(symbolDir, relPath)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def forget(self, relPath):
+        """ Should be called if a file returned by |find| turns out to be gone.
+        """
+        self.found.pop(relPath, None)
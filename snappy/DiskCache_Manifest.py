@@ -0,0 +1,137 @@
+################################################################################
+# DiskCache manifest
+#
+# Records the contents of the cache directory so that DiskCache can load its
+# cache at startup without walking the directory, and so that the LRU order of
+# the cache survives restarts.
+#
+# The manifest is a checkpoint of the whole cache, written periodically. It
+# starts with a header line, followed by one line per cache entry, least
+# recently used first:
+#
+#   <size>\t<last access time>\t<path relative to the cache directory>
+#
+# Between checkpoints, every file added to or removed from the cache is
+# appended to a journal so that it is not lost if DiskCache stops before the
+# next checkpoint:
+#
+#   +\t<size>\t<last access time>\t<relative path>
+#   -\t<relative path>
+#
+# Entries added by the journal are dropped when it is replayed if their files
+# no longer exist.
+################################################################################
+from logger import logger, logLevel
+
+import os
+import collections
+
+MANIFEST_NAME = ".manifest"
+JOURNAL_NAME = ".journal"
+MANIFEST_HEADER = "DiskCache manifest v.1"
+
+
+class CacheManifest:
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.manifestPath = os.path.join(cacheDir, MANIFEST_NAME)
+        self.journalPath = os.path.join(cacheDir, JOURNAL_NAME)
+        self.journal = None
+
+    def isManifestFile(self, path):
+        return path in (self.manifestPath, self.journalPath)
+
+    def load(self):
+        """ Returns a list of |path, size, lastAccess| tuples in LRU order, least
+        recently used first. Returns |None| if there is no usable manifest.
+        """
+        entries = collections.OrderedDict()
+        try:
+            with open(self.manifestPath, 'r') as fp:
+                if fp.readline().rstrip("\n") != MANIFEST_HEADER:
+                    logger.log(logLevel.WARNING, "Cache manifest has an unknown format")
+                    return None
+                for line in fp:
+                    size, lastAccess, relPath = line.rstrip("\n").split("\t", 2)
+                    entries[relPath] = (int(size), float(lastAccess))
+        except IOError as e:
+            logger.log(logLevel.INFO, "Unable to read cache manifest: {}".format(e))
+            return None
+        except ValueError:
+            logger.log(logLevel.WARNING, "Cache manifest is corrupt")
+            return None
+
+        try:
+            with open(self.journalPath, 'r') as fp:
+                self.replayJournal(fp, entries)
+        except IOError:
+            pass  # No changes since the last checkpoint
+
+        return [(os.path.join(self.cacheDir, entry[0]), entry[1][0], entry[1][1])
+                for entry in entries.iteritems()]
+
+    def replayJournal(self, fp, entries):
+        # Entries added since the last checkpoint, whose files may be gone if
+        # DiskCache stopped before it could journal their eviction
+        added = set()
+        for line in fp:
+            if not line.endswith("\n"):
+                # DiskCache stopped while this line was being written
+                break
+            fields = line.rstrip("\n").split("\t")
+            try:
+                if fields[0] == "+":
+                    relPath = "\t".join(fields[3:])
+                    entries.pop(relPath, None)
+                    entries[relPath] = (int(fields[1]), float(fields[2]))
+                    added.add(relPath)
+                elif fields[0] == "-":
+                    entries.pop("\t".join(fields[1:]), None)
+            except (IndexError, ValueError):
+                logger.log(logLevel.WARNING, "Ignoring corrupt cache journal line: {}"
+                           .format(line.rstrip("\n")))
+        for relPath in added:
+            if relPath in entries and not os.path.exists(os.path.join(self.cacheDir, relPath)):
+                logger.log(logLevel.INFO, "Dropping journaled cache entry whose file is gone: {}"
+                           .format(relPath))
+                del entries[relPath]
+
+    def recordAdd(self, entry):
+        self.writeJournal("+\t{}\t{}\t{}\n".format(entry.size, entry.lastAccess,
+                                                   self.relPath(entry.path)))
+
+    def recordEvict(self, path):
+        self.writeJournal("-\t{}\n".format(self.relPath(path)))
+
+    def writeJournal(self, line):
+        try:
+            if not self.journal:
+                self.journal = open(self.journalPath, 'a')
+            self.journal.write(line)
+            self.journal.flush()
+        except IOError as e:
+            logger.log(logLevel.ERROR, "Unable to write to cache journal: {}".format(e))
+
+    def checkpoint(self, entries):
+        """ Writes a new manifest from |entries|, an iterable of CacheEntry
+        objects in LRU order, and empties the journal.
+        """
+        tempPath = self.manifestPath + ".tmp"
+        try:
+            with open(tempPath, 'w') as fp:
+                fp.write(MANIFEST_HEADER + "\n")
+                for entry in entries:
+                    fp.write("{}\t{}\t{}\n".format(entry.size, entry.lastAccess,
+                                                   self.relPath(entry.path)))
+            os.rename(tempPath, self.manifestPath)
+            if self.journal:
+                self.journal.close()
+            self.journal = open(self.journalPath, 'w')
+        except (OSError, IOError) as e:
+            logger.log(logLevel.ERROR, "Unable to write cache manifest: {}".format(e))
+            return False
+        logger.log(logLevel.DEBUG, "Cache manifest written")
+        return True
+
+    def relPath(self, path):
+        return os.path.relpath(path, self.cacheDir)
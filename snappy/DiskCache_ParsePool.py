@@ -0,0 +1,73 @@
+################################################################################
+# DiskCache parse pool
+#
+# Runs the CPU bound parsing of symbol files in a pool of processes, so that it
+# does not hold the GIL of the DiskCache process. Jobs are submitted by the
+# download workers, each of which waits for its own job.
+#
+# A job that takes longer than |timeoutSec| is stopped by terminating the whole
+# pool, since there is no way to tell which of its processes is running the
+# job, and a new pool takes its place. Jobs of other download workers that were
+# running in the old pool are then submitted again to the new one.
+#
+# The first pool is created before any other threads are started so that its
+# processes cannot inherit a lock held by one of those threads. The pools that
+# replace it are not, but a process of theirs that is stuck on such a lock is
+# stopped like any other job that times out.
+################################################################################
+from logger import logger, logLevel
+
+import time
+import threading
+import multiprocessing
+
+# How often, in seconds, a download worker that is waiting for its job checks
+# whether the pool has been replaced
+REPLACEMENT_CHECK_SEC = 1
+
+
+class ParsePool:
+    def __init__(self, processes, timeoutSec):
+        self.processes = processes
+        self.timeoutSec = timeoutSec
+        # Guards |pool| and |generation|
+        self.lock = threading.Lock()
+        self.pool = multiprocessing.Pool(processes)
+        # Incremented every time the pool is replaced
+        self.generation = 0
+
+    def run(self, function, args):
+        """ Runs |function| with |args| in the pool and returns its result, or
+        raises the exception that it raised. Raises multiprocessing.TimeoutError
+        if it takes longer than |timeoutSec|. |function| must be a module level
+        function so that it can be sent to the pool.
+        """
+        while True:
+            with self.lock:
+                pool, generation = self.pool, self.generation
+                job = pool.apply_async(function, args)
+            deadline = time.time() + self.timeoutSec
+            while not job.ready():
+                if self.generation != generation:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.replace(generation)
+                    raise multiprocessing.TimeoutError()
+                job.wait(min(remaining, REPLACEMENT_CHECK_SEC))
+            if job.ready():
+                return job.get()
+            logger.log(logLevel.DEBUG, "Resubmitting parse job to the new parse pool")
+
+    def replace(self, generation):
+        """ Terminates the pool, which ran a job that timed out, and creates a
+        new one, unless that has already been done since |generation|.
+        """
+        with self.lock:
+            if self.generation != generation:
+                return
+            logger.log(logLevel.WARNING, "Parse job timed out. Restarting the parse pool")
+            oldPool = self.pool
+            self.pool = multiprocessing.Pool(self.processes)
+            self.generation += 1
+        oldPool.terminate()
@@ -0,0 +1,108 @@
+################################################################################
+# DiskCache reaper
+#
+# Deletes the files of evicted cache entries on a background thread so that the
+# DiskCacheThread never waits for the disk to unlink files. The cache removes
+# entries from its bookkeeping immediately and hands their paths to the reaper,
+# which deletes them in batches and then removes directories left empty.
+#
+# A path may be added to the cache again before the reaper gets to it. Files
+# are only ever moved into the cache directory through |moveIntoCache|, which
+# takes the same lock as the reaper and cancels any pending deletion of the
+# path, so the reaper never deletes a file that is back in the cache and never
+# removes a directory that a file is being moved into.
+################################################################################
+from logger import logger, logLevel
+
+import os
+import errno
+import threading
+import Queue
+
+# The maximum number of files deleted before empty directories are removed
+REAP_BATCH_SIZE = 256
+
+
+class CacheReaper(threading.Thread):
+    def __init__(self, cacheDir):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cacheDir = cacheDir
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        # Paths that have been evicted but not deleted yet
+        self.pending = set()
+
+    def delete(self, path):
+        """ Deletes the file at |path|, which is no longer in the cache, soon.
+        """
+        with self.lock:
+            self.pending.add(path)
+        self.queue.put(path)
+
+    def moveIntoCache(self, sourcePath, destPath):
+        """ Moves the file at |sourcePath| to |destPath| in the cache directory,
+        creating directories as needed. Raises OSError on failure.
+        """
+        with self.lock:
+            self.pending.discard(destPath)
+            destDir = os.path.dirname(destPath)
+            if not os.path.exists(destDir):
+                os.makedirs(destDir)
+            os.rename(sourcePath, destPath)
+
+    def removeEmptyDirs(self, directory):
+        """ Removes |directory| and its parents within the cache directory as
+        long as they are empty.
+        """
+        with self.lock:
+            self.removeEmptyCacheDirs(directory)
+
+    def run(self):
+        while True:
+            paths = [self.queue.get()]
+            while len(paths) < REAP_BATCH_SIZE:
+                try:
+                    paths.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self.reap(paths)
+
+    def reap(self, paths):
+        directories = set()
+        deleted = 0
+        for path in paths:
+            with self.lock:
+                if path not in self.pending:
+                    # Added to the cache again since it was evicted
+                    continue
+                self.pending.remove(path)
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        logger.log(logLevel.ERROR,
+                                   "Unable to delete file evicted from cache: {}: {}"
+                                   .format(path, e))
+            directories.add(os.path.dirname(path))
+        with self.lock:
+            # In reverse order, directories come before their parents
+            for directory in sorted(directories, reverse=True):
+                self.removeEmptyCacheDirs(directory)
+        logger.log(logLevel.DEBUG, "Deleted {} files evicted from the cache".format(deleted))
+
+    def removeEmptyCacheDirs(self, directory):
+        while directory != self.cacheDir and directory.startswith(self.cacheDir):
+            # Going for the "easier to ask for forgiveness than permission" model:
+            # Try to remove directory. Check afterwards to see if there was an
+            # error indicating that the directory was not empty
+            try:
+                os.rmdir(directory)
+            except OSError as ex:
+                if ex.errno in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    return
+                logger.log(logLevel.ERROR, "Unable to remove empty cache directory {}: {}"
+                           .format(directory, ex))
+                return
+            directory = os.path.dirname(directory)
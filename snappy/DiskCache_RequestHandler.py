@@ -1,19 +1,45 @@
 from logger import logger, logLevel
 from validateRequest import validateRequest
+from DiskCache_Config import config
 from DiskCache_DiskCache import diskCache
+from requestLimiter import RequestLimiter
 
 import json
 import uuid
 import tornado.web
 import sys
+import time
 import traceback
 
+requestLimiter = RequestLimiter()
+
 
 class RequestHandler(tornado.web.RequestHandler):
     def prepare(self):
         xForwardIP = self.request.headers.get("X-Forwarded-For")
         self.remoteIP = self.request.remote_ip if not xForwardIP else xForwardIP
         self.requestId = uuid.uuid4()
+        self.work = None
+        self.connectionClosed = False
+
+    def on_connection_close(self):
+        self.connectionClosed = True
+        if self.work:
+            self.log(logLevel.INFO, "Client closed the connection. Cancelling request")
+            diskCache.cancel(self.work)
+
+    # Returns the time by which the response should be sent, as requested by
+    # the X-Deadline-Ms header, or |None| if there is no deadline
+    def getDeadline(self):
+        deadlineMs = self.request.headers.get("X-Deadline-Ms")
+        if deadlineMs is None:
+            return None
+        try:
+            return time.time() + int(deadlineMs) / 1000.0
+        except ValueError:
+            self.log(logLevel.WARNING, "Ignoring invalid X-Deadline-Ms header: {}"
+                     .format(deadlineMs))
+            return None
 
     def log(self, level, message):
         logger.log(level, "{} {}".format(self.requestId, message), remoteIP=self.remoteIP)
@@ -49,6 +75,20 @@ class RequestHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def post(self):
+        if not requestLimiter.admit(config['maxQueuedRequests']):
+            retryAfter = requestLimiter.retryAfter()
+            self.log(logLevel.INFO, "Too many requests in progress. Rejecting request. "
+                     "Retry after {} seconds".format(retryAfter))
+            self.sendHeaders(503)
+            self.set_header("Retry-After", str(retryAfter))
+            return
+        try:
+            yield self.handleRequest()
+        finally:
+            requestLimiter.release()
+
+    @tornado.gen.coroutine
+    def handleRequest(self):
         uri = self.request.uri
 
         self.log(logLevel.INFO, "Processing POST request: {}".format(uri))
@@ -63,9 +103,13 @@ class RequestHandler(tornado.web.RequestHandler):
                 self.sendHeaders(400)
                 return
 
-            response = yield diskCache.request(requestBody, self.requestId)
+            self.work = diskCache.request(requestBody, self.requestId, self.getDeadline())
+            response = yield self.work
             response = json.dumps(response)
         except Exception as e:
+            if self.connectionClosed:
+                self.log(logLevel.INFO, "Request cancelled")
+                return
             ex_type, ex, tb = sys.exc_info()
             stack = traceback.extract_tb(tb)
             self.log(logLevel.ERROR, "Could not formulate response: {}: {} STACK: {}"
@@ -73,6 +117,10 @@ class RequestHandler(tornado.web.RequestHandler):
             self.sendHeaders(500)
             return
 
+        if self.connectionClosed:
+            self.log(logLevel.INFO, "Client closed the connection. Response not sent")
+            return
+
         try:
             self.sendHeaders(200)
             self.log(logLevel.DEBUG, "Response: {}".format(response))
@@ -82,3 +130,15 @@ class RequestHandler(tornado.web.RequestHandler):
             return
 
         self.log(logLevel.INFO, "Response sent")
+
+
+class StatusHandler(tornado.web.RequestHandler):
+    """ Reports how busy the server is. Responds with 503 while new requests
+    would be rejected, so that load balancers can route around the server.
+    """
+    def get(self):
+        status = requestLimiter.status(config['maxQueuedRequests'])
+        status['workQueueSize'] = diskCache.workQueue.qsize()
+        self.set_status(503 if status['saturated'] else 200)
+        self.set_header("Content-type", "application/json")
+        self.write(json.dumps(status))
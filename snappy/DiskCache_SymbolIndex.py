@@ -0,0 +1,355 @@
+################################################################################
+# DiskCache v.2 symbol index
+#
+# The processed symbol files that DiskCache keeps in its cache. The file starts
+# with a magic line so that it can be told apart from raw symbol files and from
+# the older text based "DiskCache v.1" files. The rest of the file is binary
+# (all integers are little endian):
+#
+#   "DiskCache v.2\n"
+#   uint64                  Number of symbols (n)
+#   uint64[n]               Symbol addresses, sorted in ascending order
+#   uint32[n]               Symbol sizes (0 if the size is not known)
+#   uint32[n + 1]           Offsets of the symbol names in the string table
+#   char[]                  String table
+#
+# Because the address array has a fixed width, a lookup can binary search it
+# directly in a memory mapped file without reading the rest of the file.
+################################################################################
+from logger import logger, logLevel
+
+import os
+import mmap
+import struct
+import bisect
+from functools import partial
+
+READ_CHUNK_SIZE = 64 * 1024
+MAGIC = "DiskCache v.2\n"
+COUNT_FORMAT = struct.Struct("<Q")
+ADDRESS_FORMAT = struct.Struct("<Q")
+SIZE_FORMAT = struct.Struct("<I")
+STRING_OFFSET_FORMAT = struct.Struct("<I")
+HEADER_SIZE = len(MAGIC) + COUNT_FORMAT.size
+
+
+def isSymbolIndex(firstLine):
+    return firstLine == MAGIC.rstrip()
+
+
+class SymMapBuilder:
+    """ Incrementally parses the text of a Breakpad symbol file, which can be
+    passed to |write| in chunks of any size. Only the PUBLIC and FUNC records
+    are kept, so memory use depends on the number of symbols rather than on
+    the size of the file.
+    """
+    def __init__(self, libId):
+        self.libId = libId
+        self.publicSymbols = {}
+        self.funcSymbols = {}
+        self.lineNum = 0
+        self.remainder = ""
+
+    def write(self, data):
+        lines = (self.remainder + data).split("\n")
+        self.remainder = lines.pop()
+        for line in lines:
+            self.parseLine(line)
+
+    def parseLine(self, line):
+        self.lineNum += 1
+        if line.startswith("PUBLIC "):
+            line = line.rstrip()
+            fields = line.split(" ", 3)
+            if len(fields) < 4:
+                logger.log(logLevel.WARNING,
+                           "PUBLIC line {} in {} has too few fields"
+                           .format(self.lineNum, self.libId))
+                return
+            address = int(fields[1], 16)
+            symbol = fields[3]
+            self.addSymbol(address, 0, symbol, True)
+        elif line.startswith("FUNC "):
+            line = line.rstrip()
+            fields = line.split(" ", 4)
+            if len(fields) < 5:
+                logger.log(logLevel.WARNING,
+                           "FUNC line {} in {} has too few fields"
+                           .format(self.lineNum, self.libId))
+                return
+            address = int(fields[1], 16)
+            size = int(fields[2], 16)
+            symbol = fields[4]
+            self.addSymbol(address, size, symbol, False)
+
+    def addSymbol(self, address, size, symbol, isPublic):
+        if isPublic:
+            self.publicSymbols[address] = (size, symbol)
+        else:
+            self.funcSymbols[address] = (size, symbol)
+
+    def finish(self):
+        """ Returns a symMap suitable for |writeSymbolIndex|
+        """
+        if self.remainder:
+            self.parseLine(self.remainder)
+            self.remainder = ""
+        # Prioritize PUBLIC symbols over FUNC ones
+        symMap = self.funcSymbols
+        symMap.update(self.publicSymbols)
+        self.funcSymbols = {}
+        self.publicSymbols = {}
+        return symMap
+
+
+class RawSymbolLookup(SymMapBuilder):
+    """ Resolves |offsets| in a single pass over the text of a Breakpad symbol
+    file, without keeping the rest of its symbols.
+
+    The offsets are sorted once. Each record is then placed, with a binary
+    search, in the gap between the two sorted offsets that surround its address
+    and only the highest and the lowest record in each gap are kept. The symbol
+    for an offset is the highest record in its own gap or in any gap below it,
+    and the next symbol after it is the lowest record in any gap above it, both
+    of which are found with one walk over the gaps at the end. This makes the
+    cost O(records * log(offsets)) rather than O(records * offsets).
+    """
+    def __init__(self, libId, offsets):
+        SymMapBuilder.__init__(self, libId)
+        self.offsets = sorted(set(offsets))
+        # Highest record, as |address, isPublic, symbol, size|, in the gap
+        # (offsets[i - 1], offsets[i]]
+        self.gapBest = [None] * len(self.offsets)
+        # Lowest record address in the same gaps, plus the gap above the
+        # highest offset
+        self.gapLowest = [None] * (len(self.offsets) + 1)
+
+    def addSymbol(self, address, size, symbol, isPublic):
+        gap = bisect.bisect_left(self.offsets, address)
+        lowest = self.gapLowest[gap]
+        if lowest is None or address < lowest:
+            self.gapLowest[gap] = address
+        if gap >= len(self.offsets):
+            return
+        best = self.gapBest[gap]
+        # Like |SymMapBuilder|, prioritize PUBLIC symbols over FUNC ones and
+        # otherwise keep the last of several records at the same address
+        if best is None or address > best[0] or (address == best[0] and
+                                                 (isPublic or not best[1])):
+            self.gapBest[gap] = (address, isPublic, symbol, 0 if isPublic else size)
+
+    def finish(self):
+        """ Returns a dictionary mapping each offset that could be resolved to
+        |symbol, start, end| as described for |SymbolIndex.lookup|.
+        """
+        if self.remainder:
+            self.parseLine(self.remainder)
+            self.remainder = ""
+        # The lowest record address above each offset
+        nextAddresses = [None] * len(self.offsets)
+        nextAddress = self.gapLowest[-1]
+        for i in xrange(len(self.offsets) - 1, -1, -1):
+            nextAddresses[i] = nextAddress
+            if self.gapLowest[i] is not None:
+                nextAddress = self.gapLowest[i]
+        symbols = {}
+        best = None
+        for offset, gapBest, nextAddress in zip(self.offsets, self.gapBest, nextAddresses):
+            if gapBest is not None:
+                best = gapBest
+            if best is not None:
+                address, isPublic, symbol, size = best
+                symbols[offset] = (symbol, address, symbolEnd(address, size, nextAddress))
+        return symbols
+
+
+def symbolEnd(address, size, nextAddress):
+    """ Returns the end of the range of offsets that resolve to the symbol at
+    |address|: the end of the function if its size is known, but never beyond
+    the next symbol at |nextAddress|. Returns |None| if neither is known.
+    """
+    if size:
+        if nextAddress is None:
+            return address + size
+        return min(address + size, nextAddress)
+    return nextAddress
+
+
+def writeSymbolIndex(fp, symMap):
+    """ Writes |symMap| to the file object |fp| in the DiskCache v.2 format.
+    |symMap| maps each address to a tuple: |size, symbol|
+    """
+    addresses = sorted(symMap.keys())
+    fp.write(MAGIC)
+    fp.write(COUNT_FORMAT.pack(len(addresses)))
+    for address in addresses:
+        fp.write(ADDRESS_FORMAT.pack(address))
+    for address in addresses:
+        fp.write(SIZE_FORMAT.pack(symMap[address][0]))
+    stringOffset = 0
+    fp.write(STRING_OFFSET_FORMAT.pack(stringOffset))
+    for address in addresses:
+        stringOffset += len(symMap[address][1])
+        fp.write(STRING_OFFSET_FORMAT.pack(stringOffset))
+    for address in addresses:
+        fp.write(symMap[address][1])
+
+
+class SymbolIndex:
+    """ Read access to a DiskCache v.2 symbol index. |data| may be anything that
+    supports the buffer interface, such as a string or a memory map.
+    """
+    def __init__(self, data):
+        self.data = data
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Data is not a DiskCache v.2 symbol index")
+        if len(data) < HEADER_SIZE:
+            raise ValueError("DiskCache v.2 symbol index is truncated")
+        self.count = COUNT_FORMAT.unpack_from(data, len(MAGIC))[0]
+        self.addressStart = HEADER_SIZE
+        self.sizeStart = self.addressStart + self.count * ADDRESS_FORMAT.size
+        self.stringOffsetStart = self.sizeStart + self.count * SIZE_FORMAT.size
+        self.stringStart = self.stringOffsetStart + (self.count + 1) * STRING_OFFSET_FORMAT.size
+        if len(data) < self.stringStart:
+            raise ValueError("DiskCache v.2 symbol index is truncated")
+        stringsEnd = STRING_OFFSET_FORMAT.unpack_from(
+            data, self.stringStart - STRING_OFFSET_FORMAT.size)[0]
+        if len(data) < self.stringStart + stringsEnd:
+            raise ValueError("DiskCache v.2 symbol index is truncated")
+        self.addresses = AddressArray(self)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(data)
+        except:
+            data.close()
+            raise
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def address(self, index):
+        return ADDRESS_FORMAT.unpack_from(self.data,
+                                          self.addressStart + index * ADDRESS_FORMAT.size)[0]
+
+    def size(self, index):
+        return SIZE_FORMAT.unpack_from(self.data, self.sizeStart + index * SIZE_FORMAT.size)[0]
+
+    def symbol(self, index):
+        position = self.stringOffsetStart + index * STRING_OFFSET_FORMAT.size
+        start = STRING_OFFSET_FORMAT.unpack_from(self.data, position)[0]
+        end = STRING_OFFSET_FORMAT.unpack_from(self.data,
+                                               position + STRING_OFFSET_FORMAT.size)[0]
+        return self.data[self.stringStart + start:self.stringStart + end]
+
+    def symbolRange(self, index):
+        """ Returns |start, end| of the range of offsets that resolve to the
+        symbol at |index|. See |symbolEnd|.
+        """
+        address = self.address(index)
+        nextAddress = self.address(index + 1) if index + 1 < self.count else None
+        return address, symbolEnd(address, self.size(index), nextAddress)
+
+    def find(self, offset):
+        """ Returns the index of the symbol with the greatest address that is less
+        than or equal to |offset|, or |None| if there is no such symbol.
+        """
+        index = bisect.bisect_right(self.addresses, offset) - 1
+        if index < 0:
+            return None
+        return index
+
+    def lookup(self, offsets):
+        """ Returns a dictionary mapping each offset in |offsets| that could be
+        resolved to |symbol, start, end|, where every offset from |start| up to
+        (but not including) |end| resolves to |symbol|. |end| is |None| if it is
+        not known.
+        """
+        symbols = {}
+        for offset in offsets:
+            index = self.find(offset)
+            if index is not None:
+                start, end = self.symbolRange(index)
+                symbols[offset] = (self.symbol(index), start, end)
+        return symbols
+
+
+class AddressArray:
+    """ Sequence view of the address array of a SymbolIndex so that it can be
+    searched with |bisect| without being read into memory.
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return self.index.address(i)
+
+
+def readSymMapV1(fp):
+    """ Reads the body of a "DiskCache v.1" file (after the first line) and
+    returns it as a symMap suitable for |writeSymbolIndex|.
+    """
+    symMap = {}
+    for line in fp:
+        line = line.rstrip()
+        if not line:
+            continue
+        address, symbol = line.split(" ", 1)
+        symMap[int(address.rstrip("L"), 16)] = (0, symbol)
+    return symMap
+
+
+def upgradeSymMapV1(path):
+    """ Rewrites the "DiskCache v.1" file at |path| in place as a v.2 index.
+    """
+    with open(path, 'rb') as fp:
+        fp.readline()
+        symMap = readSymMapV1(fp)
+    writeSymbolIndexFile(path, symMap)
+
+
+def buildSymbolIndex(sourcePath, destPath, libId):
+    """ Reads the raw symbol file at |sourcePath| and writes its v.2 index to
+    |destPath|.
+    """
+    builder = SymMapBuilder(libId)
+    with open(sourcePath, 'rb') as fp:
+        for chunk in iter(partial(fp.read, READ_CHUNK_SIZE), ""):
+            builder.write(chunk)
+    writeSymbolIndexFile(destPath, builder.finish())
+
+
+def lookupRawSymbols(path, offsets):
+    """ Resolves |offsets| from the raw symbol file at |path|. Returns a
+    dictionary mapping each offset that could be resolved to
+    |symbol, start, end| as described for |SymbolIndex.lookup|.
+    """
+    lookup = RawSymbolLookup(path, offsets)
+    with open(path, 'rb') as fp:
+        for chunk in iter(partial(fp.read, READ_CHUNK_SIZE), ""):
+            lookup.write(chunk)
+    return lookup.finish()
+
+
+def writeSymbolIndexFile(path, symMap):
+    """ Writes |symMap| to a temporary file which then replaces |path|, so that
+    a partially written index is never seen at |path|.
+    """
+    tempPath = path + ".tmp"
+    try:
+        with open(tempPath, 'wb') as fp:
+            writeSymbolIndex(fp, symMap)
+        os.rename(tempPath, path)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
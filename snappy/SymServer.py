@@ -7,13 +7,18 @@
 ################################################################################
 from logger import logger, logLevel
 from SymServer_Config import config
-from SymServer_RequestHandler import RequestHandler
+from SymServer_RequestHandler import RequestHandler, StatusHandler
 
 import sys
 import os
 import argparse
 import tornado.ioloop
 import tornado.web
+from tornado.httpclient import AsyncHTTPClient
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
 
 
 # Sets configuration and calls |runServer|
@@ -35,9 +40,11 @@ def main():
                         "prevent using any memcached server, use '-m None'. (default: {})"
                         .format(config['memcachedServers']))
     parser.add_argument('--diskCacheServer', '-d', metavar="ADDRESS",
-                        help="Sets the address of the disk cache server. It is required that "
-                        "SymServer be able to contact a disk cache server. (default: {})"
-                        .format(config['DiskCacheServer']))
+                        action="append", help="Adds an address to the list of disk cache "
+                        "servers. Modules are divided among the servers. If specified, the "
+                        "default address(es) will be discarded. This argument can be specified "
+                        "more than once. It is required that SymServer be able to contact a disk "
+                        "cache server. (default: {})".format(config['DiskCacheServer']))
     parser.add_argument('--logPath', '-l', metavar="PATH", help="The path to "
                         "save logs to. (default: {})"
                         .format(os.path.basename(config['log']['path'])))
@@ -74,7 +81,14 @@ def runServer():
                      maxFiles=config["log"]["maxFiles"],
                      maxFileBytes=config["log"]["maxFileSizeMB"] * 1024 * 1024)
     logger.log(logLevel.INFO, "Configuration loaded: {}".format(config))
-    app = tornado.web.Application([(r"/", RequestHandler)])
+    # The curl client keeps connections to DiskCache alive between requests, and
+    # lets DiskCacheClient abort requests that it no longer needs
+    if not pycurl:
+        logger.log(logLevel.CRITICAL, "pycurl is not installed. Install the packages in "
+                   "requirements.txt")
+        return 1
+    AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
+    app = tornado.web.Application([(r"/", RequestHandler), (r"/status", StatusHandler)])
     app.listen(config['port'])
     tornado.ioloop.IOLoop.current().start()
 
@@ -10,6 +10,29 @@ class Config(dict):
         self['port'] = 8080
         self['memcachedServers'] = ["127.0.0.1:11211"]
         self['DiskCacheServer'] = "127.0.0.1:8888"
+        self['DiskCacheServers'] = []
+        self['DiskCacheClient'] = {
+            'connectTimeoutMs': 2000,
+            'requestTimeoutMs': 60000,
+            'maxConnections': 20,
+            'virtualNodes': 160,
+            'ejectAfterFailures': 3,
+            'ejectionSec': 30,
+            'hedgePercentile': 95,
+            'hedgeMinSamples': 20
+        }
+        self['maxQueuedRequests'] = 0
+        self['requestDeadlineMs'] = 0
+        self['symbolicationThreads'] = 32
+        self['symbolCache'] = {
+            'maxEntries': 100000,
+            'ttlSec': 600
+        }
+        self['symbolRanges'] = {
+            'pageSize': 4096,
+            'maxPagesPerRange': 16,
+            'maxCachedPages': 20000
+        }
         self['log'] = {
             'path': "SymServer.log",
             'level': 30,
@@ -41,7 +64,7 @@ class Config(dict):
             else:
                 self['memcachedServers'] = args.memcachedServer
         if args.diskCacheServer is not None:
-            self['DiskCacheServer'] = args.diskCacheServer
+            self['DiskCacheServers'] = args.diskCacheServer
         if args.logPath is not None:
             self['log']['path'] = args.logPath
         if args.logLevel is not None:
@@ -54,7 +77,23 @@ class Config(dict):
 
     def sanitize(self):
         self['log']['path'] = os.path.realpath(self['log']['path'])
-        if (not self['DiskCacheServer'].startswith(("http://", "https://"))):
-            self['DiskCacheServer'] = "http://" + self['DiskCacheServer']
+        self['DiskCacheServer'] = serverURL(self['DiskCacheServer'])
+        self['DiskCacheServers'] = [
+            [serverURL(server) for server in shard] if isinstance(shard, list)
+            else serverURL(shard)
+            for shard in self['DiskCacheServers']]
+
+    def diskCacheShards(self):
+        """ Returns the URLs of the DiskCache servers to use, as a list of lists
+        of the replicas of each shard
+        """
+        shards = self['DiskCacheServers'] or [self['DiskCacheServer']]
+        return [shard if isinstance(shard, list) else [shard] for shard in shards]
+
+
+def serverURL(address):
+    if not address.startswith(("http://", "https://")):
+        return "http://" + address
+    return address
 
 config = Config()
@@ -0,0 +1,310 @@
+################################################################################
+# SymServer DiskCache client
+#
+# Sends the frames that SymServer could not find in its caches to DiskCache.
+# Requests are made asynchronously on the IOLoop, so that a slow or hung
+# DiskCache does not hold up a worker thread, and the number of connections to
+# DiskCache is limited by |DiskCacheClient.maxConnections|; requests beyond that
+# wait for a free connection.
+#
+# SymServer requires pycurl and configures Tornado to use its curl client, which
+# keeps connections to DiskCache alive between requests.
+#
+# When there is more than one DiskCache shard, each request is split by module
+# into one request per shard (see SymServer_DiskCacheCluster), which are sent
+# at the same time, and their responses are merged into one.
+#
+# Within a shard with replicas, the request goes to the replica that has been
+# the fastest lately. If it has not responded after |hedgeDelay|, the request is
+# also sent to the next fastest replica and whichever answers first is used. If
+# a replica fails, the request is sent to the next one that has not been tried
+# straight away, until one responds or all of them have failed. The request
+# that loses is aborted, so that it does not hold a connection, and is not
+# counted as a failure of its server.
+################################################################################
+from logger import logger, logLevel
+from SymServer_Config import config
+from SymServer_DiskCacheCluster import DiskCacheCluster
+
+import json
+import time
+import collections
+import tornado.gen
+import tornado.queues
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+# Only used by the curl client, which SymServer requires
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+# How long to wait for a response from DiskCache after the deadline of a request
+# has passed. DiskCache sends what it has resolved when the deadline passes, so
+# this only needs to cover the time it takes to send that.
+DEADLINE_GRACE_SEC = 1.0
+
+
+def isServerFailure(response, elapsed, timeout, capped):
+    """ Returns whether an unsuccessful |response| to a request with the given
+    |timeout|, which took |elapsed| seconds, counts against the server. Tornado
+    reports connection errors and timeouts as 599. A timeout only counts if the
+    request had the full |requestTimeoutMs|, since one that was |capped| by its
+    deadline says nothing about the server. A server that is shedding load
+    (503) is busy rather than broken, and other errors below 500 are about the
+    request.
+    """
+    if response.code == 599:
+        return not (capped and elapsed >= timeout)
+    return response.code >= 500 and response.code != 503
+
+
+class Abort:
+    """ Lets a request to DiskCache that is no longer needed be aborted, so that
+    it frees its connection rather than holding it until it times out. Tornado
+    has no way to abort a request, but curl aborts one when its progress
+    callback returns non-zero, which it calls often while it waits. Aborting
+    the |parent| Abort, if there is one, aborts this one too.
+    """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+    def isAborted(self):
+        return self.aborted or (self.parent is not None and self.parent.isAborted())
+
+    def prepareCurl(self, curl):
+        # Curl handles are reused, so this is set for every request
+        curl.setopt(pycurl.NOPROGRESS, 0)
+        curl.setopt(pycurl.PROGRESSFUNCTION, self.progress)
+
+    def progress(self, downloadTotal, downloaded, uploadTotal, uploaded):
+        return 1 if self.isAborted() else 0
+
+
+class DiskCacheClient:
+    def __init__(self):
+        """ Must be called on the IOLoop thread.
+        """
+        self.client = AsyncHTTPClient(force_instance=True,
+                                      max_clients=config['DiskCacheClient']['maxConnections'])
+        clientConfig = config['DiskCacheClient']
+        self.cluster = DiskCacheCluster(config.diskCacheShards(),
+                                        clientConfig['virtualNodes'],
+                                        clientConfig['ejectAfterFailures'],
+                                        clientConfig['ejectionSec'],
+                                        clientConfig['hedgePercentile'],
+                                        clientConfig['hedgeMinSamples'])
+        self.hedgedRequests = 0
+        self.hedgeWins = 0
+        self.failovers = 0
+
+    @tornado.gen.coroutine
+    def query(self, requestData, id, deadline=None, abort=None):
+        """ Returns DiskCache's response to |requestData|, or |None| if there was
+        no usable response. If |deadline| is given, DiskCache is asked to respond
+        by then. The frames of modules whose shard did not respond are left
+        unresolved. The request is aborted when |abort|, an Abort, is.
+        """
+        shards = self.splitRequest(requestData)
+        if len(shards) == 1:
+            shard = shards.keys()[0]
+            response = yield self.queryShard(shard, requestData, id, deadline, abort)
+            raise tornado.gen.Return(response)
+
+        responses = yield dict((shard, self.queryShard(shard, split[0], id, deadline, abort))
+                               for shard, split in shards.iteritems())
+        if not any(responses.itervalues()):
+            raise tornado.gen.Return(None)
+        response = self.makeResponseTemplate(requestData)
+        for shard, (shardRequest, moduleIndexes, frameIndexes) in shards.iteritems():
+            shardResponse = responses[shard]
+            if not shardResponse:
+                continue
+            for shardModuleIndex, moduleIndex in enumerate(moduleIndexes):
+                response['knownModules'][moduleIndex] = \
+                    shardResponse['knownModules'][shardModuleIndex]
+            shardRanges = shardResponse.get('symbolRanges')
+            for shardStackIndex, stackFrameIndexes in enumerate(frameIndexes):
+                shardStack = shardResponse['symbolicatedStacks'][shardStackIndex]
+                for shardFrameIndex, (stackIndex, frameIndex) in enumerate(stackFrameIndexes):
+                    response['symbolicatedStacks'][stackIndex][frameIndex] = \
+                        shardStack[shardFrameIndex]
+                    if shardRanges:
+                        response['symbolRanges'][stackIndex][frameIndex] = \
+                            shardRanges[shardStackIndex][shardFrameIndex]
+        raise tornado.gen.Return(response)
+
+    def splitRequest(self, requestData):
+        """ Splits |requestData| by the shard that each module belongs to.
+        Returns a dictionary mapping each shard to a tuple:
+        |request, moduleIndexes, frameIndexes| where |moduleIndexes| gives the
+        index in |requestData|'s memory map of each module of |request|, and
+        |frameIndexes| gives the |stackIndex, frameIndex| in |requestData| of
+        each frame of each stack of |request|.
+        """
+        memoryMap = requestData['memoryMap']
+        moduleShards = [self.cluster.shardFor(module) for module in memoryMap]
+        shards = {}
+        shardModuleIndexes = {}
+        for moduleIndex, shard in enumerate(moduleShards):
+            if shard not in shards:
+                shards[shard] = ({
+                    'stacks': [[] for stack in requestData['stacks']],
+                    'memoryMap': [],
+                    'version': requestData['version']
+                }, [], [[] for stack in requestData['stacks']])
+            shardRequest, moduleIndexes, frameIndexes = shards[shard]
+            shardModuleIndexes[moduleIndex] = len(moduleIndexes)
+            shardRequest['memoryMap'].append(memoryMap[moduleIndex])
+            moduleIndexes.append(moduleIndex)
+        if len(shards) == 1:
+            return shards
+        for stackIndex, stack in enumerate(requestData['stacks']):
+            for frameIndex, (moduleIndex, offset) in enumerate(stack):
+                shardRequest, moduleIndexes, frameIndexes = shards[moduleShards[moduleIndex]]
+                shardRequest['stacks'][stackIndex].append([shardModuleIndexes[moduleIndex],
+                                                           offset])
+                frameIndexes[stackIndex].append((stackIndex, frameIndex))
+        return shards
+
+    def makeResponseTemplate(self, requestData):
+        response = {
+            'symbolicatedStacks': [],
+            'symbolRanges': [],
+            'knownModules': [False] * len(requestData['memoryMap'])
+        }
+        memoryMap = requestData['memoryMap']
+        for stack in requestData['stacks']:
+            response['symbolicatedStacks'].append([
+                "{} (in {})".format(hex(offset), memoryMap[moduleIndex][0])
+                for moduleIndex, offset in stack])
+            response['symbolRanges'].append([None] * len(stack))
+        return response
+
+    def status(self):
+        return {
+            'diskCacheServers': self.cluster.status(),
+            'hedgedRequests': self.hedgedRequests,
+            'hedgeWins': self.hedgeWins,
+            'failovers': self.failovers
+        }
+
+    @tornado.gen.coroutine
+    def queryShard(self, shard, requestData, id, deadline, abort=None):
+        """ Returns the response of one of the replicas of |shard| to
+        |requestData|, or |None|. Each replica that fails is replaced by the
+        next one that has not been tried, until one responds or there are none
+        left. Once per request, a replica that is slow to respond is hedged by
+        sending the request to the next replica as well. Aborting |abort| aborts
+        the requests to all of the replicas.
+        """
+        replicas = collections.deque(self.cluster.replicasFor(shard))
+        # Maps the Future of each request in progress to its server and Abort
+        queries = {}
+        # Each request's Future is put here when it is done
+        finished = tornado.queues.Queue()
+
+        def send():
+            server = replicas.popleft()
+            replicaAbort = Abort(abort)
+            future = self.queryServer(server, requestData, id, deadline, replicaAbort)
+            queries[future] = (server, replicaAbort)
+            future.add_done_callback(finished.put_nowait)
+            return future, server
+
+        future, server = send()
+        hedge = None
+        hedgeTime = self.hedgeTime(shard, server)
+        while queries:
+            timeout = None
+            if hedge is None and hedgeTime is not None and replicas:
+                timeout = hedgeTime
+            try:
+                future = yield finished.get(timeout)
+            except tornado.gen.TimeoutError:
+                if abort is not None and abort.isAborted():
+                    hedgeTime = None
+                    continue
+                logger.log(logLevel.INFO, "{} DiskCache {} has not responded in time. Also "
+                           "sending the request to {}".format(id, server, replicas[0]))
+                self.hedgedRequests += 1
+                hedge = send()[0]
+                continue
+            failedServer, replicaAbort = queries.pop(future)
+            response = future.result()
+            if response is not None:
+                if future is hedge:
+                    self.hedgeWins += 1
+                # The replica that lost is not needed any more
+                for loserServer, loserAbort in queries.itervalues():
+                    loserAbort.abort()
+                raise tornado.gen.Return(response)
+            if queries or not replicas:
+                continue
+            if deadline is not None and deadline <= time.time():
+                break
+            if abort is not None and abort.isAborted():
+                break
+            logger.log(logLevel.INFO, "{} No response from DiskCache {}. Sending the "
+                       "request to {}".format(id, failedServer, replicas[0]))
+            self.failovers += 1
+            future, server = send()
+            hedgeTime = self.hedgeTime(shard, server)
+        raise tornado.gen.Return(None)
+
+    def hedgeTime(self, shard, server):
+        """ Returns the time at which a request that was just sent to |server|
+        should be hedged, or |None| if it should not be.
+        """
+        hedgeDelay = self.cluster.hedgeDelay(shard, server)
+        if hedgeDelay is None:
+            return None
+        return time.time() + hedgeDelay
+
+    @tornado.gen.coroutine
+    def queryServer(self, server, requestData, id, deadline, abort=None):
+        """ Returns the response of the DiskCache at |server| to |requestData|,
+        or |None|. The request is aborted when |abort|, an Abort, is.
+        """
+        # Every request sets its own progress callback, or it would inherit the
+        # one of the last request that used the same curl handle
+        abort = abort or Abort()
+        logger.log(logLevel.DEBUG, "{} Sending request to DiskCache {}: {}"
+                   .format(id, server, requestData))
+        headers = {}
+        timeout = config['DiskCacheClient']['requestTimeoutMs'] / 1000.0
+        # Whether the deadline left the request less than the usual timeout
+        capped = False
+        if deadline is not None:
+            remaining = max(deadline - time.time(), 0)
+            headers["X-Deadline-Ms"] = str(int(remaining * 1000))
+            if remaining + DEADLINE_GRACE_SEC < timeout:
+                timeout = remaining + DEADLINE_GRACE_SEC
+                capped = True
+        request = HTTPRequest(server, method="POST",
+                              body=json.dumps(requestData), headers=headers,
+                              connect_timeout=config['DiskCacheClient']['connectTimeoutMs'] /
+                              1000.0,
+                              request_timeout=timeout,
+                              prepare_curl_callback=abort.prepareCurl)
+        start = time.time()
+        response = yield self.client.fetch(request, raise_error=False)
+        if abort.isAborted():
+            logger.log(logLevel.DEBUG, "{} Aborted request to DiskCache {}".format(id, server))
+            raise tornado.gen.Return(None)
+        if response.code != 200:
+            logger.log(logLevel.WARNING, "{} Got HTTP Code {} when querying DiskCache {}: {}"
+                       .format(id, response.code, server, response.error))
+            if isServerFailure(response, time.time() - start, timeout, capped):
+                self.cluster.recordFailure(server)
+            raise tornado.gen.Return(None)
+        self.cluster.recordSuccess(server, time.time() - start)
+        try:
+            result = json.loads(response.body)
+        except ValueError as e:
+            logger.log(logLevel.ERROR, "{} Invalid response from DiskCache: {}".format(id, e))
+            raise tornado.gen.Return(None)
+        raise tornado.gen.Return(result)
@@ -0,0 +1,192 @@
+################################################################################
+# SymServer DiskCache cluster
+#
+# Decides which DiskCache server each module is sent to when SymServer is given
+# more than one. The servers are grouped into shards, each of which is either a
+# single server or a set of replicas that serve the same modules.
+#
+# Modules are assigned to shards with consistent hashing: every shard is placed
+# on a hash ring at |virtualNodes| points, and a module belongs to the shard at
+# the first point after the hash of its |libName/breakpadId|. Each shard then
+# caches a disjoint share of the modules, and adding or removing a shard only
+# moves the modules between it and its neighbours on the ring (about
+# 1 / number of shards of them). A shard is placed on the ring by the address
+# of its first server, so replicas can be added to it without moving modules.
+#
+# A server that fails |ejectAfterFailures| requests in a row is ejected for
+# |ejectionSec| seconds. While it is ejected, the other replicas of its shard are
+# used, and if there are none, its modules go to the next shard on the ring, so
+# the other shards' modules stay where they are. After that, requests are sent
+# to it again, and it is ejected again on the first failure.
+#
+# The response times of each server are tracked, so that requests go to the
+# replica that has been the fastest lately, and so that a request can be hedged
+# by sending it to a second replica when the first has taken longer than most
+# of its recent responses (see |hedgeDelay|).
+#
+# Must only be used from the IOLoop thread.
+################################################################################
+from logger import logger, logLevel
+
+import time
+import math
+import bisect
+import hashlib
+import collections
+
+# The number of recent response times kept for each server
+LATENCY_SAMPLES = 200
+# The weight of a new response time in a server's average response time
+LATENCY_AVERAGE_WEIGHT = 0.2
+
+
+def ringHash(key):
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+def percentile(latencies, percent):
+    latencies = sorted(latencies)
+    index = int(math.ceil(len(latencies) * percent / 100.0)) - 1
+    return latencies[min(max(index, 0), len(latencies) - 1)]
+
+
+class HashRing:
+    def __init__(self, nodes, virtualNodes):
+        self.nodes = list(nodes)
+        points = []
+        for node in self.nodes:
+            for i in xrange(max(virtualNodes, 1)):
+                points.append((ringHash("{}#{}".format(node, i)), node))
+        points.sort()
+        self.hashes = [point[0] for point in points]
+        self.owners = [point[1] for point in points]
+
+    def iterNodes(self, key):
+        """ Yields each node once, starting with the one that owns |key| and
+        going around the ring from there.
+        """
+        start = bisect.bisect(self.hashes, ringHash(key))
+        seen = set()
+        for i in xrange(len(self.owners)):
+            node = self.owners[(start + i) % len(self.owners)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class ServerStats:
+    def __init__(self):
+        # The number of requests that failed in a row
+        self.failures = 0
+        # The time that an ejected server may be tried again
+        self.ejectedUntil = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.averageLatency = None
+
+    def addLatency(self, latency):
+        self.latencies.append(latency)
+        if self.averageLatency is None:
+            self.averageLatency = latency
+        else:
+            self.averageLatency += LATENCY_AVERAGE_WEIGHT * (latency - self.averageLatency)
+
+
+class DiskCacheCluster:
+    def __init__(self, shards, virtualNodes, ejectAfterFailures, ejectionSec,
+                 hedgePercentile, hedgeMinSamples):
+        """ |shards| is a list of lists of server addresses, one per shard.
+        """
+        # Maps the name of each shard on the ring to its servers
+        self.shards = collections.OrderedDict((servers[0], servers) for servers in shards)
+        self.ring = HashRing(self.shards.keys(), virtualNodes)
+        self.ejectAfterFailures = ejectAfterFailures
+        self.ejectionSec = ejectionSec
+        self.hedgePercentile = hedgePercentile
+        self.hedgeMinSamples = hedgeMinSamples
+        self.stats = {}
+        for servers in shards:
+            for server in servers:
+                self.stats[server] = ServerStats()
+
+    def isEjected(self, server, now):
+        return self.stats[server].ejectedUntil > now
+
+    def shardFor(self, module):
+        """ Returns the name of the shard that |module|, a |libName, breakpadId|
+        tuple, should be sent to.
+        """
+        now = time.time()
+        owner = None
+        for shard in self.ring.iterNodes("{}/{}".format(module[0], module[1])):
+            if owner is None:
+                owner = shard
+            if any(not self.isEjected(server, now) for server in self.shards[shard]):
+                return shard
+        # Every server is ejected. Try the module's own shard anyway
+        return owner
+
+    def replicasFor(self, shard):
+        """ Returns the servers of |shard| that are not ejected (or all of them,
+        if they all are) in the order they should be tried: fastest first.
+        Servers that have not responded yet are tried first, so that they get
+        measured.
+        """
+        now = time.time()
+        servers = [server for server in self.shards[shard] if not self.isEjected(server, now)]
+        return sorted(servers or self.shards[shard],
+                      key=lambda server: self.stats[server].averageLatency)
+
+    def hedgeDelay(self, shard, server):
+        """ Returns how many seconds to wait for a response from |server| before
+        sending the request to another replica of |shard| as well, or |None| if
+        requests to it are not hedged. If too few requests have been sent to
+        |server| to tell, the response times of all of the shard's servers are
+        used.
+        """
+        if self.hedgePercentile <= 0:
+            return None
+        latencies = self.stats[server].latencies
+        if len(latencies) < self.hedgeMinSamples:
+            latencies = [latency for shardServer in self.shards[shard]
+                         for latency in self.stats[shardServer].latencies]
+            if len(latencies) < self.hedgeMinSamples:
+                return None
+        return percentile(latencies, self.hedgePercentile)
+
+    def recordSuccess(self, server, latency):
+        stats = self.stats[server]
+        stats.addLatency(latency)
+        stats.failures = 0
+        if stats.ejectedUntil:
+            stats.ejectedUntil = 0
+            logger.log(logLevel.INFO, "DiskCache server {} is back".format(server))
+
+    def recordFailure(self, server):
+        stats = self.stats[server]
+        stats.failures += 1
+        if self.ejectAfterFailures > 0 and stats.failures >= self.ejectAfterFailures:
+            now = time.time()
+            if stats.ejectedUntil <= now:
+                logger.log(logLevel.WARNING, "Ejecting DiskCache server {} for {}s after {} "
+                           "failed requests".format(server, self.ejectionSec, stats.failures))
+            stats.ejectedUntil = now + self.ejectionSec
+
+    def status(self):
+        now = time.time()
+        status = []
+        for shard, servers in self.shards.iteritems():
+            for server in servers:
+                stats = self.stats[server]
+                hedgeDelay = self.hedgeDelay(shard, server)
+                status.append({
+                    'server': server,
+                    'shard': shard,
+                    'failures': stats.failures,
+                    'ejected': self.isEjected(server, now),
+                    'averageLatencyMs': (None if stats.averageLatency is None else
+                                         int(stats.averageLatency * 1000)),
+                    'hedgeDelayMs': None if hedgeDelay is None else int(hedgeDelay * 1000)
+                })
+        return status
@@ -1,19 +1,46 @@
 from logger import logger, logLevel
 from validateRequest import validateRequest
-from SymServer_Symbolicator import symbolicator
+from SymServer_Symbolicator import symbolicator, Cancellation
+from SymServer_Config import config
+from requestLimiter import RequestLimiter
 
 import json
 import uuid
 import tornado.web
 import sys
+import time
 import traceback
 
+requestLimiter = RequestLimiter()
+
 
 class RequestHandler(tornado.web.RequestHandler):
     def prepare(self):
         xForwardIp = self.request.headers.get("X-Forwarded-For")
         self.remoteIP = self.request.remote_ip if not xForwardIp else xForwardIp
         self.requestId = uuid.uuid4()
+        self.cancelled = Cancellation()
+
+    def on_connection_close(self):
+        self.log(logLevel.INFO, "Client closed the connection. Cancelling request")
+        self.cancelled.set()
+
+    # Returns the time by which the response should be sent, or |None| if there
+    # is no deadline. Clients may ask for an earlier deadline than the configured
+    # one with the X-Deadline-Ms header.
+    def getDeadline(self):
+        deadline = None
+        if config['requestDeadlineMs'] > 0:
+            deadline = time.time() + config['requestDeadlineMs'] / 1000.0
+        deadlineMs = self.request.headers.get("X-Deadline-Ms")
+        if deadlineMs is not None:
+            try:
+                requested = time.time() + int(deadlineMs) / 1000.0
+                deadline = requested if deadline is None else min(deadline, requested)
+            except ValueError:
+                self.log(logLevel.WARNING, "Ignoring invalid X-Deadline-Ms header: {}"
+                         .format(deadlineMs))
+        return deadline
 
     def log(self, level, message):
         logger.log(level, "{} {}".format(self.requestId, message), remoteIP=self.remoteIP)
@@ -49,6 +76,20 @@ class RequestHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def post(self):
+        if not requestLimiter.admit(config['maxQueuedRequests']):
+            retryAfter = requestLimiter.retryAfter()
+            self.log(logLevel.INFO, "Too many requests in progress. Rejecting request. "
+                     "Retry after {} seconds".format(retryAfter))
+            self.sendHeaders(503)
+            self.set_header("Retry-After", str(retryAfter))
+            return
+        try:
+            yield self.handleRequest()
+        finally:
+            requestLimiter.release()
+
+    @tornado.gen.coroutine
+    def handleRequest(self):
         uri = self.request.uri
 
         self.log(logLevel.INFO, "Processing POST request: {}".format(uri))
@@ -64,7 +105,8 @@ class RequestHandler(tornado.web.RequestHandler):
                 self.sendHeaders(400)
                 return
 
-            response = yield symbolicator.symbolicate(requestBody, self.requestId)
+            response = yield symbolicator.symbolicate(requestBody, self.requestId,
+                                                      self.getDeadline(), self.cancelled)
             response = json.dumps(response)
         except Exception as e:
             ex_type, ex, tb = sys.exc_info()
@@ -74,6 +116,10 @@ class RequestHandler(tornado.web.RequestHandler):
             self.sendHeaders(400)
             return
 
+        if self.cancelled.is_set():
+            self.log(logLevel.INFO, "Client closed the connection. Response not sent")
+            return
+
         try:
             self.sendHeaders(200)
             self.log(logLevel.DEBUG, "Response: {}".format(response))
@@ -83,3 +129,15 @@ class RequestHandler(tornado.web.RequestHandler):
             return
 
         self.log(logLevel.INFO, "Response sent")
+
+
+class StatusHandler(tornado.web.RequestHandler):
+    """ Reports how busy the server is. Responds with 503 while new requests
+    would be rejected, so that load balancers can route around the server.
+    """
+    def get(self):
+        status = requestLimiter.status(config['maxQueuedRequests'])
+        status.update(symbolicator.stats())
+        self.set_status(503 if status['saturated'] else 200)
+        self.set_header("Content-type", "application/json")
+        self.write(json.dumps(status))
@@ -1,15 +1,19 @@
 from logger import logger, logLevel
 from SymServer_Config import config
+from SymServer_DiskCacheClient import DiskCacheClient, Abort
 
 import sys
-import json
+import time
+import bisect
 import threading
-from concurrent.futures import Future
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import memcache
 import urllib
-import urllib2
-import contextlib
 import traceback
+import tornado.gen
+import tornado.concurrent
 
 
 class Symbolicator:
@@ -17,7 +21,23 @@ class Symbolicator:
         # Don't init anything that needs config now, because it may not be ready yet
         self.initialized = False
         self.memcache = None
+        self.symbolCache = None
+        self.rangePageCache = None
+        self.diskCacheClient = None
         self.outputCacheHits = False
+        # The blocking parts of symbolication (the memcached client is blocking)
+        # are done by a fixed number of worker threads. Jobs wait in the pool's
+        # queue until a worker is free.
+        self.pool = None
+        self.jobLock = threading.Lock()
+        self.queuedJobs = 0
+        self.activeJobs = 0
+        # Maps the |moduleOffsetId| of each frame that is being fetched from
+        # DiskCache to |future, deadline, fetch| where |future| is a Future for
+        # its symbol and range, |deadline| is that of the fetch and |fetch| is
+        # its DiskCacheFetch, so that concurrent requests for the same frames
+        # share one fetch. Only used on the IOLoop thread.
+        self.inFlight = {}
 
     def initialize(self):
         self.initialized = True
@@ -25,36 +45,305 @@ class Symbolicator:
             self.memcache = memcache.Client(config['memcachedServers'], debug=0)
         else:
             self.memcache = None
+        self.symbolCache = SymbolCache(config['symbolCache']['maxEntries'],
+                                       config['symbolCache']['ttlSec'])
+        # Range pages have their own budget so that they never evict symbols
+        self.rangePageCache = SymbolCache(config['symbolRanges']['maxCachedPages'],
+                                          config['symbolCache']['ttlSec'])
+        self.diskCacheClient = DiskCacheClient()
+        self.pool = ThreadPoolExecutor(max_workers=config['symbolicationThreads'])
 
-    def symbolicate(self, request, id):
+    @tornado.gen.coroutine
+    def symbolicate(self, request, id, deadline=None, cancelled=None):
+        """ Returns a Future for the response to |request|. Must be called on the
+        IOLoop thread. If |deadline| (a time as returned by |time.time|) passes,
+        the response has whatever could be resolved until then. If |cancelled|
+        (a Cancellation) is set, work on the request stops as soon as possible.
+        """
         if not self.initialized:
             self.initialize()
-        future = Future()
         if 'debug' in request:
             action = request['action']
             if action == "outputCacheHits":
                 self.outputCacheHits = bool(request['enabled'])
                 logger.log(logLevel.WARNING, "{} outputCacheHits set to: {}"
                            .format(id, self.outputCacheHits))
-                future.set_result({"success": True})
-                return future
+                raise tornado.gen.Return({"success": True})
+            if action == "symbolCacheStats":
+                stats = self.symbolCache.stats()
+                stats['rangePages'] = self.rangePageCache.stats()
+                raise tornado.gen.Return(stats)
+            if action == "symbolCacheFlush":
+                self.symbolCache.flush()
+                self.rangePageCache.flush()
+                logger.log(logLevel.WARNING, "{} Symbol cache flushed".format(id))
+                raise tornado.gen.Return({"success": True})
             # If the action was not recognized, fall through to let the symbolication
-            # thread handle it
-        symbolicationThread = SymbolicationThread(request, future, self.memcache,
-                                                  id, self.outputCacheHits)
-        symbolicationThread.start()
-        return future
+            # job handle it
+        job = SymbolicationJob(request, self.memcache, self.symbolCache, self.rangePageCache,
+                               id, self.outputCacheHits, cancelled)
+        if 'debug' in request:
+            yield self.runJob(job.debugRequest)
+            raise tornado.gen.Return(job.response)
+
+        unresolvedFrames = yield self.runJob(job.lookupCachedSymbols)
+        if unresolvedFrames:
+            if cancelled and cancelled.is_set():
+                job.log(logLevel.DEBUG, "Job was cancelled")
+            elif deadline is not None and deadline <= time.time():
+                job.log(logLevel.INFO, "Deadline passed. Not querying DiskCache")
+            else:
+                symbols, fetched = yield self.resolveFromDiskCache(unresolvedFrames, id,
+                                                                   deadline, cancelled)
+                if cancelled and cancelled.is_set():
+                    job.log(logLevel.DEBUG, "Job was cancelled")
+                elif symbols:
+                    yield self.runJob(job.addSymbols, symbols, fetched)
+        raise tornado.gen.Return(job.getResponse())
+
+    # Gets the symbols of |frames|, a list of |moduleOffsetId, module, offset|
+    # tuples, from DiskCache. Frames that other requests are already fetching
+    # are not fetched again, as long as those fetches have at least as much
+    # time as this one; their results are shared. Returns a dictionary
+    # mapping the |moduleOffsetId| of each frame whose module DiskCache knows
+    # to its symbol, and a dictionary mapping the |moduleOffsetId| of each of
+    # those that were fetched by this call to the |start, end| of the range of
+    # offsets that resolve to its symbol, or |None| if DiskCache did not say.
+    # If |cancelled| is set, this stops waiting and returns what it has, and
+    # fetches that no other request is waiting for are aborted.
+    @tornado.gen.coroutine
+    def resolveFromDiskCache(self, frames, id, deadline, cancelled=None):
+        joined = {}
+        toFetch = []
+        for frame in frames:
+            entry = self.inFlight.get(frame[0])
+            if entry and deadlineNoEarlier(entry[1], deadline):
+                joined[frame[0]] = entry
+            else:
+                # A fetch with an earlier deadline would only give this
+                # request what it resolved by then
+                toFetch.append(frame)
+
+        fetches = set(value[2] for value in joined.itervalues())
+        for fetch in fetches:
+            fetch.waiting += 1
+        owned = {}
+        if toFetch:
+            fetch = DiskCacheFetch()
+            fetches.add(fetch)
+            for frame in toFetch:
+                owned[frame[0]] = tornado.concurrent.Future()
+                self.inFlight[frame[0]] = (owned[frame[0]], deadline, fetch)
+            self.fetchFromDiskCache(toFetch, owned, id, deadline, fetch)
+
+        try:
+            # DiskCache responds to this request's own fetch shortly after the
+            # deadline with what it has, so only waiting for other requests'
+            # fetches is cut off at the deadline
+            yield self.waitForFrames(owned.values(), None, cancelled)
+            if joined and not (cancelled and cancelled.is_set()):
+                logger.log(logLevel.DEBUG, "{} Waiting for {} frames that other requests are "
+                           "fetching from DiskCache".format(id, len(joined)))
+                finished = yield self.waitForFrames([value[0] for value in joined.itervalues()],
+                                                    deadline, cancelled)
+                if not finished and not (cancelled and cancelled.is_set()):
+                    logger.log(logLevel.INFO, "{} Deadline passed while waiting for frames "
+                               "fetched by other requests".format(id))
+        finally:
+            for fetch in fetches:
+                self.releaseFetch(fetch)
+        if cancelled and cancelled.is_set():
+            logger.log(logLevel.DEBUG, "{} Stopped waiting for DiskCache".format(id))
+
+        symbols = {}
+        fetched = {}
+        for moduleOffsetId, future in owned.iteritems():
+            if future.done() and future.result() is not None:
+                symbols[moduleOffsetId], fetched[moduleOffsetId] = future.result()
+        for moduleOffsetId, entry in joined.iteritems():
+            if entry[0].done() and entry[0].result() is not None:
+                symbols[moduleOffsetId] = entry[0].result()[0]
+        raise tornado.gen.Return((symbols, fetched))
+
+    # Fetches |frames|, a list of |moduleOffsetId, module, offset| tuples, from
+    # DiskCache for |fetch| and sets the Future in |futures| of each frame, by
+    # its |moduleOffsetId|, to |symbol, range| or |None| if it was not resolved.
+    # Runs on its own, so that the requests that wait for it can stop waiting.
+    @tornado.gen.coroutine
+    def fetchFromDiskCache(self, frames, futures, id, deadline, fetch):
+        results = {}
+        try:
+            subRequest = self.makeSubRequest(frames)
+            cacheResponse = yield self.diskCacheClient.query(subRequest, id, deadline,
+                                                             fetch.abort)
+            if cacheResponse:
+                stack = cacheResponse['symbolicatedStacks'][0]
+                knownModules = cacheResponse['knownModules']
+                # Older versions of DiskCache do not send symbol ranges
+                ranges = cacheResponse.get('symbolRanges', [[None] * len(stack)])[0]
+                for index, frame in enumerate(subRequest['stacks'][0]):
+                    if knownModules[frame[0]]:
+                        results[frames[index][0]] = (stack[index], ranges[index])
+            elif fetch.abort.aborted:
+                logger.log(logLevel.DEBUG, "{} DiskCache request aborted".format(id))
+            else:
+                logger.log(logLevel.ERROR, "{} Bad response from DiskCache".format(id))
+        except Exception as e:
+            logger.log(logLevel.ERROR, "{} Exception when querying DiskCache: {}"
+                       .format(id, e))
+        finally:
+            for moduleOffsetId, future in futures.iteritems():
+                # A request with a later deadline may have taken over
+                if self.inFlight.get(moduleOffsetId, (None,))[0] is future:
+                    del self.inFlight[moduleOffsetId]
+                future.set_result(results.get(moduleOffsetId))
+
+    # Returns a Future that resolves to |True| when all of |futures| are done,
+    # or to |False| if |deadline| passes or |cancelled| is set first
+    @tornado.gen.coroutine
+    def waitForFrames(self, futures, deadline, cancelled):
+        if not futures:
+            raise tornado.gen.Return(True)
+        wait = tornado.gen.multi(futures)
+        if cancelled:
+            wait = tornado.gen.WaitIterator(wait, cancelled.future).next()
+        try:
+            if deadline is None:
+                yield wait
+            else:
+                yield tornado.gen.with_timeout(deadline, wait)
+        except tornado.gen.TimeoutError:
+            raise tornado.gen.Return(False)
+        raise tornado.gen.Return(not (cancelled and cancelled.is_set()))
+
+    # Called by each request that waited for |fetch| when it stops waiting.
+    # Once no request is waiting for it, the fetch is aborted if it is still in
+    # progress, and its frames are no longer offered to other requests.
+    def releaseFetch(self, fetch):
+        fetch.waiting -= 1
+        if fetch.waiting > 0:
+            return
+        fetch.abort.abort()
+        for moduleOffsetId, inFlight in self.inFlight.items():
+            if inFlight[2] is fetch:
+                del self.inFlight[moduleOffsetId]
+
+    # Returns a request for DiskCache for |frames|, a list of
+    # |moduleOffsetId, module, offset| tuples. The request has a single stack
+    # with the frames in the same order.
+    def makeSubRequest(self, frames):
+        subRequest = {
+            'stacks': [[]],
+            'memoryMap': [],
+            'version': 4
+        }
+        subRequestModuleIndex = {}
+        for moduleOffsetId, module, offset in frames:
+            if module not in subRequestModuleIndex:
+                subRequest['memoryMap'].append(module)
+                subRequestModuleIndex[module] = len(subRequest['memoryMap']) - 1
+            subRequest['stacks'][0].append([subRequestModuleIndex[module], offset])
+        return subRequest
+
+    # Returns a Future for the result of calling |function| with |args| on a
+    # worker thread
+    def runJob(self, function, *args):
+        with self.jobLock:
+            self.queuedJobs += 1
+        return self.pool.submit(self.jobWorker, function, *args)
+
+    # Runs on a worker thread
+    def jobWorker(self, function, *args):
+        with self.jobLock:
+            self.queuedJobs -= 1
+            self.activeJobs += 1
+        try:
+            return function(*args)
+        except Exception as e:
+            ex_type, ex, tb = sys.exc_info()
+            stack = traceback.extract_tb(tb)
+            logger.log(logLevel.ERROR,
+                       "Job caught exception while symbolicating: {}: {} STACK: {}"
+                       .format(ex_type, e, stack))
+            raise
+        finally:
+            with self.jobLock:
+                self.activeJobs -= 1
+
+    def stats(self):
+        if not self.initialized:
+            self.initialize()
+        with self.jobLock:
+            stats = {
+                'symbolicationThreads': config['symbolicationThreads'],
+                'queuedJobs': self.queuedJobs,
+                'activeJobs': self.activeJobs
+            }
+        stats.update(self.diskCacheClient.status())
+        return stats
+
+
+def deadlineNoEarlier(deadline, otherDeadline):
+    """ Returns |True| if |deadline| is no earlier than |otherDeadline|, where
+    |None| means there is no deadline.
+    """
+    if deadline is None:
+        return True
+    return otherDeadline is not None and deadline >= otherDeadline
+
+
+class Cancellation:
+    """ Set when the client of a request goes away. Like a |threading.Event|, it
+    can be checked from any thread, and |future| is done once it is set so that
+    it can also be waited for on the IOLoop. Must be set on the IOLoop thread.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.future = tornado.concurrent.Future()
+
+    def set(self):
+        self.event.set()
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def is_set(self):
+        return self.event.is_set()
+
+
+class DiskCacheFetch:
+    """ A request to DiskCache that one or more symbolication requests are
+    waiting for. It is aborted once none of them are waiting any more.
+    """
+    def __init__(self):
+        self.abort = Abort()
+        # The number of requests waiting for the fetch
+        self.waiting = 1
 
 
-class SymbolicationThread(threading.Thread):
-    def __init__(self, request, future, memcache, id, outputCacheHits):
-        threading.Thread.__init__(self)
+class SymbolicationJob:
+    """ The symbolication of a single request. Its methods are called on the
+    worker threads of the Symbolicator's pool, in turn, while the Symbolicator
+    queries DiskCache on the IOLoop in between.
+    """
+    def __init__(self, request, memcache, symbolCache, rangePageCache, id, outputCacheHits,
+                 cancelled=None):
         self.request = request
-        self.future = future
         self.memcache = memcache
+        self.symbolCache = symbolCache
+        self.rangePageCache = rangePageCache
         self.id = id
         self.outputCacheHits = outputCacheHits
+        self.cancelled = cancelled
         self.response = self.makeResponseTemplate()
+        # Maps the |moduleOffsetId| of each distinct frame that was not in
+        # memcached to the frames that have it, as in |framesByKey|
+        self.unresolvedFrames = {}
+        # Maps the |moduleOffsetId| of each distinct frame to its module's key
+        # prefix and its offset
+        self.frameAddresses = {}
+        # The symbol range pages that have been read, by key. See |rangePageKey|
+        self.rangePages = {}
+        self.rangePageSize = config['symbolRanges']['pageSize']
 
     def log(self, level, message):
         # Put the id at the beginning of all log messages
@@ -84,121 +373,211 @@ class SymbolicationThread(threading.Thread):
                 response['cacheHits'].append(hitsInStack)
         return response
 
-    def run(self):
-        try:
-            if 'debug' in self.request:
-                self.debugRequest()
-                response = self.response
-            else:
-                self.symbolicateRequest()
-                response = self.response
-                if self.request['version'] == 3:
-                    response = response['symbolicatedStacks']
+    def getResponse(self):
+        if self.request['version'] == 3:
+            return self.response['symbolicatedStacks']
+        return self.response
 
-            self.future.set_result(response)
-        except Exception as e:
-            ex_type, ex, tb = sys.exc_info()
-            stack = traceback.extract_tb(tb)
-            self.log(logLevel.ERROR,
-                     "Thread caught exception while symbolicating: {}: {} STACK: {}"
-                     .format(ex_type, e, stack))
-            self.future.set_exception(e)
+    # Resolves the frames that are in the symbol cache or memcached, either by
+    # their exact offset or because they are in the range of a symbol that was
+    # resolved before. Returns a list of |moduleOffsetId, module, offset| of the
+    # distinct frames that are not, which must be fetched from DiskCache.
+    def lookupCachedSymbols(self):
+        if self.cancelled and self.cancelled.is_set():
+            # The client went away while the job was waiting for a worker
+            self.log(logLevel.DEBUG, "Job was cancelled before it started")
+            return []
 
-    def symbolicateRequest(self):
-        subRequest = {
-            'stacks': [[]],
-            'memoryMap': [],
-            'version': 4
-        }
-        subRequestStack = subRequest['stacks'][0]
-        subRequestMemoryMap = subRequest['memoryMap']
-        subRequestModuleIndex = {}
         unresolvedFrames = []
         memoryMap = self.request['memoryMap']
         responseStack = self.response['symbolicatedStacks']
         responseKnownModules = self.response['knownModules']
 
-        runIt = self.future.set_running_or_notify_cancel()
-        if not runIt:
-            self.log(logLevel.DEBUG, "Thread work was cancelled")
-            return
+        # Maps the memcached key of each distinct |module, offset| in the request
+        # to the frames that have it, each given as a tuple:
+        # |stackIndex, frameIndex, moduleIndex|
+        framesByKey = collections.OrderedDict()
+        keyPrefixes = {}
         for stackIndex, stack in enumerate(self.request['stacks']):
             for frameIndex, frame in enumerate(stack):
                 moduleIndex, offset = frame
                 if moduleIndex < 0:
                     continue
+                keyPrefix = keyPrefixes.get(moduleIndex)
+                if keyPrefix is None:
+                    keyPrefix = self.moduleKeyPrefix(memoryMap[moduleIndex])
+                    keyPrefixes[moduleIndex] = keyPrefix
+                moduleOffsetId = keyPrefix + str(offset)
+                framesByKey.setdefault(moduleOffsetId, []).append(
+                    (stackIndex, frameIndex, moduleIndex))
+                self.frameAddresses[moduleOffsetId] = (keyPrefix, offset)
 
-                module = memoryMap[moduleIndex]
-                module = (module[0], module[1])  # Lists can't be hashed. Tuples can.
-                moduleOffsetId = self.moduleOffsetId(module, offset)
+        # The range pages of the frames are looked up along with the frames
+        pageKeys = set()
+        if self.rangePageSize > 0:
+            for keyPrefix, offset in self.frameAddresses.itervalues():
+                pageKeys.add(self.rangePageKey(keyPrefix, offset // self.rangePageSize))
+        cacheResults = self.getCachedValues(framesByKey.keys(), list(pageKeys))
+        for pageKey in pageKeys:
+            self.rangePages[pageKey] = cacheResults.get(pageKey, [])
 
-                cacheResult = None
-                if self.memcache:
-                    cacheResult = self.memcache.get(moduleOffsetId)
-                if cacheResult is not None:
+        for moduleOffsetId, frames in framesByKey.iteritems():
+            cacheResult = cacheResults.get(moduleOffsetId)
+            if cacheResult is None and self.rangePageSize > 0:
+                keyPrefix, offset = self.frameAddresses[moduleOffsetId]
+                pageKey = self.rangePageKey(keyPrefix, offset // self.rangePageSize)
+                symbolRange = findSymbolRange(self.rangePages[pageKey], offset)
+                if symbolRange:
+                    cacheResult = symbolRange[2]
+            if cacheResult is not None:
+                for stackIndex, frameIndex, moduleIndex in frames:
                     responseStack[stackIndex][frameIndex] = cacheResult
                     responseKnownModules[moduleIndex] = True
                     if self.outputCacheHits:
                         self.response['cacheHits'][stackIndex][frameIndex] = True
-                    continue
+                continue
 
-                # Cache miss. Need to get the value from the DiskCache
-                subRequestStack.append(frame[:])
-                subRequestIndex = len(subRequestStack) - 1
-                unresolvedFrames.append((stackIndex, frameIndex, moduleIndex, subRequestIndex))
-                if module not in subRequestModuleIndex:
-                    # Need to add this module to the subRequest memory map
-                    subRequestMemoryMap.append(module)
-                    subRequestModuleIndex[module] = len(subRequestMemoryMap) - 1
-                subRequestStack[subRequestIndex][0] = subRequestModuleIndex[module]
+            # Cache miss. Need to get the value from the DiskCache. Frames that
+            # are the same are only fetched once.
+            stackIndex, frameIndex, moduleIndex = frames[0]
+            module = memoryMap[moduleIndex]
+            module = (module[0], module[1])  # Lists can't be hashed. Tuples can.
+            offset = self.request['stacks'][stackIndex][frameIndex][1]
+            self.unresolvedFrames[moduleOffsetId] = frames
+            unresolvedFrames.append((moduleOffsetId, module, offset))
 
         if unresolvedFrames:
-            self.log(logLevel.INFO, "{} frames in not in memcached"
+            self.log(logLevel.INFO, "{} distinct frames not in memcached"
                      .format(len(unresolvedFrames)))
+        return unresolvedFrames
 
-            cacheResponse = self.queryDiskCache(subRequest)
-            if cacheResponse:
-                stack = cacheResponse['symbolicatedStacks'][0]
-                knownModules = cacheResponse['knownModules']
-                for frame in unresolvedFrames:
-                    stackIndex, frameIndex, moduleIndex, subRequestIndex = frame
-                    module = memoryMap[moduleIndex]
-                    module = (module[0], module[1])  # Lists can't be hashed. Tuples can.
-                    moduleKnown = knownModules[subRequestModuleIndex[module]]
-                    if moduleKnown:
-                        symbol = stack[subRequestIndex]
-                        offset = self.request['stacks'][stackIndex][frameIndex][1]
-                        moduleOffsetId = self.moduleOffsetId(module, offset)
-                        responseStack[stackIndex][frameIndex] = symbol
-                        responseKnownModules[moduleIndex] = True
-                        if self.memcache:
-                            self.memcache.add(moduleOffsetId, symbol)
-            else:
-                self.log(logLevel.ERROR, "Bad response from DiskCache")
+    # Returns a dictionary of the values of the symbol keys |keys| and the range
+    # page keys |pageKeys| that are in the in-process caches or memcached. The
+    # in-process caches are checked first, and memcached for what is not in
+    # them, in a single query.
+    def getCachedValues(self, keys, pageKeys=()):
+        cacheResults = self.symbolCache.getMulti(keys)
+        cacheResults.update(self.rangePageCache.getMulti(pageKeys))
+        missingKeys = [key for key in itertools.chain(keys, pageKeys) if key not in cacheResults]
+        if self.memcache and missingKeys:
+            memcacheResults = self.memcache.get_multi(missingKeys)
+            self.symbolCache.setMulti(dict((key, memcacheResults[key]) for key in keys
+                                           if key in memcacheResults))
+            self.rangePageCache.setMulti(dict((key, memcacheResults[key]) for key in pageKeys
+                                              if key in memcacheResults))
+            cacheResults.update(memcacheResults)
+        return cacheResults
 
-    def moduleOffsetId(self, module, offset):
+    # Resolves the frames that were not in memcached from |symbols|, which maps
+    # their |moduleOffsetId| to their symbol. The symbols of the frames in
+    # |newSymbols|, which maps their |moduleOffsetId| to the |start, end| of
+    # their symbol's range or |None|, are also added to the symbol cache and
+    # memcached, along with their ranges.
+    def addSymbols(self, symbols, newSymbols):
+        responseStack = self.response['symbolicatedStacks']
+        responseKnownModules = self.response['knownModules']
+        newCacheEntries = {}
+        newRanges = []
+        for moduleOffsetId, symbol in symbols.iteritems():
+            for stackIndex, frameIndex, moduleIndex in self.unresolvedFrames[moduleOffsetId]:
+                responseStack[stackIndex][frameIndex] = symbol
+                responseKnownModules[moduleIndex] = True
+            if moduleOffsetId in newSymbols:
+                newCacheEntries[moduleOffsetId] = symbol
+                symbolRange = newSymbols[moduleOffsetId]
+                if symbolRange and symbolRange[1] is not None:
+                    keyPrefix = self.frameAddresses[moduleOffsetId][0]
+                    newRanges.append((keyPrefix, symbolRange[0], symbolRange[1], symbol))
+        updatedPages = self.addSymbolRanges(newRanges)
+        self.symbolCache.setMulti(newCacheEntries)
+        self.rangePageCache.setMulti(updatedPages)
+        newCacheEntries.update(updatedPages)
+        if self.memcache and newCacheEntries:
+            self.memcache.set_multi(newCacheEntries)
+
+    # Adds |ranges|, a list of |keyPrefix, start, end, symbol| tuples, to the
+    # range pages they cover. Returns a dictionary of the updated pages by key.
+    # Ranges that cover more than |maxPagesPerRange| pages are not added.
+    # Pages are replaced as a whole, so if another request adds a range to the
+    # same page at the same time, one of the ranges is lost. That only costs a
+    # cache miss later.
+    def addSymbolRanges(self, ranges):
+        if self.rangePageSize <= 0 or not ranges:
+            return {}
+        maxPages = config['symbolRanges']['maxPagesPerRange']
+        # Pairs of |start, end, symbol| and the keys of the pages it covers
+        rangePageKeys = []
+        for keyPrefix, start, end, symbol in ranges:
+            pages = xrange(start // self.rangePageSize, (end - 1) // self.rangePageSize + 1)
+            if len(pages) > maxPages:
+                continue
+            rangePageKeys.append(((start, end, symbol),
+                                  [self.rangePageKey(keyPrefix, pageNumber)
+                                   for pageNumber in pages]))
+
+        # Ranges may cover pages that no frame of this request was in
+        unreadKeys = set()
+        for symbolRange, pageKeys in rangePageKeys:
+            unreadKeys.update(key for key in pageKeys if key not in self.rangePages)
+        if unreadKeys:
+            cacheResults = self.getCachedValues([], list(unreadKeys))
+            for pageKey in unreadKeys:
+                self.rangePages[pageKey] = cacheResults.get(pageKey, [])
+
+        updatedPages = {}
+        for symbolRange, pageKeys in rangePageKeys:
+            for pageKey in pageKeys:
+                page = updatedPages.get(pageKey)
+                if page is None:
+                    page = list(self.rangePages[pageKey])
+                if insertSymbolRange(page, symbolRange):
+                    updatedPages[pageKey] = page
+        self.rangePages.update(updatedPages)
+        return updatedPages
+
+    def moduleKeyPrefix(self, module):
         # Use quote_plus to ensure there is no whitespace since memcached does not
         # like that
         return "/".join([
             urllib.quote_plus(str(module[0])),
             urllib.quote_plus(str(module[1])),
-            urllib.quote_plus(str(offset))
+            ""
         ])
 
-    def queryDiskCache(self, requestData):
-        self.log(logLevel.DEBUG, "Sending request to DiskCache: {}".format(requestData))
-        try:
-            request = urllib2.Request(config['DiskCacheServer'])
-            request.add_data(json.dumps(requestData))
-            with contextlib.closing(urllib2.urlopen(request)) as response:
-                if response.getcode() != 200:
-                    self.log(logLevel.WARNING, "Got HTTP Code {} when querying DiskCache"
-                             .format(response.getcode()))
-                    return None
-                return json.loads(response.read())
-        except Exception as e:
-            self.log(logLevel.ERROR, "Exception when querying DiskCache: {}".format(e))
-            return None
+    def moduleOffsetId(self, module, offset):
+        # Offsets are integers, so they never need quoting
+        return self.moduleKeyPrefix(module) + str(offset)
+
+    def rangePageKey(self, keyPrefix, page):
+        # The "p" keeps page keys apart from |moduleOffsetId|s
+        return "{}p{}".format(keyPrefix, page)
+
+    # Removes the range of the symbol that |offset| resolved to, if there is
+    # one, from all the range pages it is in
+    def evictSymbolRange(self, keyPrefix, offset):
+        if self.rangePageSize <= 0:
+            return
+        pageKey = self.rangePageKey(keyPrefix, offset // self.rangePageSize)
+        page = self.rangePageCache.getMulti([pageKey]).get(pageKey, [])
+        symbolRange = findSymbolRange(page, offset)
+        if not symbolRange and self.memcache:
+            page = self.memcache.get(pageKey) or []
+            symbolRange = findSymbolRange(page, offset)
+        if not symbolRange:
+            return
+        start, end, symbol = symbolRange
+        pageKeys = [self.rangePageKey(keyPrefix, pageNumber) for pageNumber in
+                    xrange(start // self.rangePageSize, (end - 1) // self.rangePageSize + 1)]
+        for pageKey in pageKeys:
+            self.rangePageCache.delete(pageKey)
+        if self.memcache:
+            pages = self.memcache.get_multi(pageKeys)
+            for pageKey, page in pages.iteritems():
+                page = [pageRange for pageRange in page if pageRange[0] != start]
+                if page:
+                    self.memcache.set(pageKey, page)
+                else:
+                    self.memcache.delete(pageKey)
 
     def debugRequest(self):
         request = self.request
@@ -209,7 +588,12 @@ class SymbolicationThread(threading.Thread):
                                           request['offset'])
 
         if action == "cacheEvict":
-            self.memcache.delete(cacheId)
+            self.symbolCache.delete(cacheId)
+            if self.memcache:
+                self.memcache.delete(cacheId)
+            self.evictSymbolRange(self.moduleKeyPrefix((request['libName'],
+                                                        request['breakpadId'])),
+                                  request['offset'])
             self.log(logLevel.WARNING, "{} Cache item manually evicted: {}"
                      .format(self.id, cacheId))
             self.response['success'] = True
@@ -218,4 +602,94 @@ class SymbolicationThread(threading.Thread):
                      .format(self.id, action))
             self.response['message'] = "Invalid action"
 
+
+def findSymbolRange(page, offset):
+    """ Returns the |start, end, symbol| in the range page |page| (a list of
+    them sorted by |start|) that contains |offset|, or |None|.
+    """
+    index = bisect.bisect_right([symbolRange[0] for symbolRange in page], offset) - 1
+    if index >= 0 and offset < page[index][1]:
+        return page[index]
+    return None
+
+
+def insertSymbolRange(page, symbolRange):
+    """ Inserts |symbolRange| into the range page |page|, keeping it sorted.
+    Returns |False| if it overlaps a range that is already in the page.
+    """
+    start, end, symbol = symbolRange
+    index = bisect.bisect_left([pageRange[0] for pageRange in page], start)
+    if index > 0 and page[index - 1][1] > start:
+        return False
+    if index < len(page) and page[index][0] < end:
+        return False
+    page.insert(index, symbolRange)
+    return True
+
+
+class SymbolCache:
+    """ A small in-process LRU cache of symbols by |moduleOffsetId|, or of
+    symbol range pages by key, checked before memcached. It is shared by all
+    symbolication workers, so all access to it is done while holding its lock.
+    Entries expire after |ttlSec| seconds (never if |ttlSec| is |0|), so that
+    regenerated symbols are picked up. A |maxEntries| of |0| disables the
+    cache.
+    """
+    def __init__(self, maxEntries, ttlSec):
+        self.maxEntries = maxEntries
+        self.ttlSec = ttlSec
+        self.lock = threading.Lock()
+        # Maps |moduleOffsetId| (or range page key) to |symbol (or page), expiry time|
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def getMulti(self, keys):
+        """ Returns a dictionary of the symbols of |keys| that are in the cache.
+        """
+        results = {}
+        if self.maxEntries <= 0:
+            return results
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                entry = self.cache.pop(key, None)
+                if entry is None or (entry[1] is not None and entry[1] <= now):
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                # Mark this entry as the "most recently used"
+                self.cache[key] = entry
+                results[key] = entry[0]
+        return results
+
+    def setMulti(self, symbols):
+        if self.maxEntries <= 0 or not symbols:
+            return
+        expiry = time.time() + self.ttlSec if self.ttlSec > 0 else None
+        with self.lock:
+            for key, symbol in symbols.iteritems():
+                self.cache.pop(key, None)
+                self.cache[key] = (symbol, expiry)
+            while len(self.cache) > self.maxEntries:
+                self.cache.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def flush(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.cache),
+                'maxEntries': self.maxEntries,
+                'ttlSec': self.ttlSec
+            }
+
 symbolicator = Symbolicator()
@@ -0,0 +1,69 @@
+import time
+import math
+import collections
+
+# The drain rate is the number of requests completed in this many seconds,
+# divided by this many seconds
+DRAIN_RATE_WINDOW_SEC = 10
+# Bounds of the Retry-After estimate sent with rejected requests
+MIN_RETRY_AFTER_SEC = 1
+MAX_RETRY_AFTER_SEC = 60
+
+
+class RequestLimiter:
+    """ Counts the requests that a server is working on so that new requests can
+    be rejected while there are too many. Must only be used from the IOLoop
+    thread.
+    """
+    def __init__(self):
+        self.active = 0
+        self.shed = 0
+        # Completion times of the requests completed in the last
+        # |DRAIN_RATE_WINDOW_SEC|
+        self.completions = collections.deque()
+
+    def admit(self, maxRequests):
+        """ Returns |True| if a new request may be worked on, in which case
+        |release| must be called when it is done. A |maxRequests| of |0| means
+        there is no limit.
+        """
+        if maxRequests > 0 and self.active >= maxRequests:
+            self.shed += 1
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        now = time.time()
+        self.completions.append(now)
+        self.expireCompletions(now)
+
+    def expireCompletions(self, now):
+        while self.completions and self.completions[0] < now - DRAIN_RATE_WINDOW_SEC:
+            self.completions.popleft()
+
+    def drainRate(self):
+        """ Returns the number of requests completed per second recently.
+        """
+        self.expireCompletions(time.time())
+        return float(len(self.completions)) / DRAIN_RATE_WINDOW_SEC
+
+    def retryAfter(self):
+        """ Returns an estimate of how many seconds it will take until the
+        requests being worked on now are done.
+        """
+        rate = self.drainRate()
+        if not rate:
+            return MAX_RETRY_AFTER_SEC
+        seconds = int(math.ceil(self.active / rate))
+        return min(max(seconds, MIN_RETRY_AFTER_SEC), MAX_RETRY_AFTER_SEC)
+
+    def status(self, maxRequests):
+        return {
+            'queuedRequests': self.active,
+            'maxQueuedRequests': maxRequests,
+            'shedRequests': self.shed,
+            'drainRatePerSec': self.drainRate(),
+            'saturated': maxRequests > 0 and self.active >= maxRequests
+        }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+################################################################################
+# benchmark_localSymbols
+#
+# Compares the time taken to resolve offsets from raw (MODULE format) symbol
+# files with the single pass sort-merge used by DiskCache against the previous
+# approach of comparing every record with every requested offset.
+#
+# By default a large synthetic symbol file is generated. Use --symbolDir to
+# benchmark the largest files of a local symbol directory instead (for example
+# a crashreporter-symbols directory).
+################################################################################
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import testUtils
+testUtils.addSymServerToPath()
+from snappy.DiskCache_SymbolIndex import lookupRawSymbols
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark symbol lookups in raw symbol files")
+    parser.add_argument("--symbolDir", "-s", metavar="PATH", help="A local symbol "
+                        "directory to take symbol files from. If not specified, a synthetic "
+                        "symbol file is generated.")
+    parser.add_argument("--files", "-f", type=int, default=3, help="The number of "
+                        "symbol files (the largest ones) to benchmark with --symbolDir. "
+                        "(default: 3)")
+    parser.add_argument("--offsets", "-o", type=int, default=1000, help="The number "
+                        "of offsets to resolve per lookup. (default: 1000)")
+    parser.add_argument("--symbols", "-n", type=int, default=200000, help="The number "
+                        "of FUNC records in the synthetic symbol file. (default: 200000)")
+    args = parser.parse_args()
+
+    tempDir = None
+    try:
+        if args.symbolDir:
+            paths = largestSymbolFiles(args.symbolDir, args.files)
+        else:
+            tempDir = tempfile.mkdtemp()
+            path = os.path.join(tempDir, "synthetic.sym")
+            makeSymbolFile(path, args.symbols)
+            paths = [path]
+        for path in paths:
+            benchmark(path, args.offsets)
+    finally:
+        if tempDir:
+            shutil.rmtree(tempDir)
+    return 0
+
+
+def largestSymbolFiles(symbolDir, count):
+    paths = []
+    for root, dirs, files in os.walk(symbolDir):
+        for file in files:
+            if file.endswith(".sym"):
+                path = os.path.join(root, file)
+                paths.append((os.path.getsize(path), path))
+    paths.sort(reverse=True)
+    return [entry[1] for entry in paths[:count]]
+
+
+def makeSymbolFile(path, symbolCount):
+    random.seed(0)
+    address = 0x1000
+    with open(path, 'w') as fp:
+        fp.write("MODULE windows x86_64 0123456789ABCDEF0123456789ABCDEF0 synthetic.pdb\n")
+        fp.write("FILE 0 synthetic.cpp\n")
+        for index in xrange(symbolCount):
+            size = random.randint(0x10, 0x400)
+            fp.write("FUNC {:x} {:x} 0 function_{}(int, char*)\n".format(address, size, index))
+            for line in xrange(4):
+                fp.write("{:x} {:x} {} 0\n".format(address + line * 4, 4, line + 1))
+            if index % 5 == 0:
+                fp.write("PUBLIC {:x} 0 public_{}\n".format(address, index))
+            address += size + random.randint(0, 0x40)
+
+
+def addressRange(path):
+    lowest = None
+    highest = 0
+    with open(path, 'r') as fp:
+        for line in fp:
+            if line.startswith(("FUNC ", "PUBLIC ")):
+                address = int(line.split(" ", 2)[1], 16)
+                highest = max(highest, address)
+                if lowest is None or address < lowest:
+                    lowest = address
+    return lowest or 0, highest
+
+
+def linearLookup(path, offsets):
+    """ The previous implementation: every record is compared with every offset.
+    """
+    symbols = {}
+    offsets = [[o, None] for o in offsets]
+    with open(path, 'r') as fp:
+        for line in fp:
+            if line.startswith("PUBLIC "):
+                fields = line.rstrip().split(" ", 3)
+                address = int(fields[1], 16)
+                symbol = fields[3]
+            elif line.startswith("FUNC "):
+                fields = line.rstrip().split(" ", 4)
+                address = int(fields[1], 16)
+                symbol = fields[4]
+            else:
+                continue
+            for index in xrange(len(offsets)):
+                offset, closest = offsets[index]
+                if address <= offset and (closest is None or address > closest):
+                    offsets[index] = [offset, address]
+                    symbols[offset] = symbol
+    return symbols
+
+
+def timeIt(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def benchmark(path, offsetCount):
+    lowest, highest = addressRange(path)
+    offsets = [random.randint(lowest, highest + 0x100) for i in xrange(offsetCount)]
+    sizeMB = os.path.getsize(path) / 1024.0 / 1024.0
+    print "{} ({:.1f} MB, {} offsets)".format(path, sizeMB, offsetCount)
+    mergeTime, mergeSymbols = timeIt(lookupRawSymbols, path, offsets)
+    linearTime, linearSymbols = timeIt(linearLookup, path, offsets)
+    # The previous implementation keeps the first of several records at the same
+    # address, so only the resolved offsets are compared.
+    if set(mergeSymbols) != set(linearSymbols):
+        print "    WARNING: The lookups resolved different offsets"
+    print "    Per-offset scan: {:.3f}s".format(linearTime)
+    print "    Sort-merge:      {:.3f}s".format(mergeTime)
+    if mergeTime:
+        print "    Speedup:         {:.1f}x".format(linearTime / mergeTime)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,6 +19,15 @@ def addSymServerToPath():
     if quickstartDir not in sys.path:
         sys.path.insert(0, quickstartDir)
 
+
+def addSnappyToPath():
+    """ The modules in snappy import each other by their bare names, so tests
+    that use them directly need the snappy directory on the path.
+    """
+    snappyDir = os.path.realpath(os.path.join(TEST_DIR, "..", "snappy"))
+    if snappyDir not in sys.path:
+        sys.path.insert(0, snappyDir)
+
 addSymServerToPath()
 import snappy.DiskCache_Config as DiskCache
 import snappy.SymServer_Config as SymServer
@@ -35,6 +44,15 @@ def symServerRequest(requestString, ip, port):
         return {'code': err.code, 'data': None}
 
 
+def statusRequest(ip, port):
+    url = "http://{}:{}/status".format(ip, port)
+    try:
+        with contextlib.closing(urllib2.urlopen(url)) as response:
+            return {'code': response.getcode(), 'data': json.loads(response.read())}
+    except urllib2.HTTPError as err:
+        return {'code': err.code, 'data': json.loads(err.read())}
+
+
 def sampleRequest():
     request = {
         "stacks": [[[0, 11723767], [1, 65802]]],
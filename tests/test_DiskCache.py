@@ -127,5 +127,108 @@ class testDiskCache(unittest.TestCase):
         self.assertTrue(os.path.exists(response['path']),
                         "Cached file does not exist after a cacheGet")
 
+    def test_memoryCacheStats(self):
+        request = {
+            "debug": True,
+            "action": "memoryCacheStats"
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        for key in ('hits', 'misses', 'entries', 'sizeBytes', 'maxSizeBytes'):
+            self.assertIn(key, response, "No {} provided in response".format(key))
+        self.assertEqual(response['entries'], 0,
+                         "Memory cache should be empty right after the server is started")
+
+        request = json.loads(testUtils.sampleRequest())
+        request['memoryMap'] = request['memoryMap'][:1]
+        request['stacks'] = [[request['stacks'][0][0]]]
+        JSONrequest = json.dumps(request)
+        for i in xrange(2):
+            response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                                  port=self.config['DiskCache']['port'])
+            testUtils.verifyGenericResponse(self, response)
+
+        request = {
+            "debug": True,
+            "action": "memoryCacheStats"
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertEqual(response['entries'], 1, "Symbol file should be held in memory")
+        self.assertEqual(response['hits'], 1, "Second lookup should be served from memory")
+
+    def test_batchStats(self):
+        request = {
+            "debug": True,
+            "action": "batchStatsClear"
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        testUtils.verifyGenericResponse(self, response)
+
+        JSONrequest = testUtils.sampleRequest()
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        testUtils.verifyGenericResponse(self, response)
+
+        request = {
+            "debug": True,
+            "action": "batchStats"
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        for key in ('batches', 'requests', 'averageBatchSize', 'maxBatchSize',
+                    'symbolFileReads', 'readsSaved'):
+            self.assertIn(key, response, "No {} provided in response".format(key))
+        self.assertEqual(response['batches'], 1, "Request should be counted as one batch")
+        self.assertEqual(response['requests'], 1, "Request should be counted once")
+
+    def test_negativeCache(self):
+        request = {
+            "stacks": [[[0, 11723767]]],
+            "memoryMap": [["nonexistent.pdb", "00000000000000000000000000000000"]],
+            "version": 4
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertFalse(response['knownModules'][0], "Module should not be known")
+
+        request = {
+            "debug": True,
+            "action": "negativeCacheList"
+        }
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertIn('entries', response, "No entries provided in response to List")
+        libNames = [entry['libName'] for entry in response['entries']]
+        self.assertIn("nonexistent.pdb", libNames,
+                      "Missing module should be in the negative cache")
+
+        request['action'] = 'negativeCacheClear'
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertIn('success', response, "No result provided in response to Clear")
+        self.assertTrue(response['success'], "Negative cache clear unsuccessful")
+
+        request['action'] = 'negativeCacheList'
+        JSONrequest = json.dumps(request)
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['DiskCache']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertEqual(response['entries'], [], "Negative cache should be empty after Clear")
+
 if __name__ == '__main__':
     unittest.main()
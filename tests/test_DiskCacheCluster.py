@@ -0,0 +1,412 @@
+import unittest
+import time
+import json
+import collections
+import tornado.gen
+import tornado.testing
+import tornado.web
+import tornado.httpserver
+from tornado.httpclient import AsyncHTTPClient
+
+import testUtils
+testUtils.addSnappyToPath()
+from SymServer_Config import config
+from SymServer_DiskCacheCluster import HashRing, DiskCacheCluster
+import SymServer_DiskCacheClient
+from SymServer_DiskCacheClient import DiskCacheClient
+
+MODULES = [("lib{}.pdb".format(i), "{:032X}".format(i * 7919)) for i in xrange(2000)]
+SERVERS = ["http://127.0.0.1:{}/".format(port) for port in xrange(8888, 8893)]
+EJECTION_SEC = 0.2
+
+
+def moduleKey(module):
+    return "{}/{}".format(*module)
+
+
+def makeCluster(servers, ejectionSec=EJECTION_SEC):
+    return DiskCacheCluster([[server] for server in servers], 160, 3, ejectionSec, 95, 20)
+
+
+def resolve(requestData):
+    """ Responds to |requestData| like a DiskCache that has the symbols of
+    every module
+    """
+    memoryMap = requestData['memoryMap']
+    return {
+        'symbolicatedStacks': [["sym{} (in {})".format(offset, memoryMap[moduleIndex][0])
+                                for moduleIndex, offset in stack]
+                               for stack in requestData['stacks']],
+        'symbolRanges': [[[offset, offset + 1] for moduleIndex, offset in stack]
+                         for stack in requestData['stacks']],
+        'knownModules': [True] * len(memoryMap)
+    }
+
+
+class FakeDiskCacheClient(DiskCacheClient):
+    """ Sends requests to fake DiskCache servers. Each server in |servers| is
+    given as |delay, fails|: how many seconds it takes to respond, and whether
+    its response is an error. Servers that are not listed respond at once.
+    """
+    def __init__(self, servers=None):
+        DiskCacheClient.__init__(self)
+        self.servers = servers or {}
+        self.requests = collections.defaultdict(list)
+        self.aborts = collections.defaultdict(list)
+
+    @tornado.gen.coroutine
+    def queryServer(self, server, requestData, id, deadline, abort=None):
+        self.requests[server].append(requestData)
+        self.aborts[server].append(abort)
+        delay, fails = self.servers.get(server, (0, False))
+        start = time.time()
+        yield tornado.gen.sleep(delay)
+        if abort and abort.aborted:
+            raise tornado.gen.Return(None)
+        if fails:
+            self.cluster.recordFailure(server)
+            raise tornado.gen.Return(None)
+        self.cluster.recordSuccess(server, time.time() - start)
+        raise tornado.gen.Return(resolve(requestData))
+
+
+class testHashRing(unittest.TestCase):
+    def test_spread(self):
+        ring = HashRing(SERVERS[:4], 160)
+        counts = collections.Counter(next(ring.iterNodes(moduleKey(module)))
+                                     for module in MODULES)
+        self.assertEqual(set(counts), set(SERVERS[:4]))
+        for server, count in counts.iteritems():
+            self.assertTrue(0.15 < count / float(len(MODULES)) < 0.35,
+                            "{} owns {} of {} modules".format(server, count, len(MODULES)))
+
+    def test_addNode(self):
+        before = HashRing(SERVERS[:4], 160)
+        after = HashRing(SERVERS[:5], 160)
+        moved = 0
+        for module in MODULES:
+            owner = next(after.iterNodes(moduleKey(module)))
+            if owner != next(before.iterNodes(moduleKey(module))):
+                moved += 1
+                self.assertEqual(owner, SERVERS[4], "Modules should only move to the new node")
+        # About 1/5 of the modules belong to the new node
+        self.assertTrue(0.1 < moved / float(len(MODULES)) < 0.3,
+                        "{} of {} modules moved".format(moved, len(MODULES)))
+
+    def test_iterNodes(self):
+        ring = HashRing(SERVERS[:4], 160)
+        for module in MODULES[:100]:
+            self.assertEqual(sorted(ring.iterNodes(moduleKey(module))), sorted(SERVERS[:4]))
+
+
+class testDiskCacheCluster(unittest.TestCase):
+    def test_shardFor(self):
+        cluster = makeCluster(SERVERS[:4])
+        for module in MODULES:
+            self.assertEqual(cluster.shardFor(module),
+                             next(cluster.ring.iterNodes(moduleKey(module))))
+
+    def test_ejection(self):
+        cluster = makeCluster(SERVERS[:4])
+        owners = dict((module, cluster.shardFor(module)) for module in MODULES)
+        ejected = SERVERS[0]
+        cluster.recordFailure(ejected)
+        cluster.recordFailure(ejected)
+        self.assertEqual([cluster.shardFor(module) for module in MODULES],
+                         [owners[module] for module in MODULES],
+                         "A server is only ejected after |ejectAfterFailures| failures")
+
+        cluster.recordFailure(ejected)
+        for module in MODULES:
+            if owners[module] == ejected:
+                nextShard = list(cluster.ring.iterNodes(moduleKey(module)))[1]
+                self.assertEqual(cluster.shardFor(module), nextShard)
+            else:
+                self.assertEqual(cluster.shardFor(module), owners[module],
+                                 "Only the ejected server's modules should move")
+
+        time.sleep(EJECTION_SEC * 1.5)
+        self.assertEqual([cluster.shardFor(module) for module in MODULES],
+                         [owners[module] for module in MODULES],
+                         "The modules should return after |ejectionSec|")
+        # Ejected again on the first failure
+        cluster.recordFailure(ejected)
+        self.assertTrue(cluster.isEjected(ejected, time.time()))
+        cluster.recordSuccess(ejected, 0.01)
+        self.assertFalse(cluster.isEjected(ejected, time.time()))
+
+    def test_allEjected(self):
+        cluster = makeCluster(SERVERS[:2])
+        for server in SERVERS[:2]:
+            for i in xrange(3):
+                cluster.recordFailure(server)
+        for module in MODULES[:100]:
+            self.assertEqual(cluster.shardFor(module),
+                             next(cluster.ring.iterNodes(moduleKey(module))))
+
+
+class testDiskCacheClient(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(testDiskCacheClient, self).setUp()
+        self.servers = config['DiskCacheServers']
+        config['DiskCacheServers'] = SERVERS[:3]
+
+    def tearDown(self):
+        config['DiskCacheServers'] = self.servers
+        super(testDiskCacheClient, self).tearDown()
+
+    def makeRequest(self):
+        memoryMap = [list(module) for module in MODULES[:20]]
+        stacks = [[[(i * 7) % len(memoryMap), i * 16] for i in xrange(50)],
+                  [[(i * 3) % len(memoryMap), i * 32 + 1] for i in xrange(30)]]
+        return {'stacks': stacks, 'memoryMap': memoryMap, 'version': 4}
+
+    @tornado.testing.gen_test
+    def test_merge(self):
+        client = FakeDiskCacheClient()
+        request = self.makeRequest()
+        response = yield client.query(request, "merge")
+        self.assertEqual(response, resolve(request))
+        self.assertEqual(set(client.requests), set(SERVERS[:3]),
+                         "The request should have been split across every shard")
+        for server, serverRequests in client.requests.iteritems():
+            for module in serverRequests[0]['memoryMap']:
+                self.assertEqual(client.cluster.shardFor(module), server)
+
+    @tornado.testing.gen_test
+    def test_mergeFailedShard(self):
+        client = FakeDiskCacheClient({SERVERS[1]: (0, True)})
+        request = self.makeRequest()
+        response = yield client.query(request, "mergeFailedShard")
+        expected = resolve(request)
+        template = client.makeResponseTemplate(request)
+        memoryMap = request['memoryMap']
+        for moduleIndex, module in enumerate(memoryMap):
+            if client.cluster.shardFor(module) == SERVERS[1]:
+                expected['knownModules'][moduleIndex] = False
+        for stackIndex, stack in enumerate(request['stacks']):
+            for frameIndex, (moduleIndex, offset) in enumerate(stack):
+                if client.cluster.shardFor(memoryMap[moduleIndex]) == SERVERS[1]:
+                    expected['symbolicatedStacks'][stackIndex][frameIndex] = \
+                        template['symbolicatedStacks'][stackIndex][frameIndex]
+                    expected['symbolRanges'][stackIndex][frameIndex] = None
+        self.assertEqual(response, expected)
+
+
+class testDiskCacheReplicas(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(testDiskCacheReplicas, self).setUp()
+        self.servers = config['DiskCacheServers']
+        config['DiskCacheServers'] = [SERVERS[:3]]
+        self.request = {'stacks': [[[0, 16], [1, 32]]],
+                        'memoryMap': [list(module) for module in MODULES[:2]],
+                        'version': 4}
+
+    def tearDown(self):
+        config['DiskCacheServers'] = self.servers
+        super(testDiskCacheReplicas, self).tearDown()
+
+    def makeClient(self, servers):
+        """ Makes a client whose replicas have responded in 10ms, 20ms and
+        30ms lately, so that they are tried in the order of |SERVERS| and
+        hedged after 10ms
+        """
+        client = FakeDiskCacheClient(servers)
+        for i, server in enumerate(SERVERS[:3]):
+            for sample in xrange(config['DiskCacheClient']['hedgeMinSamples']):
+                client.cluster.recordSuccess(server, (i + 1) * 0.01)
+        return client
+
+    def sentTo(self, client):
+        return [server for server in SERVERS[:3] if client.requests[server]]
+
+    @tornado.testing.gen_test
+    def test_fastReplica(self):
+        client = self.makeClient({})
+        response = yield client.query(self.request, "fastReplica")
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.sentTo(client), SERVERS[:1])
+        self.assertEqual(client.hedgedRequests, 0)
+
+    @tornado.testing.gen_test
+    def test_hedgeWins(self):
+        client = self.makeClient({SERVERS[0]: (2, False)})
+        start = time.time()
+        response = yield client.query(self.request, "hedgeWins")
+        self.assertLess(time.time() - start, 1, "The hedge should have answered first")
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.sentTo(client), SERVERS[:2])
+        self.assertEqual((client.hedgedRequests, client.hedgeWins, client.failovers), (1, 1, 0))
+        self.assertTrue(client.aborts[SERVERS[0]][0].aborted,
+                        "The slow replica's request should have been aborted")
+        self.assertFalse(client.aborts[SERVERS[1]][0].aborted)
+
+    @tornado.testing.gen_test
+    def test_hedgeLoses(self):
+        client = self.makeClient({SERVERS[0]: (0.1, False), SERVERS[1]: (2, False)})
+        start = time.time()
+        response = yield client.query(self.request, "hedgeLoses")
+        self.assertLess(time.time() - start, 1, "The first replica should have answered first")
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.sentTo(client), SERVERS[:2])
+        self.assertEqual((client.hedgedRequests, client.hedgeWins, client.failovers), (1, 0, 0))
+        self.assertTrue(client.aborts[SERVERS[1]][0].aborted,
+                        "The hedge's request should have been aborted")
+
+    @tornado.testing.gen_test
+    def test_failover(self):
+        client = self.makeClient({SERVERS[0]: (0, True), SERVERS[1]: (0, True)})
+        response = yield client.query(self.request, "failover")
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.sentTo(client), SERVERS[:3],
+                         "Every replica should have been tried in turn")
+        self.assertEqual((client.hedgedRequests, client.failovers), (0, 2))
+
+    @tornado.testing.gen_test
+    def test_failoverAfterHedge(self):
+        # The slow replica is hedged, the hedge fails, and then the slow one
+        # fails too. The request should still go to the last replica.
+        client = self.makeClient({SERVERS[0]: (0.2, True), SERVERS[1]: (0, True)})
+        response = yield client.query(self.request, "failoverAfterHedge")
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.sentTo(client), SERVERS[:3])
+        self.assertEqual((client.hedgedRequests, client.hedgeWins, client.failovers), (1, 0, 1))
+
+    @tornado.testing.gen_test
+    def test_allFail(self):
+        client = self.makeClient(dict((server, (0, True)) for server in SERVERS[:3]))
+        response = yield client.query(self.request, "allFail")
+        self.assertIsNone(response)
+        for server in SERVERS[:3]:
+            self.assertEqual(len(client.requests[server]), 1)
+
+
+class SlowHandler(tornado.web.RequestHandler):
+    """ Responds with |code| after |delay| seconds
+    """
+    def initialize(self, delay, code):
+        self.delay = delay
+        self.code = code
+
+    @tornado.gen.coroutine
+    def post(self):
+        yield tornado.gen.sleep(self.delay)
+        self.set_status(self.code)
+        self.write(json.dumps(resolve(json.loads(self.request.body))))
+
+
+class testDiskCacheFailures(tornado.testing.AsyncTestCase):
+    """ Which unsuccessful responses of a real server count as failures
+    """
+    def setUp(self):
+        super(testDiskCacheFailures, self).setUp()
+        self.config = (config['DiskCacheServers'], config['DiskCacheClient']['requestTimeoutMs'],
+                       SymServer_DiskCacheClient.DEADLINE_GRACE_SEC)
+        SymServer_DiskCacheClient.DEADLINE_GRACE_SEC = 0.1
+        config['DiskCacheClient']['requestTimeoutMs'] = 500
+        self.maxConnections = config['DiskCacheClient']['maxConnections']
+        self.request = {'stacks': [[[0, 16]]], 'memoryMap': [list(MODULES[0])], 'version': 4}
+
+    def tearDown(self):
+        (config['DiskCacheServers'], config['DiskCacheClient']['requestTimeoutMs'],
+         SymServer_DiskCacheClient.DEADLINE_GRACE_SEC) = self.config
+        super(testDiskCacheFailures, self).tearDown()
+
+    def startServer(self, delay, code):
+        """ Returns the URL of a new server that responds with |code| after
+        |delay| seconds
+        """
+        sock, port = tornado.testing.bind_unused_port()
+        app = tornado.web.Application([(r"/", SlowHandler, {'delay': delay, 'code': code})])
+        server = tornado.httpserver.HTTPServer(app, io_loop=self.io_loop)
+        server.add_sockets([sock])
+        return "http://127.0.0.1:{}/".format(port)
+
+    def makeClient(self, delay, code):
+        self.server = self.startServer(delay, code)
+        config['DiskCacheServers'] = [self.server]
+        return DiskCacheClient()
+
+    def failures(self, client):
+        return client.cluster.stats[self.server].failures
+
+    @tornado.testing.gen_test
+    def test_success(self):
+        client = self.makeClient(0, 200)
+        response = yield client.queryServer(self.server, self.request, "success", None)
+        self.assertEqual(response, resolve(self.request))
+        self.assertEqual(self.failures(client), 0)
+
+    @tornado.testing.gen_test
+    def test_serverError(self):
+        client = self.makeClient(0, 500)
+        response = yield client.queryServer(self.server, self.request, "serverError", None)
+        self.assertIsNone(response)
+        self.assertEqual(self.failures(client), 1)
+
+    @tornado.testing.gen_test
+    def test_overloaded(self):
+        client = self.makeClient(0, 503)
+        yield client.queryServer(self.server, self.request, "overloaded", None)
+        self.assertEqual(self.failures(client), 0)
+
+    @tornado.testing.gen_test
+    def test_fullTimeout(self):
+        client = self.makeClient(2, 200)
+        response = yield client.queryServer(self.server, self.request, "fullTimeout", None)
+        self.assertIsNone(response)
+        self.assertEqual(self.failures(client), 1)
+
+    @tornado.testing.gen_test
+    def test_deadlineTimeout(self):
+        # The deadline leaves the request 0.15s, well short of |requestTimeoutMs|.
+        # Running out of that time is not the server's fault.
+        client = self.makeClient(2, 200)
+        for i in xrange(config['DiskCacheClient']['ejectAfterFailures']):
+            response = yield client.queryServer(self.server, self.request, "deadlineTimeout",
+                                                time.time() + 0.05)
+            self.assertIsNone(response)
+        self.assertEqual(self.failures(client), 0)
+        self.assertFalse(client.cluster.isEjected(self.server, time.time()))
+
+    @tornado.testing.gen_test
+    def test_connectionError(self):
+        sock, port = tornado.testing.bind_unused_port()
+        sock.close()
+        self.server = "http://127.0.0.1:{}/".format(port)
+        config['DiskCacheServers'] = [self.server]
+        client = DiskCacheClient()
+        response = yield client.queryServer(self.server, self.request, "connectionError",
+                                            time.time() + 0.05)
+        self.assertIsNone(response)
+        self.assertEqual(self.failures(client), 1)
+
+    @unittest.skipIf(SymServer_DiskCacheClient.pycurl is None, "pycurl is not installed")
+    @tornado.testing.gen_test
+    def test_abort(self):
+        # An aborted request frees its connection at once and is not a failure
+        AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
+        try:
+            config['DiskCacheClient']['maxConnections'] = 1
+            self.server = self.startServer(2, 200)
+            fastServer = self.startServer(0, 200)
+            config['DiskCacheServers'] = [self.server, fastServer]
+            client = DiskCacheClient()
+        finally:
+            AsyncHTTPClient.configure(None)
+            config['DiskCacheClient']['maxConnections'] = self.maxConnections
+        abort = SymServer_DiskCacheClient.Abort()
+        slow = client.queryServer(self.server, self.request, "abort", None, abort)
+        yield tornado.gen.sleep(0.1)
+        abort.abort()
+        start = time.time()
+        response = yield client.queryServer(fastServer, self.request, "afterAbort", None)
+        self.assertLess(time.time() - start, 1, "The aborted request should free its connection")
+        self.assertEqual(response, resolve(self.request))
+        response = yield slow
+        self.assertIsNone(response)
+        self.assertEqual(self.failures(client), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
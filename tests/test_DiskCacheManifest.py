@@ -0,0 +1,115 @@
+import unittest
+import os
+import shutil
+import tempfile
+import Queue
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_Config import config
+from DiskCache_Manifest import CacheManifest
+from DiskCache_DiskCache import DiskCacheThread, LRUCache, CacheEntry
+
+
+class testCacheManifest(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.manifest = CacheManifest(self.cacheDir)
+
+    def tearDown(self):
+        if self.manifest.journal:
+            self.manifest.journal.close()
+        shutil.rmtree(self.cacheDir)
+
+    def addFile(self, relPath, size, lastAccess):
+        path = os.path.join(self.cacheDir, relPath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write("x" * size)
+        return CacheEntry(path, size, lastAccess)
+
+    def reload(self):
+        """ Loads the manifest as DiskCache does when it starts again
+        """
+        return CacheManifest(self.cacheDir).load()
+
+    def test_checkpoint(self):
+        entries = [self.addFile("a.pdb/1/a.sym", 1, 10.0), self.addFile("b.pdb/2/b.sym", 2, 20.0)]
+        self.assertTrue(self.manifest.checkpoint(entries))
+        self.assertEqual(self.reload(), [(entry.path, entry.size, entry.lastAccess)
+                                         for entry in entries])
+
+    def test_journalReplay(self):
+        a = self.addFile("a.pdb/1/a.sym", 1, 10.0)
+        b = self.addFile("b.pdb/2/b.sym", 2, 20.0)
+        self.manifest.checkpoint([a, b])
+        c = self.addFile("c.pdb/3/c.sym", 3, 30.0)
+        self.manifest.recordAdd(c)
+        self.manifest.recordEvict(b.path)
+        # |a| was used again
+        a.lastAccess = 40.0
+        self.manifest.recordAdd(a)
+        # DiskCache stopped while writing this line
+        self.manifest.journal.write("+\t4\t50.0\td.pdb")
+        self.manifest.journal.flush()
+        self.assertEqual(self.reload(), [(c.path, 3, 30.0), (a.path, 1, 40.0)])
+
+    def test_journalEntryWithoutFile(self):
+        a = self.addFile("a.pdb/1/a.sym", 1, 10.0)
+        self.manifest.checkpoint([a])
+        b = self.addFile("b.pdb/2/b.sym", 2, 20.0)
+        self.manifest.recordAdd(b)
+        os.remove(b.path)
+        self.assertEqual(self.reload(), [(a.path, 1, 10.0)],
+                         "Entries whose files are gone should not be loaded")
+
+    def test_unusableManifest(self):
+        self.assertIsNone(self.reload(), "There is no manifest yet")
+        a = self.addFile("a.pdb/1/a.sym", 1, 10.0)
+        self.manifest.checkpoint([a])
+        with open(self.manifest.manifestPath, 'a') as fp:
+            fp.write("not a manifest line\n")
+        self.assertIsNone(self.reload(), "The manifest is corrupt")
+        with open(self.manifest.manifestPath, 'w') as fp:
+            fp.write("DiskCache manifest v.0\n")
+        self.assertIsNone(self.reload(), "The manifest has an unknown format")
+
+
+class testLoadCache(unittest.TestCase):
+    def setUp(self):
+        self.cachePath = config['cachePath']
+        config['cachePath'] = tempfile.mkdtemp()
+        self.thread = DiskCacheThread(Queue.Queue())
+        self.thread.cache = LRUCache()
+
+    def tearDown(self):
+        shutil.rmtree(config['cachePath'])
+        config['cachePath'] = self.cachePath
+
+    def addFile(self, relPath):
+        path = os.path.join(config['cachePath'], relPath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write("symbols")
+        return path
+
+    def test_directoryScan(self):
+        paths = [self.addFile("a.pdb/1/a.sym"), self.addFile("b.pdb/2/b.sym")]
+        os.utime(paths[0], (20, 20))
+        os.utime(paths[1], (10, 10))
+        unfinished = self.addFile("c.pdb/3/c.sym.tmp")
+        with open(os.path.join(config['cachePath'], ".manifest"), 'w') as fp:
+            fp.write("corrupt\n")
+
+        self.thread.loadCache()
+        self.assertEqual(list(self.thread.cache.cache), [paths[1], paths[0]],
+                         "Files should be loaded, least recently used first")
+        self.assertFalse(os.path.exists(unfinished), "Unfinished files should be removed")
+        self.assertIsNotNone(CacheManifest(config['cachePath']).load(),
+                             "A new manifest should be written")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_Reaper import CacheReaper
+
+
+class testCacheReaper(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.tempDir = tempfile.mkdtemp()
+        # Not started. Deletions are run by calling |reapQueued|.
+        self.reaper = CacheReaper(self.cacheDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+        shutil.rmtree(self.tempDir)
+
+    def makeFile(self, directory, relPath):
+        path = os.path.join(directory, relPath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write("symbols")
+        return path
+
+    def reapQueued(self):
+        paths = []
+        while not self.reaper.queue.empty():
+            paths.append(self.reaper.queue.get_nowait())
+        self.reaper.reap(paths)
+
+    def test_delete(self):
+        path = self.makeFile(self.cacheDir, "a.pdb/1/a.sym")
+        self.reaper.delete(path)
+        self.reapQueued()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.cacheDir), [], "Empty directories should be removed")
+
+    def test_readdedBeforeDelete(self):
+        path = self.makeFile(self.cacheDir, "a.pdb/1/a.sym")
+        self.reaper.delete(path)
+        # The file is downloaded again before the reaper gets to it
+        self.reaper.moveIntoCache(self.makeFile(self.tempDir, "a.sym"), path)
+        self.reapQueued()
+        self.assertTrue(os.path.exists(path), "A file back in the cache should not be deleted")
+
+    def test_deletedAfterReadd(self):
+        path = self.makeFile(self.cacheDir, "a.pdb/1/a.sym")
+        self.reaper.delete(path)
+        self.reaper.moveIntoCache(self.makeFile(self.tempDir, "a.sym"), path)
+        # Evicted again
+        self.reaper.delete(path)
+        self.reapQueued()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
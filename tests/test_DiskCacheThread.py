@@ -0,0 +1,133 @@
+import unittest
+import os
+import shutil
+import tempfile
+import Queue
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_Config import config
+from DiskCache_DiskCache import DiskCache, DiskCacheThread, WorkItem
+
+MEMORY_MAP = [["foo.pdb", "ABC"], ["bar.pdb", "DEF"]]
+SYMBOL_FILE = "MODULE windows x86 ABC foo.pdb\nFUNC 1000 10 0 func_a\n"
+
+
+class testDiskCacheThread(unittest.TestCase):
+    def setUp(self):
+        self.thread = DiskCacheThread(Queue.Queue())
+
+    def test_indexFramesWithoutModule(self):
+        # A module index of -1 means that the frame is not in any module
+        request = {'stacks': [[[-1, 4101], [0, 4101], [1, 5]]],
+                   'memoryMap': MEMORY_MAP, 'version': 4}
+        self.assertEqual(self.thread.indexFrames(request), {
+            ("foo.pdb", "ABC"): [(0, 1, 0, 4101)],
+            ("bar.pdb", "DEF"): [(0, 2, 1, 5)]
+        })
+
+        response = DiskCache().makeResponseTemplate(request)
+        unresolved = list(response['symbolicatedStacks'][0])
+        workItem = WorkItem("1", request, response, None)
+        workItem.moduleFrames = self.thread.indexFrames(request)
+        for libName, breakpadId in workItem.moduleFrames:
+            self.thread.applySymbols(libName, breakpadId, {4101: ("func_a", 4096, 4200)},
+                                     [workItem])
+        self.assertEqual(response['symbolicatedStacks'][0],
+                         [unresolved[0], "func_a (in foo.pdb)"] + unresolved[2:])
+        self.assertEqual(response['knownModules'], [True, False])
+
+
+class testLocalSymbols(unittest.TestCase):
+    def setUp(self):
+        self.savedConfig = dict((key, config[key]) for key in ('cachePath', 'localSymbolDirs'))
+        self.tempDirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        config['cachePath'], localDir = self.tempDirs
+        config['localSymbolDirs'] = [localDir]
+        self.sourcePath = os.path.join(localDir, "foo.pdb", "ABC", "foo.sym")
+        os.makedirs(os.path.dirname(self.sourcePath))
+        self.writeSource(SYMBOL_FILE, 1000)
+        self.thread = DiskCacheThread(Queue.Queue())
+        self.thread.init()
+
+    def tearDown(self):
+        self.thread.downloadPool.shutdown()
+        for tempDir in self.tempDirs:
+            shutil.rmtree(tempDir)
+        for key, value in self.savedConfig.iteritems():
+            config[key] = value
+
+    def writeSource(self, data, mtime):
+        with open(self.sourcePath, 'wb') as fp:
+            fp.write(data)
+        os.utime(self.sourcePath, (mtime, mtime))
+
+    def test_sidecarRebuilt(self):
+        sidecarPath = self.thread.getFile("foo.pdb", "ABC")
+        self.assertNotEqual(sidecarPath, self.sourcePath, "The local file should be indexed")
+        self.assertEqual(self.thread.getFile("foo.pdb", "ABC"), sidecarPath)
+
+        # Same modification time, different size
+        self.writeSource(SYMBOL_FILE + "FUNC 2000 10 0 func_b\n", 1000)
+        resizedPath = self.thread.getFile("foo.pdb", "ABC")
+        self.assertNotIn(resizedPath, (sidecarPath, self.sourcePath))
+        self.assertNotIn(sidecarPath, self.thread.cache.cache, "The old index should be evicted")
+        self.assertEqual(self.thread.getSymbols(resizedPath, [0x2004]),
+                         {0x2004: ("func_b", 0x2000, 0x2010)})
+
+        # Same size, different modification time
+        os.utime(self.sourcePath, (2000, 2000))
+        touchedPath = self.thread.getFile("foo.pdb", "ABC")
+        self.assertNotIn(touchedPath, (resizedPath, self.sourcePath))
+        self.assertNotIn(resizedPath, self.thread.cache.cache, "The old index should be evicted")
+
+    def test_indexingFailureRemembered(self):
+        attempts = []
+
+        def failParseJob(function, *args):
+            attempts.append(args)
+            raise IOError("Failed")
+        self.thread.runParseJob = failParseJob
+        for i in xrange(2):
+            self.assertEqual(self.thread.getFile("foo.pdb", "ABC"), self.sourcePath,
+                             "The local file should be read directly")
+        self.assertEqual(len(attempts), 1, "Indexing should not be retried for the same file")
+
+        os.utime(self.sourcePath, (2000, 2000))
+        self.assertEqual(self.thread.getFile("foo.pdb", "ABC"), self.sourcePath)
+        self.assertEqual(len(attempts), 2, "Indexing should be retried when the file changes")
+
+        del self.thread.runParseJob
+        os.utime(self.sourcePath, (3000, 3000))
+        sidecarPath = self.thread.getFile("foo.pdb", "ABC")
+        self.assertNotEqual(sidecarPath, self.sourcePath,
+                            "A file that could be indexed should no longer be read directly")
+        self.assertEqual(self.thread.getFile("foo.pdb", "ABC"), sidecarPath)
+
+
+class testNoSymbolServers(unittest.TestCase):
+    def setUp(self):
+        self.savedConfig = dict((key, config[key]) for key in ('cachePath', 'symbolURLs'))
+        config['cachePath'] = tempfile.mkdtemp()
+        config['symbolURLs'] = []
+        self.thread = DiskCacheThread(Queue.Queue())
+        self.thread.init()
+
+    def tearDown(self):
+        self.thread.downloadPool.shutdown()
+        shutil.rmtree(config['cachePath'])
+        for key, value in self.savedConfig.iteritems():
+            config[key] = value
+
+    def test_notNegativelyCached(self):
+        self.assertIsNone(self.thread.getFile("foo.pdb", "ABC"))
+        self.assertIsNone(self.thread.downloadToCache("foo.pdb", "ABC"))
+        self.assertFalse(self.thread.negativeCache.contains("foo.pdb", "ABC"),
+                         "A module should not be remembered as unavailable when there "
+                         "is nowhere to download it from")
+        self.assertEqual(self.thread.retrieveFile("foo.pdb", "ABC", "foo.sym", None),
+                         (False, False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
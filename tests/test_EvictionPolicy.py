@@ -0,0 +1,99 @@
+import unittest
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_EvictionPolicy import LRUPolicy, GDSFPolicy, TinyLFUPolicy
+
+
+class Entry:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+
+class Cache:
+    """ Just the bookkeeping of DiskCache's LRUCache that matters to policies
+    """
+    def __init__(self, policy, maxSize):
+        self.policy = policy
+        self.maxSize = maxSize
+        self.entries = {}
+        self.size = 0
+        self.newestEntry = None
+
+    def add(self, path, size):
+        self.policy.record(path)
+        entry = Entry(path, size)
+        self.entries[path] = entry
+        self.size += size
+        self.policy.add(entry)
+        self.newestEntry = entry
+        self.evictIfFull()
+
+    def access(self, path):
+        self.policy.record(path)
+        self.policy.access(self.entries[path])
+
+    def evictIfFull(self):
+        while self.size > self.maxSize:
+            victim = self.policy.victim(exclude=self.newestEntry)
+            if not victim:
+                break
+            del self.entries[victim.path]
+            self.size -= victim.size
+            self.policy.remove(victim)
+
+
+class EvictionPolicy(unittest.TestCase):
+    def test_lru(self):
+        cache = Cache(LRUPolicy(), 30)
+        for path in ("a", "b", "c"):
+            cache.add(path, 10)
+        cache.access("a")
+        cache.add("d", 10)
+        self.assertEqual(sorted(cache.entries), ["a", "c", "d"],
+                         "The least recently used entry should be evicted")
+
+    def test_gdsf(self):
+        cache = Cache(GDSFPolicy(), 100)
+        cache.add("big", 60)
+        cache.add("small", 10)
+        for i in xrange(5):
+            cache.access("small")
+        cache.add("new", 40)
+        self.assertEqual(sorted(cache.entries), ["new", "small"],
+                         "The big, rarely used entry should be evicted")
+
+    def test_tinyLFU(self):
+        cache = Cache(TinyLFUPolicy(100, 10), 100)
+        for i in xrange(9):
+            cache.add("popular{}".format(i), 10)
+            for j in xrange(3):
+                cache.access("popular{}".format(i))
+        for i in xrange(5):
+            cache.add("once{}".format(i), 10)
+        self.assertEqual(len([path for path in cache.entries if path.startswith("popular")]), 9,
+                         "Entries used only once should not push out popular ones")
+        self.assertLessEqual(cache.size, 100)
+
+    def test_tinyLFUBigEntry(self):
+        # An entry bigger than the window is the only entry in it, but the cache
+        # must still be brought back under its limit
+        cache = Cache(TinyLFUPolicy(100, 10), 100)
+        for i in xrange(9):
+            cache.add("entry{}".format(i), 10)
+        cache.add("big", 50)
+        self.assertIn("big", cache.entries)
+        self.assertLessEqual(cache.size, 100)
+
+    def test_excludeNewest(self):
+        for policy in (LRUPolicy(), GDSFPolicy(), TinyLFUPolicy(100, 10)):
+            cache = Cache(policy, 100)
+            cache.add("old", 10)
+            cache.add("huge", 200)
+            self.assertEqual(sorted(cache.entries), ["huge"],
+                             "The newest entry should never be evicted ({})"
+                             .format(policy.__class__.__name__))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import threading
+import multiprocessing
+import os
+import time
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_ParsePool import ParsePool
+
+TIMEOUT_SEC = 2
+
+
+def sleepAndReturnPid(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def fail():
+    raise IOError("Failed")
+
+
+class testParsePool(unittest.TestCase):
+    def setUp(self):
+        self.parsePool = ParsePool(1, TIMEOUT_SEC)
+
+    def tearDown(self):
+        self.parsePool.pool.terminate()
+
+    def test_result(self):
+        self.assertNotEqual(self.parsePool.run(sleepAndReturnPid, (0,)), os.getpid())
+        self.assertRaises(IOError, self.parsePool.run, fail, ())
+
+    def test_timeout(self):
+        pid = self.parsePool.run(sleepAndReturnPid, (0,))
+        start = time.time()
+        self.assertRaises(multiprocessing.TimeoutError, self.parsePool.run,
+                          sleepAndReturnPid, (60,))
+        self.assertLess(time.time() - start, TIMEOUT_SEC + 1)
+        # The process that ran the job was stopped and replaced
+        self.assertEqual(self.parsePool.generation, 1)
+        self.assertNotEqual(self.parsePool.run(sleepAndReturnPid, (0,)), pid)
+
+    def test_resubmitAfterTimeout(self):
+        self.parsePool.pool.terminate()
+        self.parsePool = ParsePool(2, TIMEOUT_SEC)
+        results = []
+
+        def runJob():
+            results.append(self.parsePool.run(sleepAndReturnPid, (TIMEOUT_SEC * 0.75,)))
+        # Started halfway through the job that times out, so it is still running
+        # when the pool is terminated
+        thread = threading.Timer(TIMEOUT_SEC / 2.0, runJob)
+        thread.start()
+        self.assertRaises(multiprocessing.TimeoutError, self.parsePool.run,
+                          sleepAndReturnPid, (60,))
+        thread.join()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(self.parsePool.generation, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
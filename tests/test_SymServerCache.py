@@ -95,5 +95,84 @@ class SymServerCache(unittest.TestCase):
                 self.assertTrue(frameHit, "Should not have gotten any cache misses "
                                 "on the second query")
 
+    def test_symbolRanges(self):
+        request = {
+            "debug": True,
+            "action": "outputCacheHits",
+            "enabled": True
+        }
+        response = testUtils.symServerRequest(json.dumps(request), ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertIn('success', response, "No result provided in response")
+
+        JSONrequest = testUtils.sampleRequest()
+        response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        testUtils.verifySampleResponse(self, response)
+
+        # Other offsets in the same functions should be resolved from the cached
+        # symbol ranges
+        request = json.loads(JSONrequest)
+        for stack in request['stacks']:
+            for frame in stack:
+                frame[1] += 1
+        response = testUtils.symServerRequest(json.dumps(request), ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifySampleResponse(self, response)
+        self.assertIn('cacheHits', response)
+        for stackHits in response['cacheHits']:
+            for frameHit in stackHits:
+                self.assertTrue(frameHit, "Offsets in functions that were resolved before "
+                                "should be cache hits")
+
+    def test_symbolCacheStats(self):
+        request = {
+            "debug": True,
+            "action": "symbolCacheStats"
+        }
+        statsRequest = json.dumps(request)
+        response = testUtils.symServerRequest(statsRequest, ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        for key in ('hits', 'misses', 'entries', 'maxEntries', 'ttlSec'):
+            self.assertIn(key, response, "No {} provided in response".format(key))
+        self.assertEqual(response['entries'], 0,
+                         "Symbol cache should be empty right after the server is started")
+
+        JSONrequest = testUtils.sampleRequest()
+        for i in xrange(2):
+            response = testUtils.symServerRequest(JSONrequest, ip="127.0.0.1",
+                                                  port=self.config['SymServer']['port'])
+            testUtils.verifySampleResponse(self, response)
+
+        response = testUtils.symServerRequest(statsRequest, ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertGreater(response['entries'], 0, "Symbols should be held in memory")
+        self.assertGreater(response['hits'], 0, "Second request should be served from memory")
+        self.assertIn('rangePages', response, "No rangePages provided in response")
+        self.assertGreater(response['rangePages']['entries'], 0,
+                           "Symbol range pages should be held in memory")
+        frames = sum(len(stack) for stack in json.loads(JSONrequest)['stacks'])
+        self.assertLessEqual(response['hits'] + response['misses'], 2 * frames,
+                             "Only frames should count towards the symbol cache statistics")
+
+        request = {
+            "debug": True,
+            "action": "symbolCacheFlush"
+        }
+        response = testUtils.symServerRequest(json.dumps(request), ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertTrue(response['success'], "Flush request unsuccessful")
+
+        response = testUtils.symServerRequest(statsRequest, ip="127.0.0.1",
+                                              port=self.config['SymServer']['port'])
+        response = testUtils.verifyGenericResponse(self, response)
+        self.assertEqual(response['entries'], 0, "Symbol cache should be empty after a flush")
+        self.assertEqual(response['rangePages']['entries'], 0,
+                         "Range page cache should be empty after a flush")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import time
+import tornado.gen
+import tornado.testing
+
+import testUtils
+testUtils.addSnappyToPath()
+from SymServer_Symbolicator import Symbolicator, Cancellation
+
+MODULE = ("test.pdb", "ABC")
+FRAME = ("test.pdb/ABC/4096", MODULE, 4096)
+SYMBOL = "func(int) (in test.pdb)"
+
+
+class SlowDiskCacheClient:
+    """ Takes |delay| seconds to resolve a frame. Like DiskCache, it responds
+    with what it has when the deadline of a request passes.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self.queries = 0
+        self.aborts = 0
+
+    @tornado.gen.coroutine
+    def query(self, requestData, id, deadline=None, abort=None):
+        self.queries += 1
+        start = time.time()
+        end = start + self.delay
+        if deadline is not None:
+            end = min(end, deadline)
+        while time.time() < end:
+            if abort and abort.isAborted():
+                self.aborts += 1
+                raise tornado.gen.Return(None)
+            yield tornado.gen.sleep(0.01)
+        resolved = time.time() - start >= self.delay
+        frames = requestData['stacks'][0]
+        raise tornado.gen.Return({
+            'symbolicatedStacks': [[SYMBOL if resolved else "0x1000 (in test.pdb)"
+                                    for frame in frames]],
+            'symbolRanges': [[None for frame in frames]],
+            'knownModules': [resolved] * len(requestData['memoryMap'])
+        })
+
+
+class SymServerCoalescing(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(SymServerCoalescing, self).setUp()
+        self.symbolicator = Symbolicator()
+        self.client = SlowDiskCacheClient(0.5)
+        self.symbolicator.diskCacheClient = self.client
+
+    @tornado.testing.gen_test
+    def test_joinLaterDeadline(self):
+        # A request without a deadline shares the fetch of one that has one
+        first = self.symbolicator.resolveFromDiskCache([FRAME], "first", None)
+        yield tornado.gen.sleep(0.1)
+        second = self.symbolicator.resolveFromDiskCache([FRAME], "second",
+                                                        time.time() + 0.2)
+        firstSymbols, firstFetched = yield first
+        secondSymbols, secondFetched = yield second
+        self.assertEqual(self.client.queries, 1, "The fetch should have been shared")
+        self.assertEqual(firstSymbols, {FRAME[0]: SYMBOL})
+        self.assertEqual(secondSymbols, {}, "The second request's deadline passed first")
+
+    @tornado.testing.gen_test
+    def test_noJoinEarlierDeadline(self):
+        # A fetch that stops at an earlier deadline must not cut short a
+        # request that has more time
+        first = self.symbolicator.resolveFromDiskCache([FRAME], "first", time.time() + 0.2)
+        yield tornado.gen.sleep(0.1)
+        second = self.symbolicator.resolveFromDiskCache([FRAME], "second", None)
+        firstSymbols, firstFetched = yield first
+        secondSymbols, secondFetched = yield second
+        self.assertEqual(self.client.queries, 2, "The frame should have been fetched again")
+        self.assertEqual(firstSymbols, {}, "The first request's deadline passed")
+        self.assertEqual(secondSymbols, {FRAME[0]: SYMBOL},
+                         "The second request should not get the first one's partial result")
+        self.assertEqual(self.symbolicator.inFlight, {})
+
+    @tornado.testing.gen_test
+    def test_cancel(self):
+        cancelled = Cancellation()
+        first = self.symbolicator.resolveFromDiskCache([FRAME], "first", None, cancelled)
+        yield tornado.gen.sleep(0.1)
+        cancelled.set()
+        start = time.time()
+        symbols, fetched = yield first
+        self.assertLess(time.time() - start, 0.1, "The request should stop waiting at once")
+        self.assertEqual(symbols, {})
+        yield tornado.gen.sleep(0.1)
+        self.assertEqual(self.client.aborts, 1, "The fetch should have been aborted")
+        self.assertEqual(self.symbolicator.inFlight, {})
+
+    @tornado.testing.gen_test
+    def test_cancelShared(self):
+        # A fetch that another request is waiting for is not aborted
+        cancelled = Cancellation()
+        first = self.symbolicator.resolveFromDiskCache([FRAME], "first", None, cancelled)
+        second = self.symbolicator.resolveFromDiskCache([FRAME], "second", None)
+        yield tornado.gen.sleep(0.1)
+        cancelled.set()
+        firstSymbols, firstFetched = yield first
+        secondSymbols, secondFetched = yield second
+        self.assertEqual(self.client.queries, 1, "The fetch should have been shared")
+        self.assertEqual(self.client.aborts, 0)
+        self.assertEqual(firstSymbols, {})
+        self.assertEqual(secondSymbols, {FRAME[0]: SYMBOL})
+
+        # Nor one that is waited for by the request that started it
+        cancelled = Cancellation()
+        first = self.symbolicator.resolveFromDiskCache([FRAME], "first", None)
+        second = self.symbolicator.resolveFromDiskCache([FRAME], "second", None, cancelled)
+        yield tornado.gen.sleep(0.1)
+        cancelled.set()
+        firstSymbols, firstFetched = yield first
+        self.assertEqual(self.client.aborts, 0)
+        self.assertEqual(firstSymbols, {FRAME[0]: SYMBOL})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+import testUtils
+testUtils.addSnappyToPath()
+from DiskCache_SymbolIndex import (SymbolIndex, SymMapBuilder, RawSymbolLookup, writeSymbolIndex,
+                                   upgradeSymMapV1, symbolEnd, MAGIC)
+
+# Maps each address to |size, symbol|
+SYM_MAP = {
+    0x1000: (0x10, "first"),
+    0x1020: (0, "public"),
+    0x1080: (0x100, "overlapsNext"),
+    0x1100: (0x8, "last"),
+}
+
+
+def makeIndex(symMap):
+    fp = StringIO()
+    writeSymbolIndex(fp, symMap)
+    return fp.getvalue()
+
+
+class testSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        self.data = makeIndex(SYM_MAP)
+        self.index = SymbolIndex(self.data)
+
+    def test_roundTrip(self):
+        self.assertEqual(len(self.index), len(SYM_MAP))
+        addresses = sorted(SYM_MAP)
+        for i, address in enumerate(addresses):
+            self.assertEqual(self.index.address(i), address)
+            self.assertEqual((self.index.size(i), self.index.symbol(i)), SYM_MAP[address])
+
+    def test_empty(self):
+        index = SymbolIndex(makeIndex({}))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.lookup([0, 0x1000]), {})
+
+    def test_open(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, "index")
+            with open(path, 'wb') as fp:
+                writeSymbolIndex(fp, SYM_MAP)
+            index = SymbolIndex.open(path)
+            try:
+                self.assertEqual(index.lookup([0x1004]), {0x1004: ("first", 0x1000, 0x1010)})
+            finally:
+                index.close()
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, SymbolIndex, "DiskCache v.1\n" + self.data[len(MAGIC):])
+        self.assertRaises(ValueError, SymbolIndex, "")
+        # Cut off in the header, in the arrays and in the string table
+        for length in (len(MAGIC) + 4, len(MAGIC) + 16, len(self.data) - 1):
+            self.assertRaises(ValueError, SymbolIndex, self.data[:length])
+
+    def test_symbolRange(self):
+        # The first symbol ends at its size, before the next symbol
+        self.assertEqual(self.index.symbolRange(0), (0x1000, 0x1010))
+        # A symbol without a size extends to the next symbol
+        self.assertEqual(self.index.symbolRange(1), (0x1020, 0x1080))
+        # A symbol is cut off by the next one even if its size reaches further
+        self.assertEqual(self.index.symbolRange(2), (0x1080, 0x1100))
+        # The last symbol ends at its size
+        self.assertEqual(self.index.symbolRange(3), (0x1100, 0x1108))
+
+        index = SymbolIndex(makeIndex({0x10: (0, "only")}))
+        self.assertEqual(index.symbolRange(0), (0x10, None),
+                         "The end of a last symbol without a size is not known")
+
+    def test_symbolEnd(self):
+        self.assertEqual(symbolEnd(0x10, 0x8, None), 0x18)
+        self.assertEqual(symbolEnd(0x10, 0x8, 0x14), 0x14)
+        self.assertEqual(symbolEnd(0x10, 0x8, 0x20), 0x18)
+        self.assertEqual(symbolEnd(0x10, 0, 0x20), 0x20)
+        self.assertIsNone(symbolEnd(0x10, 0, None))
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup([0xfff, 0x1000, 0x1010, 0x10ff, 0x1100, 0x2000]), {
+            0x1000: ("first", 0x1000, 0x1010),
+            # Past the end of "first", but there is nothing else to resolve it to
+            0x1010: ("first", 0x1000, 0x1010),
+            0x10ff: ("overlapsNext", 0x1080, 0x1100),
+            0x1100: ("last", 0x1100, 0x1108),
+            0x2000: ("last", 0x1100, 0x1108),
+        })
+
+
+def makeSymbolFile(symbolCount):
+    """ Returns the text of a symbol file with FUNC and PUBLIC records in no
+    particular order, some of which share their address
+    """
+    lines = ["MODULE windows x86_64 0123456789ABCDEF0123456789ABCDEF0 random.pdb",
+             "FILE 0 random.cpp"]
+    for index in xrange(symbolCount):
+        address = random.randint(0x1000, 0x2000)
+        if random.random() < 0.2:
+            lines.append("PUBLIC {:x} 0 public_{}".format(address, index))
+        else:
+            size = random.choice([0, random.randint(1, 0x40)])
+            lines.append("FUNC {:x} {:x} 0 function_{}".format(address, size, index))
+            lines.append("{:x} 4 1 0".format(address))
+    return "\n".join(lines) + "\n"
+
+
+class testRawSymbolLookup(unittest.TestCase):
+    def test_matchesSymbolIndex(self):
+        random.seed(0)
+        for attempt in xrange(20):
+            text = makeSymbolFile(random.randint(0, 300))
+            offsets = [random.randint(0xf00, 0x2100) for i in xrange(random.randint(1, 100))]
+            builder = SymMapBuilder("random.pdb")
+            raw = RawSymbolLookup("random.pdb", offsets)
+            # Chunks that split lines
+            for start in xrange(0, len(text), 100):
+                builder.write(text[start:start + 100])
+                raw.write(text[start:start + 100])
+            index = SymbolIndex(makeIndex(builder.finish()))
+            self.assertEqual(raw.finish(), index.lookup(offsets))
+
+    def test_duplicateAddresses(self):
+        offsets = [0x1000, 0x2000]
+        text = ("FUNC 1000 10 0 firstFunc\nFUNC 1000 20 0 lastFunc\n"
+                "FUNC 2000 10 0 func\nPUBLIC 2000 0 firstPublic\nPUBLIC 2000 0 lastPublic\n"
+                "FUNC 2000 10 0 laterFunc\n")
+        raw = RawSymbolLookup("duplicates.pdb", offsets)
+        raw.write(text)
+        expected = {
+            0x1000: ("lastFunc", 0x1000, 0x1020),
+            0x2000: ("lastPublic", 0x2000, None),
+        }
+        self.assertEqual(raw.finish(), expected)
+        builder = SymMapBuilder("duplicates.pdb")
+        builder.write(text)
+        self.assertEqual(SymbolIndex(makeIndex(builder.finish())).lookup(offsets), expected)
+
+
+class testUpgradeSymMapV1(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, "symbols")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_upgrade(self):
+        with open(self.path, 'wb') as fp:
+            # Addresses were written with hex(), which adds an "L" to longs
+            fp.write("DiskCache v.1\n0x1fffffffffL with spaces\n0x1020 public\n0x1000 first\n")
+        upgradeSymMapV1(self.path)
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        self.assertEqual(data, makeIndex({
+            0x1000: (0, "first"),
+            0x1020: (0, "public"),
+            0x1fffffffff: (0, "with spaces"),
+        }))
+        self.assertEqual(os.listdir(self.tempDir), ["symbols"],
+                         "The temporary file should be replaced")
+
+
+if __name__ == '__main__':
+    unittest.main()
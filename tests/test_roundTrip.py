@@ -90,5 +90,16 @@ class RoundTrip(unittest.TestCase):
                                               port=self.config['SymServer']['port'])
         self.assertEqual(response['code'], 400, "HTTP Status code should be 400")
 
+    def test_status(self):
+        for server in ('SymServer', 'DiskCache'):
+            response = testUtils.statusRequest(ip="127.0.0.1",
+                                               port=self.config[server]['port'])
+            self.assertEqual(response['code'], 200,
+                             "{} should not be saturated".format(server))
+            for key in ('queuedRequests', 'maxQueuedRequests', 'shedRequests',
+                        'drainRatePerSec', 'saturated'):
+                self.assertIn(key, response['data'],
+                              "No {} provided in {} status".format(key, server))
+
 if __name__ == '__main__':
     unittest.main()